@@ -0,0 +1,94 @@
+import docular
+from django.db.models import Count, Sum, Avg, Min, Max
+from django.db.models.query import QuerySet
+from apimas.components import ProcessorConstruction
+from apimas.errors import InvalidInput, AccessDeniedError
+from apimas_django.filtering import FilteringProcessor, FILTERING_CONSTRUCTORS
+
+
+FUNCTIONS = {
+    'sum': Sum,
+    'avg': Avg,
+    'min': Min,
+    'max': Max,
+}
+
+
+class AggregateProcessor(FilteringProcessor):
+    """
+    Compute aggregates of a collection in the database.
+
+    The (filtered) collection is grouped by the values of the fields given
+    by the `group_by` parameter, and the functions given by the `aggregate`
+    parameter (by default `count`) are computed per group, in one query.
+    Only filterable fields may be grouped by or aggregated.
+    """
+    READ_KEYS = {
+        'queryset': 'backend/filtered_response',
+        'group_by': 'imported/group_by',
+        'aggregates': 'imported/aggregates',
+        'read_check': 'permissions/read/check',
+    }
+
+    WRITE_KEYS = (
+        'backend/aggregates',
+    )
+
+    def get_source(self, path):
+        _, source = self.prepare_filter(path)
+        return source
+
+    def get_annotations(self, aggregates):
+        annotations = {}
+        for i, (function, path) in enumerate(aggregates):
+            if function == 'count':
+                expression = Count('pk', distinct=True)
+            else:
+                expression = FUNCTIONS[function](self.get_source(path))
+            annotations['aggregate%d' % i] = expression
+        return annotations
+
+    def execute(self, context_data):
+        queryset = context_data['queryset']
+        if queryset is None:
+            return
+
+        if not isinstance(queryset, QuerySet):
+            msg = 'A queryset is expected, {!r} found'
+            raise InvalidInput(msg.format(type(queryset)))
+
+        # read checks apply to instances, not to aggregates of them
+        if context_data['read_check'] is not None:
+            raise AccessDeniedError(
+                'You do not have permission to aggregate this collection')
+
+        group_by = context_data['group_by'] or []
+        aggregates = context_data['aggregates'] or [('count', None)]
+        sources = [self.get_source(path) for path in group_by]
+        annotations = self.get_annotations(aggregates)
+
+        # aggregate over the matched rows, not over the joins of the filters
+        objects = queryset.model.objects.filter(pk__in=queryset.values('pk'))
+        if sources:
+            rows = objects.values(*sources).annotate(
+                **annotations).order_by(*sources)
+        else:
+            rows = [objects.aggregate(**annotations)]
+
+        results = []
+        for row in rows:
+            result = {'group': {}}
+            for path, source in zip(group_by, sources):
+                docular.doc_set(result['group'], path, row[source])
+            for i, (function, path) in enumerate(aggregates):
+                value = row['aggregate%d' % i]
+                if path is None:
+                    result[function] = value
+                else:
+                    docular.doc_set(
+                        result.setdefault(function, {}), path, value)
+            results.append(result)
+        return (results,)
+
+
+Aggregate = ProcessorConstruction(FILTERING_CONSTRUCTORS, AggregateProcessor)
@@ -0,0 +1,56 @@
+from django.db.models import Count, Sum, Avg, Min, Max, Exists, OuterRef, \
+    Subquery, Prefetch, IntegerField, FloatField
+from apimas.errors import InvalidInput
+
+
+AGGREGATES = {
+    'count': (Count, IntegerField),
+    'sum': (Sum, FloatField),
+    'avg': (Avg, FloatField),
+    'min': (Min, FloatField),
+    'max': (Max, FloatField),
+}
+
+FUNCTIONS = tuple(sorted(AGGREGATES)) + ('exists',)
+
+
+def check_function(function):
+    if function not in FUNCTIONS:
+        raise InvalidInput("Unknown annotation function '%s'" % function)
+
+
+def get_expression(model, function, over):
+    """
+    Make the expression computing an annotation field for each row of a
+    model, from the related rows at a (dotted) relation path.
+
+    The value is computed by a subquery correlated to the row, so that it is
+    not affected by the joins of filters on the annotated query.
+    """
+    lookup = over.replace('.', '__')
+    rows = model.objects.filter(pk=OuterRef('pk')).order_by()
+    if function == 'exists':
+        return Exists(rows.filter(**{lookup + '__isnull': False}))
+
+    aggregate, output_field = AGGREGATES[function]
+    values = rows.annotate(value=aggregate(lookup)).values('value')
+    return Subquery(values, output_field=output_field())
+
+
+def annotate(objects, annotations):
+    """
+    Add the annotation fields of a collection to a queryset.
+
+    `annotations` maps field names to (alias, function, relation path).
+    """
+    expressions = {}
+    for alias, function, over in annotations.itervalues():
+        expressions[alias] = get_expression(objects.model, function, over)
+    if not expressions:
+        return objects
+    return objects.annotate(**expressions)
+
+
+def prefetch_annotated(source, model, annotations):
+    return Prefetch(source, queryset=annotate(model.objects.all(),
+                                              annotations))
@@ -0,0 +1,174 @@
+from django.conf.urls import url
+from django.db import transaction
+from django.http import QueryDict
+from django.core.urlresolvers import resolve, Resolver404
+from django.views.decorators.http import require_http_methods
+from django.views.decorators.csrf import csrf_exempt
+from apimas.errors import GenericException, ValidationError, NotFound, \
+    MethodNotAllowed
+from apimas_django import wrapper
+import docular
+
+JSON = 'application/json'
+
+
+def get_operations(body):
+    """
+    Read the operations of a batch request.
+
+    The body must be a JSON array of objects with a `method`, a `path`
+    (absolute, optionally with a query string) and an optional `body`.
+    """
+    if not isinstance(body, list):
+        raise ValidationError('Batch requests must be an array of operations')
+
+    operations = []
+    for operation in body:
+        if not isinstance(operation, dict) or \
+           not isinstance(operation.get('method'), basestring) or \
+           not isinstance(operation.get('path'), basestring):
+            raise ValidationError(
+                "Batch operations must have a 'method' and a 'path'")
+        operations.append((operation['method'].upper(), operation['path'],
+                           operation.get('body')))
+    return operations
+
+
+def resolve_action(method, path):
+    """
+    Find the ApimasAction that serves an operation.
+
+    Returns the action and the keyword arguments of its URL pattern.
+    """
+    try:
+        match = resolve(path)
+    except Resolver404:
+        raise NotFound('No resource found at %s' % path)
+
+    load_actions = getattr(match.func, 'load_actions', None)
+    if load_actions is None:
+        raise NotFound('No resource found at %s' % path)
+
+    action = load_actions().get(method)
+    if action is None:
+        raise MethodNotAllowed('Method %s not allowed at %s' % (method, path))
+    return action, match.kwargs
+
+
+def error_response(exc):
+    return {
+        'content': {'details': exc.message},
+        'meta': {
+            'content_type': JSON,
+            'status_code': exc.http_code,
+        },
+    }
+
+
+def execute_operation(request, batch, method, path, body):
+    """
+    Run an operation of a batch request with its ApimasAction.
+
+    The operation is given the headers of the batch request and the state
+    shared by the operations of the batch, so that authentication and user
+    retrieval are done once per batch.
+    """
+    path, _, query = path.partition('?')
+    try:
+        action, kwargs = resolve_action(method, path)
+    except GenericException as exc:
+        return error_response(exc)
+
+    apimas_request = {
+        'content': {} if body is None else body,
+        'native': request,
+        'meta': {
+            'params': QueryDict(query),
+            'files': {},
+            'headers': wrapper.get_headers(request),
+            'kwargs': kwargs,
+            'batch': batch,
+        },
+    }
+    return action.process(apimas_request)
+
+
+def export_response(response):
+    meta = response['meta']
+    return {
+        'status': meta['status_code'],
+        'headers': meta.get('headers') or {},
+        'body': response.get('content'),
+    }
+
+
+def run_operations(request, operations, atomic):
+    """
+    Run the operations of a batch request in order.
+
+    Returns the status of the batch response and the responses of the
+    operations. If `atomic` is true, the operations run in one transaction:
+    the first failed operation rolls back all of them, the rest are not run
+    and its status is the status of the batch response.
+    """
+    batch = {}
+    responses = []
+    if not atomic:
+        for operation in operations:
+            responses.append(execute_operation(request, batch, *operation))
+        return 200, responses
+
+    with transaction.atomic():
+        for operation in operations:
+            response = execute_operation(request, batch, *operation)
+            responses.append(response)
+            status = response['meta']['status_code']
+            if status >= 400:
+                transaction.set_rollback(True)
+                return status, responses
+    return 200, responses
+
+
+def batch_view(atomic):
+    def view(request):
+        """
+        Run the operations of a batch request; respond with an array of
+        their responses, each with a `status`, `headers` and `body`.
+        """
+        try:
+            body = wrapper.load_application_json_body(request.body)
+            operations = get_operations(body)
+        except GenericException as exc:
+            return wrapper.create_native_response(error_response(exc))
+
+        status, responses = run_operations(request, operations, atomic)
+        return wrapper.create_native_response({
+            'content': [export_response(response) for response in responses],
+            'meta': {
+                'content_type': JSON,
+                'status_code': status,
+            },
+        })
+    return view
+
+
+def get_batch_config(spec):
+    """
+    Read the batch endpoint configuration of an apimas app spec.
+
+    The endpoint is served at `:batch_url`, if given; its operations run in
+    one transaction if `:batch_atomic` is true.
+    """
+    batch_url = docular.doc_spec_get(spec, ':batch_url')
+    atomic = bool(docular.doc_spec_get(spec, ':batch_atomic'))
+    return batch_url, atomic
+
+
+def mk_batch_urls(batch_url, atomic):
+    if not batch_url:
+        return []
+
+    urlpattern = r'^' + batch_url.strip('/') + '/$'
+    django_view = csrf_exempt(require_http_methods(['POST'])(
+        batch_view(atomic)))
+    return [url(urlpattern, django_view)]
@@ -0,0 +1,315 @@
+import hashlib
+from django.db.models import Model
+from django.utils.http import parse_http_date_safe
+from apimas import utils
+from apimas.components import BaseProcessor, ProcessorConstruction
+from apimas.components.permissions import mk_collection_path
+from apimas.errors import InvalidInput, NotModified
+from apimas_django.execution import RESPONSE_READY
+from apimas_django.handlers import _django_base_construction, \
+    get_written_models, get_annotated_models, get_ancestor_models
+from apimas_django.permissions import NO_CONSTRUCTORS
+from apimas_django.validators import is_not_modified
+
+CACHE_KEY = 'backend/cache_key'
+
+FRAGMENTS = 'backend/fragments'
+
+CACHED_HEADERS = ('ETag', 'Last-Modified', 'Cache-Control')
+
+
+def freeze_fields(fields):
+    if not isinstance(fields, dict):
+        return True
+    return tuple(sorted((key, freeze_fields(value))
+                        for key, value in fields.iteritems()))
+
+
+def normalize_params(params):
+    if hasattr(params, 'lists'):
+        items = params.lists()
+    else:
+        items = params.iteritems()
+    return tuple(sorted((key, tuple(values) if isinstance(
+        values, list) else values) for key, values in items))
+
+
+def get_cache_owner(context_data):
+    """
+    Get the role and, if the rules filter or check the resources per user,
+    the user that cached content is kept for, or `None` if it must not be
+    cached, since such rules apply without a user.
+    """
+    user = None
+    if context_data['read_filter'] is not None or \
+       context_data['read_check'] is not None:
+        user = getattr(context_data['user'], 'pk', None)
+        if user is None:
+            return None
+    return context_data['role'], user
+
+
+class ResponseCacheProcessor(BaseProcessor):
+    """
+    Serve the responses of a read action from a cache.
+
+    A collection opts in with `:response_cache`, the import path of a
+    `apimas.cache.ResponseCache` backend. Responses are keyed by the URL
+    and parameters of the request, the role and readable fields of the
+    user and, if the rules filter or check the resources per user, the user
+    itself. Keys also carry the generations of the models the collection is
+    read from, which its write handlers advance, of the models its
+    annotation fields are computed from and of the models of the
+    collections it is nested in. The collections that write these models
+    must use the same cache, so that their writes advance them as well.
+
+    On a hit the response is completed and the rest of the processors are
+    skipped; on a miss, the response is stored by the `response_cache_store`
+    processor at the end of the action. Requests that expand refs are not
+    cached, since they read other collections.
+    """
+    READ_KEYS = {
+        'params': 'request/meta/params',
+        'kwargs': 'request/meta/kwargs',
+        'headers': 'request/meta/headers',
+        'role': 'auth/role',
+        'user': 'auth/user',
+        'can_read': 'permissions/read/enabled',
+        'read_fields': 'permissions/read/fields',
+        'read_filter': 'permissions/read/filter',
+        'read_check': 'permissions/read/check',
+    }
+
+    WRITE_KEYS = {
+        'key': CACHE_KEY,
+        'content': 'response/content',
+        'status_code': 'response/meta/status_code',
+        'headers': 'response/meta/headers',
+        'ready': RESPONSE_READY,
+    }
+
+    def __init__(self, collection_loc, action_name, spec, response_cache):
+        self.cache = utils.import_object(response_cache) \
+            if response_cache else None
+        if self.cache is None:
+            return
+        self.prefix = (mk_collection_path(collection_loc), action_name)
+        self.names = get_written_models(spec['plan']) + \
+            get_annotated_models(spec) + get_ancestor_models(
+                spec['model'], spec['bounds'])
+
+    def get_key(self, context_data):
+        params = normalize_params(context_data['params'] or {})
+        if any(key == 'expand' for key, _ in params):
+            return None
+
+        owner = get_cache_owner(context_data)
+        if owner is None:
+            return None
+
+        kwargs = tuple(sorted((context_data['kwargs'] or {}).iteritems()))
+        key = (self.prefix, kwargs, params, owner,
+               freeze_fields(context_data['read_fields']),
+               tuple(self.cache.generations(self.names)))
+        return hashlib.sha1(repr(key)).hexdigest()
+
+    def process(self, context):
+        if self.cache is None:
+            return
+
+        context_data = self.read(context)
+        if not context_data['can_read']:
+            return
+        key = self.get_key(context_data)
+        if key is None:
+            return
+
+        cached = self.cache.get(key)
+        if cached is None:
+            self.write({'key': key}, context)
+            return
+
+        headers = cached['headers']
+        self.write({
+            'content': cached['content'],
+            'status_code': cached['status_code'],
+            'headers': dict(headers),
+            'ready': True,
+        }, context)
+        last_modified = headers.get('Last-Modified')
+        if last_modified is not None:
+            last_modified = parse_http_date_safe(last_modified)
+        if is_not_modified(context_data['headers'] or {},
+                           headers.get('ETag'), last_modified):
+            raise NotModified('Not modified')
+
+
+ResponseCache = _django_base_construction(ResponseCacheProcessor)
+
+
+class ResponseCacheStoreProcessor(BaseProcessor):
+    """
+    Store the response of a read action in the cache, under the key given
+    by the `response_cache` processor.
+    """
+    READ_KEYS = {
+        'key': CACHE_KEY,
+        'content': 'response/content',
+        'status_code': 'response/meta/status_code',
+        'headers': 'response/meta/headers',
+    }
+
+    def __init__(self, collection_loc, action_name, response_cache):
+        self.cache = utils.import_object(response_cache) \
+            if response_cache else None
+
+    def process(self, context):
+        if self.cache is None:
+            return
+
+        context_data = self.read(context)
+        key = context_data['key']
+        if key is None:
+            return
+        headers = context_data['headers'] or {}
+        self.cache.set(key, {
+            'content': context_data['content'],
+            'status_code': context_data['status_code'],
+            'headers': {name: headers[name] for name in CACHED_HEADERS
+                        if name in headers},
+        })
+
+
+ResponseCacheStore = ProcessorConstruction(
+    NO_CONSTRUCTORS, ResponseCacheStoreProcessor)
+
+
+class FragmentCacheProcessor(BaseProcessor):
+    """
+    Look up the exported representations of the rows of a listing in a
+    cache, so that only the rows missing from it are serialized.
+
+    A collection opts in with `:fragment_cache`, the import path of a
+    `apimas.cache.ResponseCache` backend. It also needs a column that
+    changes on every write of a row: `:version_field` or else the
+    `changes_column` of the collection. Fragments are keyed by the primary
+    key and version of the row, the role and readable fields of the user
+    and, if the rules filter or check the resources per user, the user
+    itself; such fragments are not cached for requests without a user.
+    Keys also carry the generations of the other models the collection is
+    read from, such as those of its subcollections, which its write
+    handlers advance, and of the models its annotation fields are computed
+    from, whose values change without the version of the row.
+
+    The rows found are skipped by `instance_to_dict` and `export_data`;
+    the `fragment_cache_store` processor assembles the page and stores the
+    rest. Requests that expand refs are not cached.
+    """
+    READ_KEYS = {
+        'instances': 'backend/checked_response',
+        'expand': 'imported/expand',
+        'role': 'auth/role',
+        'user': 'auth/user',
+        'read_fields': 'permissions/read/fields',
+        'read_filter': 'permissions/read/filter',
+        'read_check': 'permissions/read/check',
+        'selected_fields': 'imported/fields',
+    }
+
+    WRITE_KEYS = {
+        'fragments': FRAGMENTS,
+    }
+
+    def __init__(self, collection_loc, action_name, spec, fragment_cache,
+                 version_field):
+        self.cache = utils.import_object(fragment_cache) \
+            if fragment_cache else None
+        if self.cache is None:
+            return
+        version_field = version_field or spec['changes_column']
+        if version_field is None:
+            raise InvalidInput(
+                "':fragment_cache' requires a ':version_field' or a "
+                "'changes_column' for collection '%s'" % collection_loc[-1])
+        model = spec['model']
+        self.version = model._meta.get_field(version_field)
+        self.prefix = mk_collection_path(collection_loc)
+        written = set(get_written_models(spec['plan']))
+        written.discard(model._meta.label)
+        self.names = tuple(sorted(written.union(get_annotated_models(spec))))
+
+    def process(self, context):
+        if self.cache is None:
+            return
+
+        context_data = self.read(context)
+        instances = context_data['instances']
+        if instances is None or isinstance(instances, Model) or \
+           context_data['expand']:
+            return
+        owner = get_cache_owner(context_data)
+        if owner is None:
+            return
+
+        fields = context_data['selected_fields']
+        if fields is None:
+            fields = context_data['read_fields']
+        prefix = (self.prefix, owner, freeze_fields(fields),
+                  tuple(self.cache.generations(self.names)))
+        keys = [hashlib.sha1(repr(prefix + (
+            instance.pk, self.version.value_to_string(instance)))).hexdigest()
+            for instance in instances]
+        fragments = zip(keys, self.cache.get_many(keys))
+        self.write({'fragments': fragments}, context)
+
+
+FragmentCache = _django_base_construction(FragmentCacheProcessor)
+
+
+class FragmentCacheStoreProcessor(BaseProcessor):
+    """
+    Assemble a listing from the cached fragments of its rows and the rows
+    serialized in this request, storing the latter in the cache.
+    """
+    READ_KEYS = {
+        'fragments': FRAGMENTS,
+        'content': 'response/content',
+        'meta': 'exportable/meta',
+    }
+
+    WRITE_KEYS = (
+        'response/content',
+    )
+
+    def __init__(self, collection_loc, action_name, fragment_cache):
+        self.cache = utils.import_object(fragment_cache) \
+            if fragment_cache else None
+
+    def process(self, context):
+        if self.cache is None:
+            return
+
+        context_data = self.read(context)
+        fragments = context_data['fragments']
+        content = context_data['content']
+        if fragments is None or content is None:
+            return
+
+        exported = iter(content['results'] if context_data['meta']
+                        else content)
+        results = []
+        for key, fragment in fragments:
+            if fragment is None:
+                fragment = next(exported)
+                self.cache.set(key, fragment)
+            results.append(fragment)
+
+        if context_data['meta']:
+            content['results'] = results
+        else:
+            content = results
+        self.write((content,), context)
+
+
+FragmentCacheStore = ProcessorConstruction(
+    NO_CONSTRUCTORS, FragmentCacheStoreProcessor)
@@ -0,0 +1,228 @@
+import base64
+import json
+from datetime import timedelta
+from django.core import exceptions
+from django.db import models, transaction
+from django.db.models import Max, Min, Q
+from django.db.models.query import QuerySet
+from django.utils.timezone import now
+from apimas.components import BaseProcessor
+from apimas.errors import InvalidInput, ResyncRequired, ValidationError
+from apimas_django.handlers import _django_base_construction, \
+    get_model_field, get_parent_pk
+from apimas_django.models import Tombstone, TombstoneHorizon
+
+
+DEFAULT_LIMIT = 100
+
+DEFAULT_LAG = 5
+
+
+def encode_cursor(value, pk, tombstone):
+    return base64.urlsafe_b64encode(json.dumps([value, pk, tombstone]))
+
+
+def decode_cursor(cursor):
+    """
+    Read the position of a change feed cursor: the change column value and
+    primary key of the last changed resource seen, and the id of the last
+    tombstone seen.
+    """
+    try:
+        value, pk, tombstone = json.loads(
+            base64.urlsafe_b64decode(cursor.encode('ascii')))
+        tombstone = int(tombstone)
+    except (TypeError, ValueError, UnicodeError):
+        raise ValidationError('Invalid change feed cursor')
+    return value, pk, tombstone
+
+
+def prune_tombstones(before):
+    """
+    Remove the tombstones of resources deleted before the given time;
+    return the number of tombstones removed.
+
+    The latest tombstone pruned is recorded per collection, so that the
+    change feeds of cursors that have not read past it ask for a resync.
+    """
+    with transaction.atomic():
+        pruned = Tombstone.objects.filter(deleted_at__lt=before)
+        horizons = dict(pruned.order_by().values_list(
+            'collection').annotate(Max('id')))
+        if not horizons:
+            return 0
+        for collection, pruned_id in horizons.iteritems():
+            horizon, created = TombstoneHorizon.objects.select_for_update(
+            ).get_or_create(collection=collection,
+                            defaults={'pruned_id': pruned_id})
+            if not created and horizon.pruned_id < pruned_id:
+                horizon.pruned_id = pruned_id
+                horizon.save()
+        count, _ = pruned.filter(id__lte=max(horizons.values())).delete()
+    return count
+
+
+def is_integer_field(field):
+    return isinstance(field, (models.AutoField, models.IntegerField))
+
+
+class ChangesProcessor(BaseProcessor):
+    """
+    Select the resources of a collection changed since a cursor, along with
+    the keys of the resources deleted since then.
+
+    The collection declares the column that holds the modification time of
+    its resources with `changes_column`; it must be updated on every write,
+    e.g. with `auto_now`. Deleted resources are read from the tombstones of
+    the collection.
+
+    Changed resources are ordered by the column and then by primary key, so
+    that the `since` cursor marks a unique position in the feed. At most
+    `limit` changed and `limit` deleted resources are returned per request;
+    the response carries the cursor to continue from as `next`, and `more`
+    tells whether there are more changes.
+
+    Change column values and tombstone ids are assigned when a write is
+    made, not when it commits, so a write may become visible after later
+    ones have been read past. The feed therefore stops short of the changes
+    of the last `:changes_lag` seconds (5 by default): writes that commit
+    within the lag are not missed, though longer transactions may still be.
+    Changed resources are held back only if the change column holds
+    date-times.
+
+    Tombstones are pruned with `prune_tombstones`; cursors that have not
+    read past the pruned tombstones of the collection get 410 Gone, and
+    must read the feed anew, without `since`.
+
+    Tombstones cannot be matched against the read rules of a role, so
+    deletions are only reported, as `deleted`, to roles that may read every
+    resource of the collection; for the rest, `deleted` is `null`.
+    """
+    READ_KEYS = {
+        'queryset': 'backend/filtered_response',
+        'since': 'imported/since',
+        'pagination': 'imported/pagination',
+        'kwargs': 'request/meta/kwargs',
+        'read_filter': 'permissions/read/filter',
+        'read_check': 'permissions/read/check',
+    }
+
+    WRITE_KEYS = (
+        'backend/filtered_response',
+        'exportable/meta/deleted',
+        'exportable/meta/next',
+        'exportable/meta/more',
+    )
+
+    def __init__(self, collection_loc, action_name, spec,
+                 pagination_default_limit, changes_lag):
+        column = spec['changes_column']
+        if column is None:
+            raise InvalidInput(
+                "'changes_column' not specified for collection '%s'" %
+                collection_loc[-1])
+        model = spec['model']
+        self.column = model._meta.get_field(column)
+        self.pk_field = model._meta.pk
+        self.key_field = get_model_field(model, spec['db_key'])
+        self.tombstones = spec['tombstones']
+        self.spec = spec
+        self.nested = bool(spec['bounds'])
+        self.default_limit = pagination_default_limit or DEFAULT_LIMIT
+        self.lag = timedelta(
+            seconds=DEFAULT_LAG if changes_lag is None else changes_lag)
+        self.lagged = isinstance(self.column, models.DateTimeField)
+
+    def get_limit(self, pagination):
+        if pagination is None:
+            return self.default_limit
+        offset, limit = pagination
+        if offset is not None:
+            raise ValidationError(
+                "'offset' is not supported; use the 'since' cursor")
+        return self.default_limit if limit is None else limit
+
+    def get_changed(self, queryset, value, pk, limit, cutoff):
+        column = self.column.name
+        if self.lagged:
+            queryset = queryset.filter(**{column + '__lte': cutoff})
+        if value is not None:
+            value = self.column.to_python(value)
+            pk = self.pk_field.to_python(pk)
+            queryset = queryset.filter(
+                Q(**{column + '__gt': value}) | Q(**{column: value,
+                                                      'pk__gt': pk}))
+        return list(queryset.order_by(column, 'pk')[:limit + 1])
+
+    def get_horizon(self):
+        pruned_id = TombstoneHorizon.objects.filter(
+            collection=self.tombstones).values_list(
+                'pruned_id', flat=True).first()
+        return pruned_id or 0
+
+    def get_deleted(self, tombstone, kwargs, limit, cutoff):
+        tombstones = Tombstone.objects.filter(
+            collection=self.tombstones, id__gt=tombstone)
+        if self.nested:
+            tombstones = tombstones.filter(
+                parent=unicode(get_parent_pk(self.spec, kwargs)))
+        # Tombstones are read up to the first recent one, since ids order
+        # them in the feed.
+        recent = tombstones.filter(deleted_at__gt=cutoff).aggregate(
+            first=Min('id'))['first']
+        if recent is not None:
+            tombstones = tombstones.filter(id__lt=recent)
+        return list(tombstones.order_by('id')[:limit + 1])
+
+    def export_key(self, key):
+        if self.key_field is not None and is_integer_field(self.key_field):
+            return self.key_field.to_python(key)
+        return key
+
+    def execute(self, context_data):
+        queryset = context_data['queryset']
+        if queryset is None:
+            return
+
+        if not isinstance(queryset, QuerySet):
+            msg = 'A queryset is expected, {!r} found'
+            raise InvalidInput(msg.format(type(queryset)))
+
+        restricted = context_data['read_filter'] is not None or \
+            context_data['read_check'] is not None
+        since = context_data['since']
+        if since:
+            value, pk, tombstone = decode_cursor(since)
+            if not restricted and tombstone < self.get_horizon():
+                raise ResyncRequired(
+                    'Change feed cursor has expired; read the feed anew')
+        else:
+            # Deletions before the pruned tombstones are not reported.
+            value, pk = None, None
+            tombstone = 0 if restricted else self.get_horizon()
+
+        limit = self.get_limit(context_data['pagination'])
+        cutoff = now() - self.lag
+        try:
+            changed = self.get_changed(queryset, value, pk, limit, cutoff)
+        except exceptions.ValidationError:
+            raise ValidationError('Invalid change feed cursor')
+        deleted = [] if restricted else self.get_deleted(
+            tombstone, context_data['kwargs'], limit, cutoff)
+
+        more = len(changed) > limit or len(deleted) > limit
+        changed = changed[:limit]
+        deleted = deleted[:limit]
+        if changed:
+            value = self.column.value_to_string(changed[-1])
+            pk = self.pk_field.value_to_string(changed[-1])
+        if deleted:
+            tombstone = deleted[-1].id
+
+        deleted_keys = None if restricted else [
+            self.export_key(elem.key) for elem in deleted]
+        return (changed, deleted_keys, encode_cursor(value, pk, tombstone),
+                more)
+
+
+Changes = _django_base_construction(ChangesProcessor)
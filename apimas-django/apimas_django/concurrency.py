@@ -0,0 +1,113 @@
+import hashlib
+from django.utils.encoding import force_text
+from apimas.components import BaseProcessor
+from apimas.errors import PreconditionFailed, PreconditionRequired
+from apimas_django.handlers import Condition, _django_base_construction
+
+
+def get_etag_columns(spec):
+    """
+    Get the columns that make up the ETag of a resource.
+
+    These are the readable regular fields of the collection that are stored
+    in model columns, ordered by name.
+    """
+    columns = spec['plan'].columns
+    etag_columns = []
+    for name, field_spec in sorted(spec['subfields'].iteritems()):
+        if 'noread' in field_spec.get('flags', []):
+            continue
+        field = columns.get(field_spec['source'])
+        if field is not None and field.concrete:
+            etag_columns.append(field)
+    return tuple(etag_columns)
+
+
+def compute_etag(instance, columns, version_field):
+    if version_field:
+        return '"%s"' % getattr(instance, version_field)
+    # Values are hashed in their serialized form, which is the same whether
+    # the instance has just been written or has been fetched.
+    values = tuple(
+        None if field.value_from_object(instance) is None
+        else force_text(field.value_to_string(instance))
+        for field in columns)
+    return '"%s"' % hashlib.sha1(repr(values)).hexdigest()
+
+
+def etag_matches(if_match, etag):
+    """
+    Check an `If-Match` header value against an ETag.
+
+    Comparison is strong, so weak entity tags never match.
+    """
+    if if_match.strip() == '*':
+        return True
+    return etag in [tag.strip() for tag in if_match.split(',')]
+
+
+def get_condition(instance, columns, version_field):
+    if version_field:
+        return Condition({version_field: getattr(instance, version_field)},
+                         version_field)
+    values = {}
+    for field in columns:
+        values[field.attname] = getattr(instance, field.attname)
+    return Condition(values, None)
+
+
+class OptimisticConcurrency(object):
+    """
+    Optimistic concurrency settings of a collection.
+
+    A collection opts in with `:optimistic_concurrency`. Its resources carry
+    an ETag, which is the value of the `:version_field` model column if
+    given, or else a hash of the readable columns.
+    """
+    def __init__(self, spec, optimistic_concurrency, version_field):
+        self.enabled = bool(optimistic_concurrency)
+        self.version_field = version_field
+        self.columns = get_etag_columns(spec) if self.enabled else ()
+
+    def etag(self, instance):
+        return compute_etag(instance, self.columns, self.version_field)
+
+    def condition(self, instance, if_match):
+        """
+        Check the `If-Match` header of a request against an instance.
+
+        Returns the condition under which the instance may be written.
+        """
+        if if_match is None:
+            raise PreconditionRequired(
+                'This resource requires an If-Match header')
+        if not etag_matches(if_match, self.etag(instance)):
+            raise PreconditionFailed('Resource has been modified')
+        return get_condition(instance, self.columns, self.version_field)
+
+
+class ETagProcessor(BaseProcessor):
+    READ_KEYS = {
+        'instance': 'backend/checked_response',
+    }
+
+    WRITE_KEYS = (
+        'response/meta/headers/ETag',
+    )
+
+    def __init__(self, collection_loc, action_name, spec,
+                 optimistic_concurrency, version_field):
+        self.concurrency = OptimisticConcurrency(
+            spec, optimistic_concurrency, version_field)
+
+    def process(self, context):
+        if not self.concurrency.enabled:
+            return
+
+        instance = self.read(context)['instance']
+        if instance is None or isinstance(instance, list):
+            return
+        self.write((self.concurrency.etag(instance),), context)
+
+
+ETag = _django_base_construction(ETagProcessor)
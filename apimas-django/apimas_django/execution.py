@@ -1,4 +1,5 @@
-from apimas.errors import GenericException, InvalidInput
+import itertools
+from apimas.errors import GenericException, InvalidInput, NotModified
 from docular import doc_get
 from apimas.components import Context
 from django.db import transaction
@@ -22,12 +23,23 @@ def seconds(tuple_list):
     return zip(*tuple_list)[1]
 
 
+# Set by a processor that has completed the response, e.g. from a cache;
+# the remaining processors are skipped.
+RESPONSE_READY = 'backend/response_ready'
+
+
 def run_processors(processors, context):
     for processor in processors:
+        if context.extract(RESPONSE_READY):
+            return
         processor.process(context)
 
 
 class ApimasAction(object):
+    __slots__ = ('collection', 'action_name', 'url', 'status_code',
+                 'content_type', 'before_transaction', 'in_transaction',
+                 'after_transaction')
+
     def __init__(self, collection, url, action_name, status_code, content_type,
                  transaction_begin_before, transaction_end_after, processors):
         self.collection = collection
@@ -50,9 +62,23 @@ class ApimasAction(object):
             self.in_transaction = []
             self.after_transaction = []
 
+    def iter_processors(self):
+        return itertools.chain(self.before_transaction, self.in_transaction,
+                               self.after_transaction)
+
     def handle_error(self, func, context):
         try:
             return func(context)
+        except NotModified:
+            # The response carries only the headers, e.g. its validators.
+            return {
+                'content': '',
+                'meta': {
+                    'content_type': None,
+                    'status_code': NotModified.http_code,
+                    'headers': context.extract('response/meta/headers') or {},
+                }
+            }
         except Exception as exc:
             status = exc.http_code if isinstance(exc, GenericException) \
                      else 500
@@ -89,7 +115,7 @@ class ApimasAction(object):
     def process_context(self, context):
         run_processors(self.before_transaction, context)
 
-        if self.in_transaction:
+        if self.in_transaction and not context.extract(RESPONSE_READY):
             with transaction.atomic():
                 run_processors(self.in_transaction, context)
 
@@ -0,0 +1,218 @@
+import docular
+from django.db.models import Model
+from apimas.components import BaseProcessor, ProcessorConstruction
+from apimas.components.impexp import ExportDataProcessor
+from apimas.components.permissions import PermissionsProcessor
+from apimas.converters import Nothing
+from apimas.errors import GenericException, ValidationError
+from apimas_django.annotations import annotate
+from apimas_django.batch import resolve_action
+from apimas_django.handlers import RetrieveHandlerProcessor
+from apimas_django.processors import InstanceToDictProcessor
+
+
+def no_constructor(instance):
+    pass
+
+
+def construct_ref(instance, loc):
+    source = docular.doc_spec_get(instance.get('source', {}),
+                                  default=loc[-1])
+    to = docular.doc_spec_get(instance['to'])
+    docular.doc_spec_set(instance, (source, to))
+
+
+def construct_collection(instance):
+    refs = {}
+    for name, value in docular.doc_spec_iter_values(instance['fields']):
+        if value is not None:
+            refs[name] = value
+    docular.doc_spec_set(instance, {'refs': refs})
+
+
+EXPAND_CONSTRUCTORS = docular.doc_spec_init_constructor_registry({
+    '.field.ref': construct_ref,
+    '.field.collection.django': construct_collection,
+}, default=no_constructor)
+
+
+def get_retrieve_action(to):
+    # Any resource id resolves to the retrieve action of the collection.
+    action, _ = resolve_action('GET', '/%s/_/' % to.strip('/'))
+    return action
+
+
+class ExpansionTarget(object):
+    """
+    The collection referenced by a ref field, as seen by its retrieve action.
+
+    Embedded resources are fetched, checked and exported with the
+    processors of the retrieve action of the collection, so that they are
+    served as if they were retrieved.
+    """
+    __slots__ = ('model', 'subset', 'db_key', 'annotations', 'permissions',
+                 'to_dict', 'exporter', 'expander')
+
+    def __init__(self, action):
+        self.permissions = None
+        self.to_dict = None
+        self.exporter = None
+        self.expander = None
+        handler = None
+        for processor in action.iter_processors():
+            if isinstance(processor, RetrieveHandlerProcessor):
+                handler = processor
+            elif isinstance(processor, PermissionsProcessor) and \
+                    processor.check_read:
+                self.permissions = processor
+            elif isinstance(processor, InstanceToDictProcessor):
+                self.to_dict = processor
+            elif isinstance(processor, ExportDataProcessor):
+                self.exporter = processor
+            elif isinstance(processor, ExpandProcessor):
+                self.expander = processor
+
+        if None in (handler, self.permissions, self.to_dict, self.exporter):
+            raise ValidationError(
+                'Resources of %s cannot be embedded' % action.collection)
+        self.model = handler.spec['model']
+        self.subset = handler.spec['subset']
+        self.db_key = handler.spec['db_key']
+        self.annotations = handler.spec['annotations']
+
+    def fetch(self, keys, read_filter, context):
+        """
+        Fetch the visible resources with the given keys in one query.
+        """
+        objects = self.model.objects.all()
+        if self.subset:
+            objects = objects.filter(self.subset)
+        if read_filter is not None:
+            objects = objects.filter(read_filter(context))
+        objects = annotate(objects, self.annotations)
+        if not self.db_key:
+            return objects.in_bulk(keys)
+        objects = objects.filter(**{self.db_key + '__in': keys})
+        return {getattr(obj, self.db_key): obj for obj in objects}
+
+    def export(self, instance, read_fields):
+        data = self.to_dict.to_dict(instance, self.to_dict.field_plans,
+                                    key=self.to_dict.key)
+        exported = self.exporter.converter.export_data(
+            data, read_fields, toplevel=True)
+        return None if exported is Nothing else exported
+
+
+def group_paths(paths):
+    grouped = {}
+    for path in paths:
+        grouped.setdefault(path[0], []).append(path[1:])
+    return grouped
+
+
+class ExpandProcessor(BaseProcessor):
+    """
+    Embed the resources referenced by ref fields in the response.
+
+    The ref fields to expand are given by the `expand` parameter, as a
+    comma-separated list of dotted paths through ref fields, e.g.
+    `expand=group_id.institution_id`. Paths may be at most `:expand_depth`
+    (by default 1) refs long.
+
+    A referenced resource is embedded if it is readable by the user
+    according to the permission rules of its collection; otherwise its URL
+    is kept.
+    """
+    READ_KEYS = {
+        'expand': 'imported/expand',
+        'instances': 'backend/checked_response',
+        'content': 'response/content',
+        'meta': 'exportable/meta',
+        'role': 'auth/role',
+        'batch': 'request/meta/batch',
+    }
+
+    def __init__(self, collection_loc, action_name, refs, expand_depth):
+        self.refs = refs
+        self.depth = 1 if expand_depth is None else expand_depth
+        self.targets = {}
+
+    def get_target(self, field):
+        target = self.targets.get(field)
+        if target is None:
+            _, to = self.refs[field]
+            try:
+                target = ExpansionTarget(get_retrieve_action(to))
+            except GenericException:
+                raise ValidationError("Field '%s' cannot be expanded" % field)
+            self.targets[field] = target
+        return target
+
+    def expand(self, pairs, paths, role, batch, context):
+        """
+        Embed referenced resources into exported ones, given as
+        (instance, exported data) pairs; `paths` are relative to them.
+        """
+        for field, subpaths in group_paths(paths).iteritems():
+            if field not in self.refs:
+                raise ValidationError("Field '%s' cannot be expanded" % field)
+            target = self.get_target(field)
+            permissions = target.permissions.get_permissions(
+                target.permissions.read_permissions_tag, role, batch, context)
+            if not permissions['enabled']:
+                continue
+
+            source, _ = self.refs[field]
+            keys = set(getattr(instance, source) for instance, _ in pairs)
+            keys.discard(None)
+            related = target.fetch(keys, permissions['filter'], context)
+
+            read_check = permissions['check']
+            subpairs = []
+            for instance, data in pairs:
+                related_instance = related.get(getattr(instance, source))
+                if related_instance is None or field not in data:
+                    continue
+                if read_check is not None:
+                    related_instance = read_check(related_instance, context)
+                    if related_instance is None:
+                        continue
+                exported = target.export(related_instance,
+                                         permissions['fields'])
+                if exported is None:
+                    continue
+                data[field] = exported
+                subpairs.append((related_instance, exported))
+
+            subpaths = [subpath for subpath in subpaths if subpath]
+            if not subpaths or not subpairs:
+                continue
+            if target.expander is None:
+                raise ValidationError(
+                    "Fields of '%s' cannot be expanded" % field)
+            target.expander.expand(subpairs, subpaths, role, batch, context)
+
+    def process(self, context):
+        context_data = self.read(context)
+        paths = context_data['expand']
+        instances = context_data['instances']
+        content = context_data['content']
+        if not paths or instances is None or content is None:
+            return
+
+        for path in paths:
+            if len(path) > self.depth:
+                raise ValidationError(
+                    'Expansions may be at most %d fields deep' % self.depth)
+
+        if context_data['meta']:
+            content = content['results']
+        if isinstance(instances, Model):
+            instances, content = [instances], [content]
+        pairs = [(instance, data) for instance, data in zip(instances, content)
+                 if isinstance(data, dict)]
+        self.expand(pairs, paths, context_data['role'],
+                    context_data['batch'], context)
+
+
+Expand = ProcessorConstruction(EXPAND_CONSTRUCTORS, ExpandProcessor)
@@ -125,6 +125,7 @@ FILTERING_CONSTRUCTORS = docular.doc_spec_init_constructor_registry({
     '.field.datetime': filter_obj(DateTimeFilter),
     '.field.date': filter_obj(DateFilter),
     '.field.choices': filter_obj(Filter),
+    '.field.annotation': filter_obj(IntegerFilter),
 
     '.flag.filterable': flag_constructor('filterable'),
 }, default=no_constructor)
@@ -172,7 +173,7 @@ class FilteringProcessor(BaseProcessor):
         imported_filters = context_data['imported_filters']
         queryset = context_data['queryset']
 
-        if not queryset or not imported_filters:
+        if queryset is None or not imported_filters:
             return
 
         if not isinstance(queryset, QuerySet):
@@ -1,10 +1,18 @@
 import logging
-from django.db.models import ProtectedError
-from django.db import transaction, IntegrityError
+from collections import namedtuple
+from functools import partial
+from django.db import models
+from django.db.models import F, ProtectedError, signals
+from django.core.exceptions import FieldDoesNotExist
+from django.db import transaction, IntegrityError, connections, router
 from apimas import utils
 from apimas_django import utils as django_utils
+from apimas_django.annotations import annotate, prefetch_annotated, \
+    check_function
 from apimas.components import BaseProcessor, ProcessorConstruction
-from apimas.errors import AccessDeniedError, InvalidInput, ConflictError
+from apimas.components.permissions import mk_collection_path
+from apimas.errors import AccessDeniedError, InvalidInput, ConflictError, \
+    ValidationError, PreconditionFailed, NotFound
 import docular
 
 logger = logging.getLogger('apimas')
@@ -33,6 +41,31 @@ def get_bounds(loc, top_spec):
     return bounds
 
 
+def get_bound_keys(loc, top_spec):
+    """
+    Get the sources of the keys of the resources a collection is nested in,
+    i.e. of the `id_field` of their collections, nearest first. These keys
+    are given in the URLs of the collection.
+    """
+    keys = []
+    working_loc = loc
+    while len(working_loc) >= 2:
+        bound = docular.doc_spec_get(
+            docular.doc_get(top_spec, working_loc + ('bound',)) or {})
+        if bound is None:
+            break
+        parent_loc = working_loc[:-2]
+        id_field = docular.doc_spec_get(
+            docular.doc_get(top_spec, parent_loc + ('id_field',)) or {},
+            default='id')
+        keys.append(docular.doc_spec_get(
+            docular.doc_get(top_spec,
+                            parent_loc + ('fields', id_field, 'source')) or {},
+            default=id_field))
+        working_loc = parent_loc
+    return keys
+
+
 def get_sub_elements(instance):
     subcollections = {}
     substructs = {}
@@ -50,6 +83,15 @@ def get_sub_elements(instance):
     return subcollections, substructs, subfields
 
 
+def get_annotations(subfields):
+    annotations = {}
+    for field, field_spec in subfields.iteritems():
+        if 'annotation' in field_spec:
+            function, over = field_spec['annotation']
+            annotations[field] = (field_spec['source'], function, over)
+    return annotations
+
+
 def struct_constructor(context, instance, loc):
     docular.construct_last(context)
     value = docular.doc_spec_get(instance)
@@ -57,6 +99,9 @@ def struct_constructor(context, instance, loc):
 
     source = docular.doc_spec_get(instance.get('source', {})) or loc[-1]
     subcollections, substructs, subfields = get_sub_elements(instance)
+    if get_annotations(subfields) or any(
+            subspec['annotations'] for subspec in subcollections.itervalues()):
+        raise InvalidInput('Annotation fields are not supported in structs')
     spec['type'] = 'struct'
     spec['source'] = source
     spec['subcollections'] = subcollections
@@ -75,12 +120,23 @@ def collection_constructor(context, instance, loc, top_spec):
     id_field = docular.doc_spec_get(instance, 'id_field', default='id')
 
     subset = docular.doc_spec_get(instance.get('subset'))
+    embed_limit = docular.doc_spec_get(instance, 'embed_limit')
+    changes_column = docular.doc_spec_get(instance, 'changes_column')
     bounds = get_bounds(loc, top_spec)
+    bound_keys = get_bound_keys(loc, top_spec)
     subcollections, substructs, subfields = get_sub_elements(instance)
 
     if id_field not in subfields:
         raise InvalidInput("'id_field' not specified as field")
 
+    # only the elements of subcollections are fetched with their annotations
+    for subspec in subcollections.itervalues():
+        if any(subsubspec['annotations'] for subsubspec in
+               subspec['subcollections'].itervalues()):
+            raise InvalidInput(
+                'Annotation fields are not supported in subcollections '
+                'nested more than one level deep')
+
     id_field_spec = subfields[id_field]
     db_key = id_field_spec['source']
 
@@ -91,9 +147,15 @@ def collection_constructor(context, instance, loc, top_spec):
     spec['db_key'] = db_key
     spec['subset'] = utils.import_object(subset) if subset else None
     spec['bounds'] = bounds
+    spec['bound_keys'] = bound_keys
+    spec['embed_limit'] = embed_limit
+    spec['changes_column'] = changes_column
+    spec['tombstones'] = mk_collection_path(loc) if changes_column else None
+    spec['annotations'] = get_annotations(subfields)
     spec['subcollections'] = subcollections
     spec['substructs'] = substructs
     spec['subfields'] = subfields
+    spec['plan'] = compile_write_plan(spec, spec['model'])
     value['spec'] = spec
     docular.doc_spec_set(instance, value)
 
@@ -122,6 +184,19 @@ def field_constructor(instance, loc):
     docular.doc_spec_set(instance, value)
 
 
+def annotation_constructor(context, instance, loc):
+    docular.construct_last(context)
+    value = docular.doc_spec_get(instance)
+    spec = value['spec']
+    function = docular.doc_spec_get(instance, 'function')
+    over = docular.doc_spec_get(instance, 'over')
+    check_function(function)
+    if not over:
+        raise InvalidInput("'over' not specified for annotation field")
+    spec['annotation'] = (function, over)
+    docular.doc_spec_set(instance, value)
+
+
 def construct_flag(flag):
     def constructor(instance, loc):
         value = docular.doc_spec_get(instance, default={})
@@ -139,6 +214,7 @@ DJANGEBASEHANDLER_CONSTRUCTORS = docular.doc_spec_init_constructor_registry(
         '.field.*': field_constructor,
         '.field.struct': struct_constructor,
         '.field.collection.django': collection_constructor,
+        '.field.annotation': annotation_constructor,
         '.flag.nowrite': construct_flag('nowrite'),
         '.flag.noread': construct_flag('noread'),
         '.flag.noupdate': construct_flag('noupdate'),
@@ -214,12 +290,24 @@ class DjangoBaseHandler(BaseProcessor):
     REQUIRED_KEYS = {
     }
 
-    def __init__(self, collection_loc, action_name, spec, post_handler):
+    # Whether the handler writes the resources of its collection.
+    WRITES = False
+
+    def __init__(self, collection_loc, action_name, spec, post_handler,
+                 response_cache, fragment_cache):
         self.collection_loc = collection_loc
         self.collection_name = collection_loc[-1]
         self.spec = spec
         self.post_handler = utils.import_object(post_handler) \
                             if post_handler else None
+        self.caches = []
+        if self.WRITES:
+            for path in (response_cache, fragment_cache):
+                cache = utils.import_object(path) if path else None
+                if cache is not None and cache not in self.caches:
+                    self.caches.append(cache)
+        self.cache_names = get_written_models(spec['plan']) \
+            if self.caches else ()
 
     def process(self, context):
         context_data = self.read(context)
@@ -227,15 +315,157 @@ class DjangoBaseHandler(BaseProcessor):
         if output is not None:
             self.write(output, context)
 
+        for cache in self.caches:
+            # Cached responses are invalidated at once and, since readers may
+            # still cache the old state until the write commits, on commit.
+            cache.bump(self.cache_names)
+            transaction.on_commit(partial(cache.bump, self.cache_names))
+
         if self.post_handler:
             raw_response = context.extract('backend/raw_response')
             self.post_handler(raw_response, context)
 
 
-def get_fields(subspecs, data):
+WritePlan = namedtuple('WritePlan', [
+    'model', 'fields', 'columns', 'bound_name', 'db_key', 'id_field',
+    'id_writable', 'create_fn', 'update_fn', 'bulk_create', 'bulk_update',
+    'substructs', 'subcollections', 'tombstones'])
+
+
+def iter_plan_models(plan):
+    yield plan.model
+    for _, subplan in plan.substructs:
+        if subplan is not None:
+            for model in iter_plan_models(subplan):
+                yield model
+    for _, subplan in plan.subcollections:
+        for model in iter_plan_models(subplan):
+            yield model
+
+
+def get_written_models(plan):
+    """
+    Get the labels of the models that the resources of a collection are
+    read from and written to, including their structs and subcollections.
+    """
+    return tuple(sorted(set(
+        model._meta.label for model in iter_plan_models(plan))))
+
+
+def get_annotated_models(spec):
+    """
+    Get the labels of the models that the annotation fields of a collection
+    and of its subcollections are computed from.
+    """
+    labels = set()
+    for subspec in [spec] + spec['subcollections'].values():
+        for _, _, over in subspec['annotations'].itervalues():
+            model = subspec['model']
+            for name in over.split('.'):
+                field = model._meta.get_field(name)
+                if not field.is_relation:
+                    break
+                if field.many_to_many:
+                    through = getattr(field, 'through', None) or \
+                        field.remote_field.through
+                    labels.add(through._meta.label)
+                model = field.related_model
+                labels.add(model._meta.label)
+    return tuple(sorted(labels))
+
+
+def get_ancestor_models(model, bounds):
+    """
+    Get the labels of the models of the collections a collection is nested
+    in, given its model and bounds, nearest first.
+    """
+    labels = []
+    for bound in bounds:
+        model = model._meta.get_field(bound).related_model
+        labels.append(model._meta.label)
+    return tuple(labels)
+
+
+def get_model_field(model, source):
+    try:
+        return model._meta.get_field(source)
+    except FieldDoesNotExist:
+        return None
+
+
+def saves_plainly(model):
+    """
+    Check whether a model has no save() logic of its own.
+
+    Bulk inserts and queryset updates do not call save() and do not support
+    multi-table inheritance; models that rely on these are written row by
+    row. Save signals are checked separately, since receivers may connect at
+    any time.
+    """
+    if model._meta.parents:
+        return False
+    return model.save.__func__ is models.Model.save.__func__
+
+
+def compile_write_plan(spec, model):
+    """
+    Compile how the resources of a collection or struct spec are written.
+
+    Models, columns, bound names and create/update callables are resolved
+    once, here, for the spec and for its nested structs and collections, so
+    that writing a resource only executes the plan.
+    """
+    fields = tuple(field_spec['source']
+                   for field_spec in spec['subfields'].itervalues())
+    columns = {}
+    for source in fields:
+        columns[source] = get_model_field(model, source)
+
+    substructs = []
+    for subspec in spec['substructs'].itervalues():
+        source = subspec['source']
+        field = get_model_field(model, source)
+        columns[source] = field
+        subplan = None
+        if field is not None and field.related_model is not None:
+            subplan = compile_write_plan(subspec, field.related_model)
+        substructs.append((source, subplan))
+
+    subcollections = tuple(
+        (subspec['source'], subspec['plan'])
+        for subspec in spec['subcollections'].itervalues())
+
+    id_field = spec.get('id_field')
+    id_writable = id_field is not None and 'nowrite' not in \
+        spec['subfields'][id_field].get('flags', [])
+    bounds = spec.get('bounds')
+
+    apimas_update = getattr(model, 'apimas_update', None)
+    auto_now = any(getattr(field, 'auto_now', False)
+                   for field in model._meta.concrete_fields)
+    return WritePlan(
+        model=model,
+        fields=fields,
+        columns=columns,
+        bound_name=bounds[0] + '_id' if bounds else None,
+        db_key=spec.get('db_key'),
+        id_field=id_field,
+        id_writable=id_writable,
+        create_fn=getattr(model, 'apimas_create', model.objects.create),
+        update_fn=apimas_update or partial(standard_update, columns=columns),
+        bulk_create=(not hasattr(model, 'apimas_create') and
+                     saves_plainly(model)),
+        bulk_update=(apimas_update is None and not auto_now and
+                     saves_plainly(model)),
+        substructs=tuple(substructs),
+        subcollections=subcollections,
+        tombstones=spec.get('tombstones'),
+    )
+
+
+def get_fields(plan, data):
     create_args = {}
-    for field_name, field_spec in subspecs.iteritems():
-        source = field_spec['source']
+    for source in plan.fields:
         value = data.get(source, Nothing)
         if value is not Nothing:
             create_args[source] = value
@@ -243,149 +473,359 @@ def get_fields(subspecs, data):
     return create_args
 
 
-def get_bound_name(spec):
-    bounds = spec.get('bounds')
-    if bounds:
-        bound = bounds[0]
-        return bound + '_id'
-    return None
+def standard_update(instance, update_args, columns=None):
+    """
+    Save only the fields of an instance that are changed by update_args.
 
+    Nothing is saved if no field changes. Fields with auto_now are saved
+    along with the changed fields.
+    """
+    changed = get_changed_fields(instance, update_args, columns)
+    if not changed:
+        return
 
-def model_create_fn(model):
-    try:
-        return getattr(model, 'apimas_create')
-    except AttributeError:
-        return model.objects.create
+    opts = instance._meta
+    update_fields = set()
+    for key, value in changed.iteritems():
+        setattr(instance, key, value)
+        field = get_column(instance, key, columns)
+        if field is None or not field.concrete:
+            # not a plain column, let the model save everything
+            update_fields = None
+            break
+        update_fields.add(field.name)
 
+    if update_fields is not None:
+        update_fields.update(field.name for field in opts.concrete_fields
+                             if getattr(field, 'auto_now', False))
+    instance.save(update_fields=update_fields)
 
-def standard_update(instance, update_args):
-    for key, value in update_args.iteritems():
-        setattr(instance, key, value)
-    instance.save()
 
+def get_column(instance, source, columns):
+    if columns is not None and source in columns:
+        return columns[source]
+    return get_model_field(type(instance), source)
 
-def model_update_fn(model):
-    try:
-        return getattr(model, 'apimas_update')
-    except AttributeError:
-        return standard_update
+
+def is_changed(instance, source, value, field):
+    """
+    Check whether a value differs from the one stored in an instance field.
+
+    Related instances are compared by primary key, so that the stored related
+    instance does not need to be fetched.
+    """
+    if field is not None and field.concrete and field.is_relation and (
+            value is None or isinstance(value, models.Model)):
+        new_pk = None if value is None else value.pk
+        return getattr(instance, field.attname) != new_pk
+    return getattr(instance, source) != value
+
+
+def get_changed_fields(instance, update_args, columns=None):
+    changed = {}
+    for source, value in update_args.iteritems():
+        field = get_column(instance, source, columns)
+        if is_changed(instance, source, value, field):
+            changed[source] = value
+    return changed
+
+
+def handle_integrity_error(exc):
+    msg = 'UNIQUE constraint failed'
+    if msg in exc.message:
+        raise ConflictError(msg)
 
 
-def do_create(key, spec, data, precreated=None):
+def get_create_args(key, plan, data, precreated=None):
     create_args = {}
     if precreated:
         create_args.update(precreated)
 
-    model = spec['model']
-    bound_name = get_bound_name(spec)
+    bound_name = plan.bound_name
     if bound_name is not None:
         assert key
         create_args[bound_name] = key
 
-    create_args.update(get_fields(spec['subfields'], data))
+    create_args.update(get_fields(plan, data))
+    return create_args
+
 
+def create_row(plan, create_args):
     logger.debug('Creating values: %s', create_args)
     try:
-        return model_create_fn(model)(**create_args)
+        return plan.create_fn(**create_args)
     except IntegrityError as exc:
-        msg = 'UNIQUE constraint failed'
-        if msg in exc.message:
-            raise ConflictError(msg)
+        handle_integrity_error(exc)
 
 
-def defer_create_subcollections(spec, data):
-    deferred = []
-    for subname, subspec in spec['subcollections'].iteritems():
-        subsource = subspec['source']
-        subdata = data.get(subsource, Nothing)
-        if subdata is Nothing:
-            continue
-        deferred.extend((subspec, elem) for elem in subdata)
-    return deferred
+def has_save_signals(model):
+    return (signals.pre_save.has_listeners(model) or
+            signals.post_save.has_listeners(model))
 
 
-def create_substructs(spec, data):
-    created = {}
-    model = spec['model']
-    for subname, subspec in spec['substructs'].iteritems():
-        subsource = subspec['source']
-        field = model._meta.get_field(subsource)
-        struct_model = field.related_model
-        subspec['model'] = struct_model
-        subdata = data.get(subsource, Nothing)
-        struct_instance = create_resource(subspec, subdata)
-        if struct_instance is not Nothing:
-            created[subsource] = struct_instance
+def can_bulk_create(plan):
+    return plan.bulk_create and not has_save_signals(plan.model)
+
+
+def can_bulk_update(plan):
+    return plan.bulk_update and not has_save_signals(plan.model)
+
+
+def can_return_bulk_pks(model):
+    connection = connections[router.db_for_write(model)]
+    return connection.features.can_return_ids_from_bulk_insert
+
+
+def bulk_create_rows(model, create_args_list):
+    logger.debug('Bulk creating %d rows of %s',
+                 len(create_args_list), model.__name__)
+    objs = [model(**create_args) for create_args in create_args_list]
+    try:
+        model.objects.bulk_create(objs)
+    except IntegrityError as exc:
+        handle_integrity_error(exc)
+        raise
+    return objs
+
+
+def create_rows(plan, create_args_list, need_pks):
+    """
+    Insert rows, in bulk where possible.
+
+    need_pks tells, per row, if the primary key of the created row is needed.
+    """
+    if not can_bulk_create(plan):
+        return [create_row(plan, create_args)
+                for create_args in create_args_list]
+
+    model = plan.model
+    if can_return_bulk_pks(model) or not any(need_pks):
+        return bulk_create_rows(model, create_args_list)
+
+    created = [None] * len(create_args_list)
+    bulk_positions = []
+    for position, create_args in enumerate(create_args_list):
+        if need_pks[position]:
+            created[position] = create_row(plan, create_args)
+        else:
+            bulk_positions.append(position)
+
+    if bulk_positions:
+        objs = bulk_create_rows(
+            model, [create_args_list[pos] for pos in bulk_positions])
+        for position, obj in zip(bulk_positions, objs):
+            created[position] = obj
     return created
 
 
-def create_resource(spec, data, key=None):
-    if data is Nothing:
-        return Nothing
+def check_struct_plan(plan, source, subplan):
+    if subplan is None:
+        raise InvalidInput("'%s' is not a relation of %s" % (
+            source, plan.model.__name__))
+    return subplan
 
-    if data is None:
-        return None
 
-    deferred = defer_create_subcollections(spec, data)
-    precreated = create_substructs(spec, data)
-    instance = do_create(key, spec, data, precreated)
-    for args in deferred:
-        create_resource(*args, key=instance.pk)
-    return instance
+def create_substructs_bulk(plan, data_list):
+    created = [{} for _ in data_list]
+    for subsource, subplan in plan.substructs:
+        subdata = [data.get(subsource, Nothing) for data in data_list]
+        if all(elem is Nothing for elem in subdata):
+            continue
+        check_struct_plan(plan, subsource, subplan)
+        struct_instances = create_resources(subplan, subdata)
+        for position, struct_instance in enumerate(struct_instances):
+            if struct_instance is not Nothing:
+                created[position][subsource] = struct_instance
+    return created
 
 
-def delete_subcollection(key, spec):
-    model = spec['model']
-    bound_name = get_bound_name(spec)
-    assert bound_name is not None
-    flt = {bound_name: key}
-    logger.debug('Deleting with filter: %s', flt)
-    delete_queryset(model.objects.filter(**flt))
+def create_subcollections_bulk(plan, data_list, instances):
+    for subsource, subplan in plan.subcollections:
+        subdata = []
+        subkeys = []
+        for data, instance in zip(data_list, instances):
+            elems = data.get(subsource, Nothing)
+            if elems is Nothing:
+                continue
+            subdata.extend(elems)
+            subkeys.extend([instance.pk] * len(elems))
+        if subdata:
+            create_resources(subplan, subdata, subkeys, need_pks=False)
+
+
+def has_subcollection_data(plan, data):
+    return any(data.get(subsource, Nothing) is not Nothing
+               for subsource, _ in plan.subcollections)
+
+
+def create_resources(plan, data_list, keys=None, need_pks=True):
+    """
+    Create many resources of a collection or struct, level by level.
+
+    The resources are inserted together, in bulk where the model allows it,
+    each bound to the key at the same position in keys. Then their substructs
+    and their subcollection elements are created in one batch per subspec,
+    so that the number of queries depends on the depth of the spec rather
+    than on the number of elements.
+
+    Returns the created instances in the order of data_list. Nothing and None
+    elements are returned as is. If need_pks is false, instances that are not
+    needed to create subcollections may lack their primary key.
+    """
+    if keys is None:
+        keys = [None] * len(data_list)
+
+    results = list(data_list)
+    positions = [i for i, data in enumerate(data_list)
+                 if data is not Nothing and data is not None]
+    if not positions:
+        return results
+
+    datas = [data_list[i] for i in positions]
+    precreated = create_substructs_bulk(plan, datas)
+    create_args_list = [
+        get_create_args(keys[i], plan, data, precreated[n])
+        for n, (i, data) in enumerate(zip(positions, datas))]
+    row_need_pks = [need_pks or has_subcollection_data(plan, data)
+                    for data in datas]
+
+    instances = create_rows(plan, create_args_list, row_need_pks)
+    create_subcollections_bulk(plan, datas, instances)
+
+    for i, instance in zip(positions, instances):
+        results[i] = instance
+    return results
+
+
+def create_resource(plan, data, key=None):
+    return create_resources(plan, [data], [key])[0]
+
+
+def has_nested_data(plan, data):
+    return any(data.get(subsource, Nothing) is not Nothing
+               for subs in (plan.substructs, plan.subcollections)
+               for subsource, _ in subs)
+
+
+def update_rows(plan, pairs):
+    """
+    Update existing rows, given as (instance, data) pairs.
+
+    Rows with the same changes are updated together with one UPDATE; rows
+    without changes are left untouched. Rows that carry nested data, or whose
+    model cannot be updated in bulk, are updated one by one.
+    """
+    model = plan.model
+    bulk = can_bulk_update(plan)
+    groups = {}
+    for instance, data in pairs:
+        if not bulk or has_nested_data(plan, data):
+            update_resource(plan, data, instance)
+            continue
+
+        changed = get_changed_fields(
+            instance, get_fields(plan, data), plan.columns)
+        if changed:
+            group = tuple(sorted(changed.iteritems()))
+            groups.setdefault(group, []).append(instance.pk)
+
+    for group, pks in groups.iteritems():
+        logger.debug('Updating %d rows of %s with values: %s',
+                     len(pks), model.__name__, group)
+        try:
+            model.objects.filter(pk__in=pks).update(**dict(group))
+        except IntegrityError as exc:
+            handle_integrity_error(exc)
+            raise
+
+
+def update_subcollection(plan, data_list, key):
+    """
+    Make the elements of a subcollection match data_list.
+
+    Elements are matched to the existing rows by the id field of the
+    subcollection. Matched rows are updated if changed, unmatched elements are
+    created and the rows left unmatched are deleted with a single query.
+    """
+    model = plan.model
+    db_key = plan.db_key
+    assert plan.bound_name is not None
+
+    existing = {}
+    for instance in model.objects.filter(**{plan.bound_name: key}):
+        existing[getattr(instance, db_key)] = instance
+
+    matched = []
+    new = []
+    for data in data_list:
+        if data is Nothing or data is None:
+            continue
+        element_key = data.get(db_key, Nothing)
+        instance = existing.pop(element_key, None)
+        if instance is not None:
+            matched.append((instance, data))
+        elif element_key is Nothing or plan.id_writable:
+            new.append(data)
+        else:
+            raise ValidationError("'%s': No element with %s %s" % (
+                plan.id_field, plan.id_field, element_key))
+
+    if existing:
+        removed = [instance.pk for instance in existing.itervalues()]
+        logger.debug('Deleting %d rows of %s', len(removed), model.__name__)
+        delete_queryset(model.objects.filter(pk__in=removed))
+        record_deletions(plan, [(element_key, key)
+                                for element_key in existing])
 
+    update_rows(plan, matched)
+    create_resources(plan, new, [key] * len(new), need_pks=False)
 
-def update_subcollections(spec, data, instance):
-    for subname, subspec in spec['subcollections'].iteritems():
-        subsource = subspec['source']
+
+def update_subcollections(plan, data, instance):
+    for subsource, subplan in plan.subcollections:
         subdata = data.get(subsource, Nothing)
         if subdata is Nothing:
             continue
-        delete_subcollection(instance.pk, subspec)
-        for elem in subdata:
-            create_resource(subspec, elem, key=instance.pk)
+        update_subcollection(subplan, subdata, instance.pk)
 
 
-def update_substructs(spec, data, instance):
+def update_substructs(plan, data, instance):
+    """
+    Create or update the substructs of an instance.
+
+    Returns the substructs to set on the instance and the removed substruct
+    instances, which are deleted after the instance no longer refers to them.
+    """
     created = {}
-    model = spec['model']
-    for subname, subspec in spec['substructs'].iteritems():
-        subsource = subspec['source']
-        field = model._meta.get_field(subsource)
-        struct_model = field.related_model
-        subspec['model'] = struct_model
+    removed = []
+    for subsource, subplan in plan.substructs:
         subdata = data.get(subsource, Nothing)
+        if subdata is Nothing:
+            continue
+        check_struct_plan(plan, subsource, subplan)
         subinstance = getattr(instance, subsource)
         if subinstance is None:
-            struct_instance = create_resource(subspec, subdata)
+            struct_instance = create_resource(subplan, subdata)
             if struct_instance is not Nothing:
                 created[subsource] = struct_instance
+        elif subdata is None:
+            created[subsource] = None
+            removed.append(subinstance)
         else:
-            struct_instance = update_resource(subspec, subdata, subinstance)
-            if struct_instance is None:
-                created[subsource] = None
-    return created
+            update_resource(subplan, subdata, subinstance)
+    return created, removed
 
 
-def do_update(spec, data, instance, precreated=None):
+def do_update(plan, data, instance, precreated=None):
     update_args = {}
     if precreated:
         update_args.update(precreated)
 
-    update_args.update(get_fields(spec['subfields'], data))
+    update_args.update(get_fields(plan, data))
 
     logger.debug('Updating values: %s', update_args)
-    model = spec['model']
     try:
-        model_update_fn(model)(instance, update_args)
+        plan.update_fn(instance, update_args)
     except IntegrityError as exc:
         msg = 'UNIQUE constraint failed'
         if msg in exc.message:
@@ -393,7 +833,7 @@ def do_update(spec, data, instance, precreated=None):
     return instance
 
 
-def update_resource(spec, data, instance):
+def update_resource(plan, data, instance):
     if data is Nothing:
         return Nothing
 
@@ -402,9 +842,13 @@ def update_resource(spec, data, instance):
         delete_instance(instance)
         return None
 
-    update_subcollections(spec, data, instance)
-    precreated = update_substructs(spec, data, instance)
-    return do_update(spec, data, instance, precreated)
+    update_subcollections(plan, data, instance)
+    precreated, removed = update_substructs(plan, data, instance)
+    do_update(plan, data, instance, precreated)
+    for struct_instance in removed:
+        logger.debug('Deleting instance: %s', struct_instance)
+        delete_instance(struct_instance)
+    return instance
 
 
 def delete_instance(instance):
@@ -415,13 +859,47 @@ def delete_instance(instance):
 
 
 def delete_queryset(queryset):
+    """
+    Delete the rows of a queryset; return the number of deleted rows of its
+    model, not counting cascades.
+    """
     try:
-        queryset.delete()
+        _, deleted = queryset.delete()
     except ProtectedError:
         raise AccessDeniedError('Deleting these resources is forbidden')
+    return deleted.get(queryset.model._meta.label, 0)
+
+
+def get_deleted_rows(plan, instances):
+    """
+    Read the (key, parent key) pairs of resources about to be deleted.
+    """
+    bound_name = plan.bound_name
+    return [(getattr(instance, plan.db_key),
+             getattr(instance, bound_name) if bound_name else None)
+            for instance in instances]
+
+
+def record_deletions(plan, rows):
+    """
+    Write tombstones for deleted resources, given as (key, parent key)
+    pairs, if their collection tracks its changes.
+
+    Resources deleted by cascade are not recorded.
+    """
+    if plan.tombstones is None or not rows:
+        return
+    # Imported here, so that apimas_django needs to be an installed app
+    # only for collections that track their changes.
+    from apimas_django.models import Tombstone
+    Tombstone.objects.bulk_create([
+        Tombstone(collection=plan.tombstones, key=unicode(key),
+                  parent=None if parent is None else unicode(parent))
+        for key, parent in rows])
 
 
 class CreateHandlerProcessor(DjangoBaseHandler):
+    WRITES = True
     REQUIRED_KEYS = {
         'data',
     }
@@ -436,51 +914,155 @@ class CreateHandlerProcessor(DjangoBaseHandler):
 
         data = context_data['data']
         kwargs = context_data['kwargs']
-        key = kwargs.get('id0')
+        key = get_parent_pk(self.spec, kwargs or {})
+        if kwargs and kwargs.get('id0') is not None and key is None:
+            raise NotFound('Resource not found')
+
+        if isinstance(data, list):
+            return (self.create_many(data, key, context),)
 
         if self.custom_create_handler:
             instance = self.custom_create_handler(
                 data, key, context)
         else:
-            instance = create_resource(self.spec, data, key=key)
+            instance = create_resource(self.spec['plan'], data, key=key)
 
-        if self.spec['subset']:
-            instance = get_model_instance(
-                self.spec, instance.pk, kwargs, strict=False)
+        if self.spec['subset'] or self.spec['annotations']:
+            # The response is fetched again, along with the read filter, to
+            # check that the instance falls into the collection subset and
+            # to compute its annotation fields.
+            get_identity_map(context).invalidate(instance)
         return (instance,)
 
+    def create_many(self, data, key, context):
+        if self.custom_create_handler:
+            instances = [self.custom_create_handler(elem, key, context)
+                         for elem in data]
+        else:
+            instances = create_resources(
+                self.spec['plan'], data, [key] * len(data))
+
+        if self.spec['subset'] or self.spec['annotations']:
+            identity_map = get_identity_map(context)
+            for instance in instances:
+                identity_map.invalidate(instance)
+        return instances
+
 
 CreateHandler = _django_base_construction(CreateHandlerProcessor)
 
 
-def select_related(objects, substructs):
+def select_related(objects, substructs, fields=None):
     for key, value in substructs.iteritems():
+        if fields is not None and key not in fields:
+            continue
         source = value['source']
         if source:
             objects = objects.select_related(source)
     return objects
 
 
-def prefetch_related(objects, subcollections):
+def prefetch_related(objects, subcollections, fields=None):
     for key, value in subcollections.iteritems():
+        if fields is not None and key not in fields:
+            continue
+        # bounded subcollections are fetched when exported
+        if value['embed_limit'] is not None:
+            continue
         source = value['source']
-        if source:
-            objects = objects.prefetch_related(source)
+        if not source:
+            continue
+        if value['annotations']:
+            source = prefetch_annotated(source, value['model'],
+                                        value['annotations'])
+        objects = objects.prefetch_related(source)
     return objects
 
 
-def get_bound_filters(bounds, kwargs):
+def get_deferred_columns(spec, fields):
+    """
+    Find the model columns read only by fields not selected by the request.
+
+    Only plain columns are deferred; keys and relations are always fetched,
+    since filters, refs and expansions rely on them.
+    """
+    model = spec['model']
+    subfields = spec['subfields']
+    needed = set(value['source'] for key, value in subfields.iteritems()
+                 if key in fields)
+    needed.add(spec['db_key'])
+
+    deferred = []
+    for key, value in subfields.iteritems():
+        source = value['source']
+        if source in needed:
+            continue
+        model_field = get_model_field(model, source)
+        if model_field is None or not model_field.concrete or \
+           model_field.primary_key or model_field.is_relation:
+            continue
+        deferred.append(source)
+    return sorted(set(deferred))
+
+
+def get_bound_filters(bounds, kwargs, keys):
+    """
+    Filter the resources of a collection by the keys of the resources it is
+    nested in, given in the URL and read from the `keys` sources.
+    """
     flts = {}
     prev = ''
     for i, bound in enumerate(bounds):
         prefix = (prev + '__') if prev else ''
         ref = prefix + bound
-        flts[ref + '_id'] = kwargs['id' + str(i)]
+        flts[ref + '__' + keys[i]] = kwargs['id' + str(i)]
         prev = ref
     return flts
 
 
+def get_parent_pk(spec, kwargs):
+    """
+    Get the primary key of the resource a collection is nested in, given
+    its key in the URL, or `None` if there is no such resource.
+    """
+    key = kwargs.get('id0')
+    bounds = spec['bounds']
+    if key is None or not bounds:
+        return key
+    parent = spec['model']._meta.get_field(bounds[0]).related_model
+    keys = spec['bound_keys']
+    if keys[0] == parent._meta.pk.name:
+        return key
+    flts = get_bound_filters(bounds[1:], {
+        'id' + str(i): kwargs['id' + str(i + 1)]
+        for i in range(len(bounds) - 1)}, keys[1:])
+    flts[keys[0]] = key
+    return parent.objects.filter(**flts).values_list(
+        'pk', flat=True).first()
+
+
+READ_FILTER_APPLIED = 'backend/read_filter_applied'
+
+
+def get_read_filters(read_filter, context):
+    """
+    Compute the read permission filter of a request for a handler query.
+
+    Returns the filters to apply and the names to register the fetched
+    instances with in the identity map.
+    """
+    if read_filter is None:
+        return [], ()
+    return [read_filter(context)], ('read',)
+
+
 class ListHandlerProcessor(DjangoBaseHandler):
+    READ_KEYS = {
+        'read_filter': 'permissions/read/filter',
+        'read_check': 'permissions/read/check',
+        'fields': 'imported/fields',
+    }
+    READ_KEYS.update(DjangoBaseHandler.READ_KEYS)
     REQUIRED_KEYS = {
     }
 
@@ -488,23 +1070,41 @@ class ListHandlerProcessor(DjangoBaseHandler):
         """
         Gets all django model instances based on the orm model extracted
         from request context.
+
+        The read permission filter, if any, is applied to the query. If the
+        request selects fields, the columns and relations of the rest are
+        not fetched, unless a read check may need them.
         """
         kwargs = context_data['kwargs']
-        return (get_collection_objects(self.spec, kwargs),)
+        fields = context_data['fields']
+        filters, _ = get_read_filters(context_data['read_filter'], context)
+        if filters:
+            context.save(READ_FILTER_APPLIED, True)
+        objects = get_collection_objects(self.spec, kwargs, filters, fields)
+        if fields is not None and context_data['read_check'] is None:
+            deferred = get_deferred_columns(self.spec, fields)
+            if deferred:
+                objects = objects.defer(*deferred)
+        return (objects,)
 
 
 ListHandler = _django_base_construction(ListHandlerProcessor)
 
 
-def get_collection_objects(spec, bounds):
+def get_collection_objects(spec, bounds, filters=None, fields=None):
     model = spec['model']
     subset = spec['subset']
-    bound_filters = get_bound_filters(spec['bounds'], bounds)
+    bound_filters = get_bound_filters(spec['bounds'], bounds,
+                                      spec['bound_keys'])
     objects = model.objects.filter(**bound_filters)
     if subset:
         objects = objects.filter(subset)
-    objects = prefetch_related(objects, spec['subcollections'])
-    objects = select_related(objects, spec['substructs'])
+    if filters:
+        objects = objects.filter(*filters)
+    # annotations may be filtered or ordered by, even if not selected
+    objects = annotate(objects, spec['annotations'])
+    objects = prefetch_related(objects, spec['subcollections'], fields)
+    objects = select_related(objects, spec['substructs'], fields)
     return objects
 
 
@@ -512,12 +1112,55 @@ def running_in_transaction():
     return not transaction.get_autocommit()
 
 
+IDENTITY_MAP = 'backend/identity_map'
+
+
+class IdentityMap(object):
+    """
+    Model instances fetched during a request.
+
+    Instances are kept by model, primary key and the names of the
+    permission filters they were fetched with, e.g. `()` or `('read',)`.
+    An instance that is written becomes stale: it is dropped from the map
+    and must be fetched again to be served.
+    """
+    __slots__ = ('instances', 'stale')
+
+    def __init__(self):
+        self.instances = {}
+        self.stale = set()
+
+    def get(self, model, pk, filters=()):
+        return self.instances.get((model, pk, filters))
+
+    def add(self, instance, filters=()):
+        model = type(instance)
+        self.instances[(model, instance.pk, filters)] = instance
+        self.stale.discard((model, instance.pk))
+
+    def invalidate(self, instance):
+        model = type(instance)
+        for key in [key for key in self.instances
+                    if key[0] is model and key[1] == instance.pk]:
+            del self.instances[key]
+        self.stale.add((model, instance.pk))
+
+    def is_stale(self, instance):
+        return (type(instance), instance.pk) in self.stale
+
+
+def get_identity_map(context):
+    identity_map = context.extract(IDENTITY_MAP)
+    if identity_map is None:
+        identity_map = IdentityMap()
+        context.save(IDENTITY_MAP, identity_map)
+    return identity_map
+
+
 def get_model_instance(spec, pk, kwargs, filters=None, strict=True,
-                       for_update=False):
+                       for_update=False, fields=None):
     db_key = spec['db_key']
-    objects = get_collection_objects(spec, kwargs)
-    if filters:
-        objects = objects.filter(*filters)
+    objects = get_collection_objects(spec, kwargs, filters, fields)
     if for_update and running_in_transaction():
         objects = objects.select_for_update()
     return django_utils.get_instance(
@@ -527,6 +1170,8 @@ def get_model_instance(spec, pk, kwargs, filters=None, strict=True,
 class RetrieveHandlerProcessor(DjangoBaseHandler):
     READ_KEYS = {
         'instance': 'backend/instance',
+        'read_filter': 'permissions/read/filter',
+        'fields': 'imported/fields',
     }
     READ_KEYS.update(DjangoBaseHandler.READ_KEYS)
     REQUIRED_KEYS = {
@@ -537,21 +1182,60 @@ class RetrieveHandlerProcessor(DjangoBaseHandler):
         """
         Gets a single model instance which based on the orm model and
         resource ID extracted from request context.
+
+        The read permission filter, if any, is applied to the query, so that
+        the instance is not fetched again to check its visibility.
         """
         pk = context_data['pk']
         kwargs = context_data['kwargs']
         instance = context_data['instance']
         if not instance:
-            instance = get_model_instance(self.spec, pk, kwargs)
+            filters, filter_names = get_read_filters(
+                context_data['read_filter'], context)
+            instance = get_model_instance(self.spec, pk, kwargs, filters,
+                                          fields=context_data['fields'])
+            get_identity_map(context).add(instance, filter_names)
         return (instance,)
 
 
 RetrieveHandler = _django_base_construction(RetrieveHandlerProcessor)
 
 
+CONDITION = 'backend/condition'
+
+Condition = namedtuple('Condition', ['values', 'version_field'])
+
+
+def claim_instance(instance, condition):
+    """
+    Conditionally claim an instance for writing, without having locked it.
+
+    The row is updated only if its columns still have the values given by
+    the condition; a version field is incremented. The row stays locked
+    until the end of the transaction. Raises PreconditionFailed if the row
+    has been changed or removed meanwhile.
+    """
+    model = type(instance)
+    objects = model.objects.filter(pk=instance.pk, **condition.values)
+    version_field = condition.version_field
+    if version_field:
+        updated = objects.update(**{version_field: F(version_field) + 1})
+    else:
+        pk_name = model._meta.pk.name
+        updated = objects.update(**{pk_name: F(pk_name)})
+
+    if not updated:
+        raise PreconditionFailed('Resource has been modified')
+    if version_field:
+        setattr(instance, version_field,
+                condition.values[version_field] + 1)
+
+
 class UpdateHandlerProcessor(DjangoBaseHandler):
+    WRITES = True
     READ_KEYS = {
         'instance': 'backend/instance',
+        'condition': CONDITION,
     }
     READ_KEYS.update(DjangoBaseHandler.READ_KEYS)
     REQUIRED_KEYS = {
@@ -576,12 +1260,17 @@ class UpdateHandlerProcessor(DjangoBaseHandler):
             instance = get_model_instance(self.spec, pk, kwargs,
                                           for_update=True)
 
+        condition = context_data['condition']
+        if condition is not None:
+            claim_instance(instance, condition)
+
         if self.custom_update_handler:
             self.custom_update_handler(data, instance, context)
         else:
-            update_resource(self.spec, data, instance)
+            update_resource(self.spec['plan'], data, instance)
 
-        instance = get_model_instance(self.spec, pk, kwargs, strict=False)
+        # The response is fetched again along with the read filter.
+        get_identity_map(context).invalidate(instance)
         return (instance,)
 
 
@@ -589,12 +1278,147 @@ UpdateHandler = _django_base_construction(UpdateHandlerProcessor)
 
 
 class DeleteHandlerProcessor(RetrieveHandlerProcessor):
+    WRITES = True
+    READ_KEYS = {
+        'condition': CONDITION,
+    }
+    READ_KEYS.update(RetrieveHandlerProcessor.READ_KEYS)
+
     def execute_context(self, context_data, context):
         """ Deletes an existing model instance. """
         (instance,) = RetrieveHandlerProcessor.execute_context(
             self, context_data, context)
+        condition = context_data['condition']
+        if condition is not None:
+            claim_instance(instance, condition)
+        plan = self.spec['plan']
+        rows = get_deleted_rows(plan, [instance])
         delete_instance(instance)
+        record_deletions(plan, rows)
         return None
 
 
 DeleteHandler = _django_base_construction(DeleteHandlerProcessor)
+
+
+def get_bulk_objects(plan, queryset, write_filter, context):
+    """
+    Select the rows of the resources matched by a bulk write.
+
+    Rows are selected by primary key, because the matched queryset may be
+    distinct or joined with related tables, which an UPDATE or DELETE does
+    not support. The write permission filter narrows the selection further.
+    """
+    objects = plan.model.objects.filter(pk__in=queryset.values('pk'))
+    if write_filter is not None:
+        objects = objects.filter(write_filter(context))
+    return objects
+
+
+def update_objects(plan, objects, data, version_field=None):
+    """
+    Update the rows of a queryset with the same data; return the number of
+    matched rows. The `version_field` column of updated rows, if given, is
+    incremented.
+
+    Models that cannot be updated in bulk are updated row by row.
+    """
+    if not can_bulk_update(plan):
+        instances = list(objects.select_for_update())
+        for instance in instances:
+            version = {version_field: getattr(instance, version_field) + 1} \
+                if version_field else None
+            do_update(plan, data, instance, version)
+        return len(instances)
+
+    update_args = get_fields(plan, data)
+    if not update_args:
+        return objects.count()
+    if version_field:
+        update_args[version_field] = F(version_field) + 1
+
+    logger.debug('Updating rows of %s with values: %s',
+                 plan.model.__name__, update_args)
+    try:
+        return objects.update(**update_args)
+    except IntegrityError as exc:
+        handle_integrity_error(exc)
+        raise
+
+
+class BulkHandlerProcessor(DjangoBaseHandler):
+    """
+    Base handler for actions that write all resources matched by a request.
+
+    The matched resources are read from the filtered collection response,
+    so that they are selected with the same filters, search and read
+    permission filter as listing the collection. The response content is
+    the number of written resources.
+    """
+    WRITES = True
+    READ_KEYS = {
+        'queryset': 'backend/filtered_response',
+        'write_filter': 'permissions/write/filter',
+    }
+    READ_KEYS.update(DjangoBaseHandler.READ_KEYS)
+
+    WRITE_KEYS = (
+        'backend/raw_response',
+        'response/content',
+    )
+
+    def execute_context(self, context_data, context):
+        objects = get_bulk_objects(
+            self.spec['plan'], context_data['queryset'],
+            context_data['write_filter'], context)
+        count = self.execute_bulk(objects, context_data, context)
+        return (count, {'count': count})
+
+
+class BulkUpdateHandlerProcessor(BulkHandlerProcessor):
+    REQUIRED_KEYS = {
+        'data',
+    }
+
+    def __init__(self, optimistic_concurrency, version_field, **kwargs):
+        self.optimistic_concurrency = bool(optimistic_concurrency)
+        self.version_field = version_field
+        BulkHandlerProcessor.__init__(self, **kwargs)
+
+    def execute_bulk(self, objects, context_data, context):
+        """
+        Updates the matched resources with the same data, in one UPDATE.
+
+        The version field of the resources is incremented, so that their
+        previous ETags no longer match. Collections with optimistic
+        concurrency but no version field cannot be updated in bulk, since
+        their resources are written without being checked.
+        """
+        plan = self.spec['plan']
+        data = context_data['data']
+        if has_nested_data(plan, data):
+            raise ValidationError(
+                'Nested fields cannot be updated in bulk')
+        if self.optimistic_concurrency and not self.version_field:
+            raise ValidationError(
+                'Resources with optimistic concurrency cannot be updated in '
+                'bulk without a version field')
+        return update_objects(plan, objects, data, self.version_field)
+
+
+BulkUpdateHandler = _django_base_construction(BulkUpdateHandlerProcessor)
+
+
+class BulkDeleteHandlerProcessor(BulkHandlerProcessor):
+    def execute_bulk(self, objects, context_data, context):
+        """ Deletes the matched resources. """
+        plan = self.spec['plan']
+        rows = []
+        if plan.tombstones is not None:
+            rows = get_deleted_rows(plan, objects)
+        count = delete_queryset(objects)
+        record_deletions(plan, rows)
+        return count
+
+
+BulkDeleteHandler = _django_base_construction(BulkDeleteHandlerProcessor)
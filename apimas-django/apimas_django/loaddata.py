@@ -42,6 +42,26 @@ def load_data_fields(subspecs, data, full, instance):
     return loaded
 
 
+def load_element(name, spec, data, full, instance):
+    """
+    Load an element of a subcollection.
+
+    When updating, the element may be identified by its id field, even if the
+    field is not writable, so that it is matched to an existing element.
+    """
+    id_field = spec['id_field']
+    id_spec = spec['subfields'][id_field]
+    if (instance is None or not isinstance(data, dict) or
+            id_field not in data or 'nowrite' not in id_spec.get('flags', [])):
+        return load_data(name, spec, data, full, None)
+
+    data = dict(data)
+    key = data.pop(id_field)
+    loaded = load_data(name, spec, data, full, None)
+    loaded[id_spec['source']] = key
+    return loaded
+
+
 def load_data_subcollections(spec, data, full, instance):
     loaded = {}
     for subname, subspec in spec['subcollections'].iteritems():
@@ -49,8 +69,9 @@ def load_data_subcollections(spec, data, full, instance):
         subdata = data.get(subname, Nothing)
         if subdata is Nothing:
             continue
-        loaded[subsource] = [load_data(subname, subspec, elem, full, None)
-                             for elem in subdata]
+        loaded[subsource] = [
+            load_element(subname, subspec, elem, full, instance)
+            for elem in subdata]
     return loaded
 
 
@@ -102,6 +123,12 @@ class LoadDataProcessor(BaseProcessor):
     def execute(self, context_data):
         data = context_data['imported_content']
         instance = context_data['instance']
+        if isinstance(data, list):
+            loaded = [load_data(self.collection_name, self.spec, elem,
+                                self.full, instance, toplevel=True)
+                      for elem in data]
+            return (loaded,)
+
         loaded = load_data(
             self.collection_name, self.spec, data, self.full, instance,
             toplevel=True)
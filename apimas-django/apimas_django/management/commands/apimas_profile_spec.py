@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from apimas import utils
+from apimas_django.profiling import profile_spec, format_report
+
+
+class Command(BaseCommand):
+    help = ("Configure and construct an apimas spec, reporting the time "
+            "spent per phase, constructor registry and predicate, and the "
+            "memory retained by the constructed spec.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'app_config',
+            help="dotted path to the app config, e.g. myproj.spec.APP_CONFIG")
+        parser.add_argument(
+            '--deploy-config', dest='deploy_config',
+            help="dotted path to the deployment config")
+        parser.add_argument(
+            '--top', type=int, default=20,
+            help="number of predicates to report (default: 20)")
+
+    def handle(self, *args, **options):
+        app_config = utils.import_object(options['app_config'])
+        deploy_config = None
+        if options['deploy_config']:
+            deploy_config = utils.import_object(options['deploy_config'])
+
+        report = profile_spec(app_config, deploy_config)
+        self.stdout.write(format_report(report, top=options['top']))
@@ -0,0 +1,19 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+from apimas_django.changes import prune_tombstones
+
+
+class Command(BaseCommand):
+    help = ("Remove the tombstones of resources deleted more than the given "
+            "number of days ago. Change feed cursors that have not read "
+            "past them must then read the feed anew.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=float, default=30,
+            help="retention of tombstones, in days (default: 30)")
+
+    def handle(self, *args, **options):
+        count = prune_tombstones(now() - timedelta(days=options['days']))
+        self.stdout.write('Removed %d tombstones\n' % count)
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 12:36
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apimas_django', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TombstoneHorizon',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('collection', models.CharField(max_length=255, unique=True)),
+                ('pruned_id', models.IntegerField()),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='tombstone',
+            name='deleted_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+from django.db import models
+
+
+class Tombstone(models.Model):
+    """
+    A resource deleted from a collection that tracks its changes.
+
+    Tombstones are kept by collection path, e.g. `api/prefix/groups/members`,
+    and by the key of the parent resource for nested collections. Their
+    ids order them in the change feed of the collection. Old tombstones are
+    removed with `apimas_django.changes.prune_tombstones`.
+    """
+    collection = models.CharField(max_length=255)
+    parent = models.CharField(max_length=255, null=True)
+    key = models.CharField(max_length=255)
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        index_together = [('collection', 'parent')]
+
+
+class TombstoneHorizon(models.Model):
+    """
+    The id of the latest tombstone pruned from a collection.
+
+    Change feed cursors that have not read past it may have missed
+    deletions, and must be dropped.
+    """
+    collection = models.CharField(max_length=255, unique=True)
+    pruned_id = models.IntegerField()
@@ -1,7 +1,11 @@
 from django.db import models
 from django.db.models.query import QuerySet
+from apimas_django import utils as django_utils
 from apimas_django.handlers import \
-    get_model_instance, _django_base_construction
+    get_model_instance, get_collection_objects, get_identity_map, \
+    get_read_filters, READ_FILTER_APPLIED, CONDITION, \
+    _django_base_construction
+from apimas_django.concurrency import OptimisticConcurrency
 from apimas.components import BaseProcessor, ProcessorConstruction
 from apimas.errors import NotFound
 import docular
@@ -12,14 +16,47 @@ def filter_collection(queryset, filter_func, context):
     return queryset.filter(flt)
 
 
-def filter_resource(spec, pk, kwargs, filter_func, context, strict):
-    flt = filter_func(context)
-    try:
-        return get_model_instance(spec, pk, kwargs, filters=[flt])
-    except NotFound:
+def filter_resource(spec, instance, kwargs, filter_func, context, strict):
+    """
+    Get an instance as visible through the read filter.
+
+    The instance is served from the identity map of the request if it has
+    already been fetched with the same filter, or if there is no filter and
+    it has not been written since it was fetched. Otherwise it is fetched
+    with one query.
+    """
+    identity_map = get_identity_map(context)
+    filters, filter_names = get_read_filters(filter_func, context)
+    model = spec['model']
+    cached = identity_map.get(model, instance.pk, filter_names)
+    if cached is not None:
+        return cached
+    if filter_func is None and not identity_map.is_stale(instance):
+        return instance
+
+    objects = get_collection_objects(spec, kwargs, filters)
+    filtered = django_utils.get_instance(objects, instance.pk, strict=False)
+    if filtered is None:
         if strict:
-            raise
+            raise NotFound('Resource not found')
         return None
+    identity_map.add(filtered, filter_names)
+    return filtered
+
+
+def filter_resources(spec, instances, kwargs, filter_func, context):
+    identity_map = get_identity_map(context)
+    if filter_func is None and not any(
+            identity_map.is_stale(instance) for instance in instances):
+        return instances
+
+    filters, filter_names = get_read_filters(filter_func, context)
+    pks = [instance.pk for instance in instances]
+    objects = get_collection_objects(spec, kwargs, filters)
+    found = objects.in_bulk(pks)
+    for instance in found.itervalues():
+        identity_map.add(instance, filter_names)
+    return [found[pk] for pk in pks if pk in found]
 
 
 class FilterResourceResponseProcessor(BaseProcessor):
@@ -46,13 +83,16 @@ class FilterResourceResponseProcessor(BaseProcessor):
         kwargs = context_data['kwargs']
         read_filter = context_data['read_filter']
 
-        if read_filter is None:
-            filtered_response = unfiltered_response
+        if unfiltered_response is None:
+            filtered_response = None
+        elif isinstance(unfiltered_response, list):
+            filtered_response = filter_resources(
+                self.spec, unfiltered_response, kwargs, read_filter, context)
         else:
             assert isinstance(unfiltered_response, models.Model)
-            pk = unfiltered_response.pk
             filtered_response = filter_resource(
-                self.spec, pk, kwargs, read_filter, context, self.strict)
+                self.spec, unfiltered_response, kwargs, read_filter, context,
+                self.strict)
 
         self.write((filtered_response,), context)
 
@@ -62,18 +102,31 @@ FilterResourceResponse = _django_base_construction(
 
 
 class ObjectRetrievalForUpdateProcessor(BaseProcessor):
+    """
+    Fetch the instance to be written.
+
+    The instance is locked for the rest of the transaction, unless the
+    collection uses optimistic concurrency: then the request must carry an
+    `If-Match` header with the current ETag of the resource, and the handler
+    writes the instance only if it has not changed meanwhile.
+    """
     READ_KEYS = {
         'kwargs': 'request/meta/kwargs',
         'pk': 'request/meta/kwargs/pk',
         'write_filter': 'permissions/write/filter',
+        'headers': 'request/meta/headers',
     }
 
     WRITE_KEYS = (
         'backend/instance',
+        CONDITION,
     )
 
-    def __init__(self, collection_loc, action_name, spec):
+    def __init__(self, collection_loc, action_name, spec,
+                 optimistic_concurrency, version_field):
         self.spec = spec
+        self.concurrency = OptimisticConcurrency(
+            spec, optimistic_concurrency, version_field)
 
     def process(self, context):
         context_data = self.read(context)
@@ -84,9 +137,18 @@ class ObjectRetrievalForUpdateProcessor(BaseProcessor):
         if write_filter is not None:
             filters.append(write_filter(context))
 
+        optimistic = self.concurrency.enabled
         instance = get_model_instance(self.spec, pk, kwargs, filters,
-                                      for_update=True)
-        self.write((instance,), context)
+                                      for_update=not optimistic)
+        filter_names = () if write_filter is None else ('write',)
+        get_identity_map(context).add(instance, filter_names)
+
+        condition = None
+        if optimistic:
+            headers = context_data['headers'] or {}
+            condition = self.concurrency.condition(
+                instance, headers.get('HTTP_IF_MATCH'))
+        self.write((instance, condition), context)
 
 
 ObjectRetrievalForUpdate = _django_base_construction(
@@ -97,6 +159,7 @@ class FilterCollectionResponseProcessor(BaseProcessor):
     READ_KEYS = {
         'unfiltered': 'backend/raw_response',
         'read_filter': 'permissions/read/filter',
+        'applied': READ_FILTER_APPLIED,
     }
 
     WRITE_KEYS = (
@@ -113,7 +176,7 @@ class FilterCollectionResponseProcessor(BaseProcessor):
         unfiltered_response = context_data['unfiltered']
         read_filter = context_data['read_filter']
 
-        if read_filter is None:
+        if read_filter is None or context_data['applied']:
             filtered_response = unfiltered_response
         else:
             assert isinstance(unfiltered_response, QuerySet)
@@ -143,6 +206,11 @@ class WritePermissionCheckProcessor(BaseProcessor):
         if write_check is None:
             return
 
+        if isinstance(backend_input, list):
+            for elem in backend_input:
+                write_check(elem, instance, context)
+            return
+
         write_check(backend_input, instance, context)
 
 
@@ -183,6 +251,14 @@ class ReadPermissionCheckProcessor(BaseProcessor):
             self.write((checked_response,), context)
             return
 
+        if isinstance(unchecked_response, list):
+            checked_response = [read_check(elem, context)
+                                for elem in unchecked_response]
+            checked_response = [elem for elem in checked_response
+                                if elem is not None]
+            self.write((checked_response,), context)
+            return
+
         checked_response = read_check(unchecked_response, context)
         if checked_response is None and self.strict:
             raise NotFound("Resource not found")
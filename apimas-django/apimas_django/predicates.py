@@ -7,6 +7,16 @@ spec_list = [
         'model': {'.string': {}},
         'subset': {'.string': {}},
         'bound': {'.string': {}},
+        'embed_limit': {'.integer': {}},
+        'changes_column': {'.string': {}},
+        ':root_url': {'.string': {}},
+    },
+
+    {
+        '.field.annotation': {},
+        '.flag.nowrite': {},
+        'function': {'.string': {}},
+        'over': {'.string': {}},
     },
 
     {
@@ -35,9 +45,69 @@ spec_list = [
         ':pagination_default_limit': {'.integer': {}},
     },
 
+    {
+        '.processor.aggregate': {},
+        'module_path': 'apimas_django.aggregation.Aggregate',
+    },
+
+    {
+        '.processor.changes': {},
+        'module_path': 'apimas_django.changes.Changes',
+        ':pagination_default_limit': {'.integer': {}},
+        ':changes_lag': {'.integer': {}},
+    },
+
+    {
+        '.processor.expand': {},
+        'module_path': 'apimas_django.expand.Expand',
+        ':expand_depth': {'.integer': {}},
+    },
+
     {
         '.processor.object_retrieval_for_update': {},
         'module_path': 'apimas_django.permissions.ObjectRetrievalForUpdate',
+        ':optimistic_concurrency': {'.boolean': {}},
+        ':version_field': {'.string': {}},
+    },
+
+    {
+        '.processor.etag': {},
+        'module_path': 'apimas_django.concurrency.ETag',
+        ':optimistic_concurrency': {'.boolean': {}},
+        ':version_field': {'.string': {}},
+    },
+
+    {
+        '.processor.validators': {},
+        'module_path': 'apimas_django.validators.Validators',
+        ':version_field': {'.string': {}},
+        ':modified_field': {'.string': {}},
+        ':cache_control': {'.string': {}},
+    },
+
+    {
+        '.processor.response_cache': {},
+        'module_path': 'apimas_django.caching.ResponseCache',
+        ':response_cache': {'.string': {}},
+    },
+
+    {
+        '.processor.response_cache_store': {},
+        'module_path': 'apimas_django.caching.ResponseCacheStore',
+        ':response_cache': {'.string': {}},
+    },
+
+    {
+        '.processor.fragment_cache': {},
+        'module_path': 'apimas_django.caching.FragmentCache',
+        ':fragment_cache': {'.string': {}},
+        ':version_field': {'.string': {}},
+    },
+
+    {
+        '.processor.fragment_cache_store': {},
+        'module_path': 'apimas_django.caching.FragmentCacheStore',
+        ':fragment_cache': {'.string': {}},
     },
 
     {
@@ -89,6 +159,8 @@ spec_list = [
     {
         '.processor.handler.*': {},
         ':post_handler': {'.string': {}},
+        ':response_cache': {'.string': {}},
+        ':fragment_cache': {'.string': {}},
     },
 
     {
@@ -118,6 +190,18 @@ spec_list = [
         'module_path': 'apimas_django.handlers.DeleteHandler',
     },
 
+    {
+        '.processor.handler.bulk_update': {},
+        'module_path': 'apimas_django.handlers.BulkUpdateHandler',
+        ':optimistic_concurrency': {'.boolean': {}},
+        ':version_field': {'.string': {}},
+    },
+
+    {
+        '.processor.handler.bulk_delete': {},
+        'module_path': 'apimas_django.handlers.BulkDeleteHandler',
+    },
+
     {
         '.action.django.*': {},
         'method': {'.string': {}},
@@ -151,8 +235,9 @@ spec_list = [
                 '08': {'.processor.permissions.read.nonstrict': {}},
                 '09': {'.processor.response_filtering_resource': {}},
                 '10': {'.processor.read_permission_check': {}},
-                '11': {'.processor.instance_to_dict': {}},
-                '12': {'.processor.export_data': {}},
+                '11': {'.processor.etag': {}},
+                '12': {'.processor.instance_to_dict': {}},
+                '13': {'.processor.export_data': {}},
             },
         },
     },
@@ -166,6 +251,40 @@ spec_list = [
             'content_type': 'application/json',
             'on_collection': True,
             'url': '/',
+            'processors': {
+                '01': {'.processor.authentication': {}},
+                '02': {'.processor.user_retrieval': {}},
+                '03': {'.processor.permissions.read': {}},
+                '04': {'.processor.import_params': {}},
+                '05': {'.processor.response_cache': {}},
+                '06': {'.processor.handler.list': {}},
+                '07': {'.processor.response_filtering_collection': {}},
+                '08': {'.processor.filtering': {}},
+                '09': {'.processor.search': {}},
+                '10': {'.processor.validators': {}},
+                '11': {'.processor.ordering': {}},
+                '12': {'.processor.pagination': {}},
+                '13': {'.processor.read_permission_check': {}},
+                '14': {'.processor.fragment_cache': {}},
+                '15': {'.processor.instance_to_dict': {}},
+                '16': {'.processor.export_data': {}},
+                '17': {'.processor.fragment_cache_store': {}},
+                '18': {'.processor.expand': {}},
+                '19': {'.processor.response_cache_store': {}},
+            }
+        },
+    },
+
+    {
+        '.action-template.django.aggregate': {},
+        'aggregate': {
+            '.action.django': {},
+            'method': 'GET',
+            'status_code': 200,
+            'content_type': 'application/json',
+            'on_collection': True,
+            ':permissions_read': 'list',
+            'url': '/aggregate/',
             'processors': {
                 '01': {'.processor.authentication': {}},
                 '02': {'.processor.user_retrieval': {}},
@@ -174,12 +293,35 @@ spec_list = [
                 '05': {'.processor.handler.list': {}},
                 '06': {'.processor.response_filtering_collection': {}},
                 '07': {'.processor.filtering': {}},
-                '08': {'.processor.search': {}},
-                '09': {'.processor.ordering': {}},
-                '10': {'.processor.pagination': {}},
-                '11': {'.processor.read_permission_check': {}},
-                '12': {'.processor.instance_to_dict': {}},
-                '13': {'.processor.export_data': {}},
+                '08': {'.processor.aggregate': {}},
+                '09': {'.processor.export_aggregates': {}},
+            }
+        },
+    },
+
+    {
+        '.action-template.django.changes': {},
+        'changes': {
+            '.action.django': {},
+            'method': 'GET',
+            'status_code': 200,
+            'content_type': 'application/json',
+            'on_collection': True,
+            ':permissions_read': 'list',
+            'url': '/changes/',
+            'processors': {
+                '01': {'.processor.authentication': {}},
+                '02': {'.processor.user_retrieval': {}},
+                '03': {'.processor.permissions.read': {}},
+                '04': {'.processor.import_params': {}},
+                '05': {'.processor.handler.list': {}},
+                '06': {'.processor.response_filtering_collection': {}},
+                '07': {'.processor.filtering': {}},
+                '08': {'.processor.changes': {}},
+                '09': {'.processor.read_permission_check': {}},
+                '10': {'.processor.instance_to_dict': {}},
+                '11': {'.processor.export_data': {}},
+                '12': {'.processor.expand': {}},
             }
         },
     },
@@ -197,11 +339,17 @@ spec_list = [
                 '01': {'.processor.authentication': {}},
                 '02': {'.processor.user_retrieval': {}},
                 '03': {'.processor.permissions.read': {}},
-                '04': {'.processor.handler.retrieve': {}},
-                '05': {'.processor.response_filtering_resource.strict': {}},
-                '06': {'.processor.read_permission_check.strict': {}},
-                '07': {'.processor.instance_to_dict': {}},
-                '08': {'.processor.export_data': {}},
+                '04': {'.processor.import_params': {}},
+                '05': {'.processor.response_cache': {}},
+                '06': {'.processor.handler.retrieve': {}},
+                '07': {'.processor.response_filtering_resource.strict': {}},
+                '08': {'.processor.read_permission_check.strict': {}},
+                '09': {'.processor.etag': {}},
+                '10': {'.processor.validators': {}},
+                '11': {'.processor.instance_to_dict': {}},
+                '12': {'.processor.export_data': {}},
+                '13': {'.processor.expand': {}},
+                '14': {'.processor.response_cache_store': {}},
             }
         },
     },
@@ -225,8 +373,9 @@ spec_list = [
             '09': {'.processor.permissions.read.nonstrict': {}},
             '10': {'.processor.response_filtering_resource': {}},
             '11': {'.processor.read_permission_check': {}},
-            '12': {'.processor.instance_to_dict': {}},
-            '13': {'.processor.export_data': {}},
+            '12': {'.processor.etag': {}},
+            '13': {'.processor.instance_to_dict': {}},
+            '14': {'.processor.export_data': {}},
         },
     },
 
@@ -264,8 +413,9 @@ spec_list = [
                 '09': {'.processor.permissions.read.nonstrict': {}},
                 '10': {'.processor.response_filtering_resource': {}},
                 '11': {'.processor.read_permission_check': {}},
-                '12': {'.processor.instance_to_dict': {}},
-                '13': {'.processor.export_data': {}},
+                '12': {'.processor.etag': {}},
+                '13': {'.processor.instance_to_dict': {}},
+                '14': {'.processor.export_data': {}},
             },
         },
     },
@@ -289,7 +439,62 @@ spec_list = [
                 '05': {'.processor.handler.delete': {}},
             }
         },
-    }
+    },
+
+    {
+        '.action-template.django.bulk_update': {},
+        'bulk_update': {
+            '.action.django': {},
+            'method': 'PATCH',
+            'status_code': 200,
+            'content_type': 'application/json',
+            'on_collection': False,
+            'url': '/',
+            'transaction_begin_before': '09',
+            'transaction_end_after': '13',
+            'processors': {
+                '01': {'.processor.authentication': {}},
+                '02': {'.processor.user_retrieval': {}},
+                '03': {'.processor.permissions.write': {}},
+                '04': {'.processor.permissions.read': {}},
+                '05': {'.processor.import_params': {}},
+                '06': {'.processor.import_write_data': {}},
+                '07': {'.processor.load_data.partial': {}},
+                '08': {'.processor.write_permission_check': {}},
+                '09': {'.processor.handler.list': {}},
+                '10': {'.processor.response_filtering_collection': {}},
+                '11': {'.processor.filtering': {}},
+                '12': {'.processor.search': {}},
+                '13': {'.processor.handler.bulk_update': {}},
+            },
+        },
+    },
+
+    {
+        '.action-template.django.bulk_delete': {},
+        'bulk_delete': {
+            '.action.django': {},
+            'method': 'DELETE',
+            'status_code': 200,
+            'content_type': 'application/json',
+            'on_collection': False,
+            'url': '/',
+            'transaction_begin_before': '06',
+            'transaction_end_after': '10',
+            'processors': {
+                '01': {'.processor.authentication': {}},
+                '02': {'.processor.user_retrieval': {}},
+                '03': {'.processor.permissions.write': {}},
+                '04': {'.processor.permissions.read': {}},
+                '05': {'.processor.import_params': {}},
+                '06': {'.processor.handler.list': {}},
+                '07': {'.processor.response_filtering_collection': {}},
+                '08': {'.processor.filtering': {}},
+                '09': {'.processor.search': {}},
+                '10': {'.processor.handler.bulk_delete': {}},
+            },
+        },
+    },
 ]
 
 for spec in spec_list:
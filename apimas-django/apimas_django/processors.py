@@ -1,7 +1,10 @@
-from django.db.models  import Model
+from django.db import connections, router
+from django.db.models  import Model, Count, OuterRef, Subquery
 from django.db.models.query import QuerySet
+from apimas import utils
 from apimas.errors import InvalidInput
 from apimas.components import BaseProcessor, ProcessorConstruction
+from apimas_django.annotations import annotate
 import docular
 
 
@@ -28,6 +31,14 @@ def construct_file(instance, loc, context):
     docular.doc_spec_set(instance, v)
 
 
+def construct_annotation(context, instance):
+    docular.construct_last(context)
+    value = docular.doc_spec_get(instance)
+    value['annotation'] = (docular.doc_spec_get(instance, 'function'),
+                           docular.doc_spec_get(instance, 'over'))
+    docular.doc_spec_set(instance, value)
+
+
 def construct_struct(instance, loc):
     source = docular.doc_spec_get(instance.get('source', {}),
                                   default=loc[-1])
@@ -36,12 +47,70 @@ def construct_struct(instance, loc):
     docular.doc_spec_set(instance, v)
 
 
-def construct_collection(instance, loc, context):
+class EmbedPlan(object):
+    """
+    How to embed a bounded subcollection: its first `limit` elements, the
+    count of all of them and the URL of the subcollection.
+
+    The URL has a `%s` placeholder for the key of each resource the
+    subcollection is nested in, outermost first.
+    """
+    __slots__ = ('model', 'bound', 'bound_key', 'limit', 'ordering', 'url',
+                 'depth', 'annotations')
+
+    def __init__(self, model, bound, limit, url, depth, annotations):
+        self.model = model
+        self.bound = bound
+        self.bound_key = model._meta.get_field(bound).attname
+        self.limit = limit
+        self.ordering = tuple(model._meta.ordering) or ('pk',)
+        self.url = url
+        self.depth = depth
+        self.annotations = annotations
+
+    def get_url(self, keys):
+        if len(keys) != self.depth:
+            return None
+        return self.url % tuple(keys)
+
+
+def mk_collection_url(loc, root_url):
+    segments = [loc[1]]
+    for i, name in enumerate(loc[3:]):
+        segments.append('%s' if i % 2 else name)
+    path = '/'.join(segments) + '/'
+    url = utils.urljoin(root_url, path) if root_url else path
+    return url, segments.count('%s')
+
+
+def construct_embed(instance, loc, config):
+    embed_limit = docular.doc_spec_get(instance, 'embed_limit')
+    if embed_limit is None:
+        return None
+
+    bound = docular.doc_spec_get(instance, 'bound')
+    if bound is None:
+        raise InvalidInput("'embed_limit' requires a bound subcollection")
+
+    model = utils.import_object(docular.doc_spec_get(instance['model']))
+    root_url = docular.doc_spec_get(config.get(':root_url', {}))
+    url, depth = mk_collection_url(loc, root_url)
+    annotations = {}
+    for name, value in docular.doc_spec_iter_values(instance['fields']):
+        if value and 'annotation' in value:
+            annotations[name] = (value['source'],) + value['annotation']
+    return EmbedPlan(model, bound, embed_limit, url, depth, annotations)
+
+
+def construct_collection(instance, loc, context, config):
     docular.construct_last(context)
     source = docular.doc_spec_get(instance.get('source', {}),
                                   default=loc[-1])
     fields = dict(docular.doc_spec_iter_values(instance['fields']))
-    value = {'source': source, 'fields': fields, 'field_type': 'collection'}
+    id_field = docular.doc_spec_get(instance, 'id_field', default='id')
+    key = (fields.get(id_field) or {}).get('source', id_field)
+    value = {'source': source, 'fields': fields, 'field_type': 'collection',
+             'embed': construct_embed(instance, loc, config), 'key': key}
     docular.doc_spec_set(instance, value)
 
 
@@ -55,6 +124,7 @@ INSTANCETODICT_CONSTRUCTORS = docular.doc_spec_init_constructor_registry(
     {'.field.*': construct_field,
      '.field.struct': construct_struct,
      '.field.file': construct_file,
+     '.field.annotation': construct_annotation,
      '.action': construct_action,
      '.field.collection.django': construct_collection,
     },
@@ -68,9 +138,139 @@ def access_relation(value, key):
     return value.all()
 
 
+class FieldPlan(object):
+    """
+    How to read a field off a model instance.
+
+    Compiled once from the constructed field spec, so that no spec dicts
+    are consulted or kept at request time. The elements of a subcollection
+    are keyed in URLs by the source of its `id_field`, given as `key`.
+    """
+    __slots__ = ('name', 'path', 'field_type', 'fields', 'embed', 'key')
+
+    def __init__(self, name, path, field_type, fields, embed=None, key=None):
+        self.name = name
+        self.path = path
+        self.field_type = field_type
+        self.fields = fields
+        self.embed = embed
+        self.key = key
+
+
+def compile_field_plans(spec):
+    plans = []
+    for name, value in spec.iteritems():
+        source = value['source'] if value else name
+        fields = value.get('fields') if value else None
+        field_type = value.get('field_type') if value else None
+        embed = value.get('embed') if value else None
+        key = value.get('key') if value else None
+        subplans = compile_field_plans(fields) if fields else None
+        plans.append(FieldPlan(name, tuple(source.split('.')), field_type,
+                               subplans, embed, key))
+    return tuple(plans)
+
+
+def select_field_plans(plans, fields):
+    """
+    Narrow field plans to the fields selected by the request, so that
+    relations of fields that are not exported are not accessed.
+    """
+    selected = []
+    for plan in plans:
+        subfields = fields.get(plan.name)
+        if not subfields:
+            continue
+        if plan.fields and isinstance(subfields, dict):
+            plan = FieldPlan(plan.name, plan.path, plan.field_type,
+                             select_field_plans(plan.fields, subfields),
+                             plan.embed, plan.key)
+        selected.append(plan)
+    return tuple(selected)
+
+
+def allows_sliced_subqueries(model):
+    connection = connections[router.db_for_read(model)]
+    return connection.features.allow_sliced_subqueries
+
+
+def fetch_embedded(embed, parents):
+    """
+    Fetch the first elements of a bounded subcollection for each of the
+    given parents, and the count of all their elements.
+
+    The elements are limited per parent in the database, with a correlated
+    subquery, so that two queries are run regardless of the number of
+    parents or elements. Backends that cannot limit the rows of a subquery,
+    such as MySQL, fetch the elements with one query per parent that has
+    any.
+    """
+    model = embed.model
+    keys = [parent.pk for parent in parents]
+    objects = model.objects.filter(**{embed.bound + '__in': keys})
+    counts = dict(objects.order_by().values_list(embed.bound_key).annotate(
+        Count('pk')))
+
+    elements = {}
+    if not allows_sliced_subqueries(model):
+        for key in keys:
+            if not counts.get(key):
+                continue
+            subobjects = annotate(model.objects.filter(**{embed.bound: key}),
+                                  embed.annotations)
+            elements[key] = list(
+                subobjects.order_by(*embed.ordering)[:embed.limit])
+        return elements, counts
+
+    first = model.objects.filter(
+        **{embed.bound: OuterRef(embed.bound_key)}).order_by(
+            *embed.ordering).values('pk')[:embed.limit]
+    objects = annotate(objects.filter(pk__in=Subquery(first)),
+                       embed.annotations)
+    for obj in objects.order_by(*embed.ordering):
+        elements.setdefault(getattr(obj, embed.bound_key), []).append(obj)
+    return elements, counts
+
+
+def fetch_embedded_plans(plans, parents):
+    embedded = {}
+    if not parents:
+        return embedded
+    for plan in plans:
+        if plan.embed is not None:
+            embedded[plan.name] = fetch_embedded(plan.embed, parents)
+    return embedded
+
+
+def get_key(instance, key):
+    """
+    Get the key of an instance in URLs: the value of the `key` source, i.e.
+    of the `id_field` of its collection, or else its primary key.
+    """
+    if key is None:
+        return instance.pk
+    for elem in key.split('.'):
+        instance = getattr(instance, elem)
+    return instance
+
+
+def get_parent_keys(kwargs):
+    """
+    Get the keys of the resources a collection is nested in, outermost
+    first, from the URL arguments of a request.
+    """
+    keys = []
+    while kwargs and ('id' + str(len(keys))) in kwargs:
+        keys.append(kwargs['id' + str(len(keys))])
+    return tuple(reversed(keys))
+
+
 class InstanceToDictProcessor(BaseProcessor):
     READ_KEYS = {
         'instance': 'backend/checked_response',
+        'fields': 'imported/fields',
+        'kwargs': 'request/meta/kwargs',
+        'fragments': 'backend/fragments',
     }
 
     WRITE_KEYS = (
@@ -78,37 +278,63 @@ class InstanceToDictProcessor(BaseProcessor):
     )
 
     def __init__(self, collection_loc, action_name,
-                 source, fields, field_type, on_collection):
-        self.collection_spec = {'source': source,
-                                'fields': fields,
-                                'field_type': field_type}
+                 source, fields, field_type, on_collection, embed=None,
+                 key=None):
         self.on_collection = on_collection
-        self.field_spec = fields
+        self.field_plans = compile_field_plans(fields)
+        self.key = key
 
-    def to_dict(self, instance, spec):
+    def embed_collection(self, instance, plan, keys, embedded):
+        if plan.name in embedded:
+            elements, counts = embedded[plan.name]
+        else:
+            elements, counts = fetch_embedded(plan.embed, [instance])
+        subvalues = elements.get(instance.pk, [])
+        subembedded = fetch_embedded_plans(plan.fields, subvalues)
+        return {
+            'count': counts.get(instance.pk, 0),
+            'url': plan.embed.get_url(keys),
+            'results': [self.to_dict(subvalue, plan.fields, keys, subembedded,
+                                     plan.key)
+                        for subvalue in subvalues],
+        }
+
+    def to_dict(self, instance, plans, keys=(), embedded=None, key=None):
+        """
+        Read the fields of an instance into a dict.
+
+        `keys` are the keys of the resources the instance is nested in,
+        outermost first, and `key` the source of the key of the instance
+        itself. Bounded subcollections are read from `embedded`, if fetched
+        beforehand for the instance.
+        """
         if instance is None:
             return None
 
+        subkeys = keys + (get_key(instance, key),)
         data = {}
-        for k, v in spec.iteritems():
-            source = v['source'] if v else k
-            fields = v.get('fields') if v else None
-            fields_type = v.get('field_type') if v else None
+        for plan in plans:
+            if plan.embed is not None:
+                data[plan.name] = self.embed_collection(
+                    instance, plan, subkeys, embedded or {})
+                continue
+
             value = instance
-            for elem in source.split('.'):
+            for elem in plan.path:
                 if value is None:
                     break
                 value = getattr(value, elem)
 
-            if fields:
-                if fields_type == 'collection':
+            if plan.fields:
+                if plan.field_type == 'collection':
                     subvalues = access_relation(value, key=instance)
-                    value = [self.to_dict(subvalue, fields)
+                    value = [self.to_dict(subvalue, plan.fields, subkeys,
+                                          key=plan.key)
                              for subvalue in subvalues]
-                elif fields_type == 'struct':
-                    value = self.to_dict(value, fields)
+                elif plan.field_type == 'struct':
+                    value = self.to_dict(value, plan.fields, subkeys)
 
-            data[k] = value
+            data[plan.name] = value
         return data
 
     def execute(self, processor_data):
@@ -122,11 +348,25 @@ class InstanceToDictProcessor(BaseProcessor):
             msg = 'Unexpected type {!r} found.'
             raise InvalidInput(msg.format(type(instance)))
 
-        if not self.on_collection:
-            instance = None if instance is None else self.to_dict(
-                instance, self.field_spec)
+        plans = self.field_plans
+        fields = processor_data['fields']
+        if fields is not None:
+            plans = select_field_plans(plans, fields)
+        keys = get_parent_keys(processor_data['kwargs'])
+
+        if not self.on_collection and not isinstance(instance, list):
+            embedded = fetch_embedded_plans(plans, [instance])
+            instance = self.to_dict(instance, plans, keys, embedded,
+                                    self.key)
         else:
-            instance = [self.to_dict(inst, self.field_spec)
+            instance = list(instance)
+            fragments = processor_data['fragments']
+            if fragments is not None:
+                # Rows with cached fragments are not read again.
+                instance = [inst for inst, (_, fragment)
+                            in zip(instance, fragments) if fragment is None]
+            embedded = fetch_embedded_plans(plans, instance)
+            instance = [self.to_dict(inst, plans, keys, embedded, self.key)
                         for inst in instance]
         return (instance,)
 
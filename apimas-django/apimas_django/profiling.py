@@ -0,0 +1,175 @@
+import sys
+import time
+from collections import OrderedDict
+
+import docular
+from apimas import utils
+from apimas_django import provider
+from apimas_django.collect_construction import (
+    collect_processors, COLLECT_CONSTRUCTORS)
+
+
+def deep_getsizeof(obj):
+    """
+    Estimate the memory retained by an object and everything it refers to.
+
+    Containers, instance dicts and slots are followed; modules, classes and
+    functions are counted but not followed, since they are shared with the
+    rest of the process. Each object is counted once.
+    """
+    seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+
+        if isinstance(obj, (basestring, int, long, float, bool, type(None))):
+            continue
+        if isinstance(obj, (type, type(sys), type(deep_getsizeof))):
+            continue
+
+        if isinstance(obj, dict):
+            stack.extend(obj.iterkeys())
+            stack.extend(obj.itervalues())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+
+        obj_dict = getattr(obj, '__dict__', None)
+        if isinstance(obj_dict, dict):
+            stack.append(obj_dict)
+        for slot in getattr(type(obj), '__slots__', ()):
+            if hasattr(obj, slot):
+                stack.append(getattr(obj, slot))
+    return size
+
+
+def count_nodes(spec):
+    count = 0
+    stack = [spec]
+    while stack:
+        node = stack.pop()
+        count += 1
+        for key, value in node.iteritems():
+            if key[:1] != '=' and isinstance(value, dict):
+                stack.append(value)
+    return count
+
+
+def name_processor_registries(processors):
+    """
+    Name the constructor registries of processors.
+
+    A registry used by a single processor is named after the processor.
+    A shared registry is named after the module variable holding it.
+    """
+    registries = OrderedDict()
+    for processor in sorted(processors):
+        constructors = utils.import_object(processor).constructors
+        registries.setdefault(id(constructors), (constructors, []))
+        registries[id(constructors)][1].append(processor)
+
+    for constructors, names in registries.itervalues():
+        name = ', '.join(names)
+        if len(names) > 1:
+            name = name_module_variable(constructors, names) or name
+        yield constructors, name
+
+
+def name_module_variable(obj, names):
+    """
+    Name the module variable holding `obj`, searching the modules of the
+    given dotted names; `None` if none of them holds it.
+    """
+    module_names = sorted(set(name.rsplit('.', 1)[0] for name in names))
+    for module_name in module_names:
+        module = sys.modules[module_name]
+        for var, value in sorted(vars(module).iteritems()):
+            if value is obj:
+                return module_name + '.' + var
+    return None
+
+
+def profile_spec(app_config, deploy_config=None):
+    """
+    Configure and construct an apimas app, measuring each phase.
+
+    Returns a dict with the wall time of each phase, the construction
+    statistics (a docular.ConstructionProfile), the number of nodes and the
+    retained memory of the constructed spec and of its ':artifacts'.
+    """
+    phases = OrderedDict()
+
+    started = time.time()
+    app_spec = provider.configure_apimas_app(app_config)
+    phases['configure_apimas_app'] = time.time() - started
+
+    started = time.time()
+    spec = provider.configure_spec(app_spec, deploy_config or {})
+    phases['configure_spec'] = time.time() - started
+
+    nodes = count_nodes(spec)
+
+    profile = docular.ConstructionProfile()
+    profile.name_registry(provider.REGISTERED_CONSTRUCTORS,
+                          'apimas_django.provider')
+    profile.name_registry(COLLECT_CONSTRUCTORS,
+                          'apimas_django.collect_construction')
+    for constructors, name in name_processor_registries(
+            collect_processors(spec)):
+        profile.name_registry(constructors, name)
+
+    with profile:
+        started = time.time()
+        provider.construct_views(spec)
+        phases['construct_views'] = time.time() - started
+
+    artifacts = docular.doc_spec_get(spec, ':artifacts')
+    return {
+        'phases': phases,
+        'profile': profile,
+        'nodes': nodes,
+        'spec_size': deep_getsizeof(spec),
+        'artifacts_size': deep_getsizeof(artifacts),
+    }
+
+
+def format_report(report, top=20):
+    profile = report['profile']
+    lines = []
+
+    lines.append('Phases:')
+    for phase, seconds in report['phases'].iteritems():
+        lines.append('  %-56s %10.3fs' % (phase, seconds))
+
+    lines.append('Constructor registries:')
+    registry_times = profile.registry_times()
+    for registry, seconds in sorted(registry_times.iteritems(),
+                                    key=lambda x: -x[1]):
+        lines.append('  %-56s %10.3fs' % (registry, seconds))
+    # configuration merging and spec copying between constructors
+    outside = report['phases']['construct_views'] - sum(
+        registry_times.itervalues())
+    lines.append('  %-56s %10.3fs' % ('(outside constructors)', outside))
+
+    lines.append('Predicates (top %d):' % top)
+    lines.append('  %-56s %-24s %8s %8s %10s' % (
+        'registry', 'predicate', 'calls', 'defers', 'time'))
+    predicate_stats = sorted(profile.constructors.iteritems(),
+                             key=lambda x: -x[1][2])
+    for (registry, predicate), (calls, defers, seconds) in \
+            predicate_stats[:top]:
+        lines.append('  %-56s %-24s %8d %8d %9.3fs' % (
+            registry, predicate, calls, defers, seconds))
+
+    lines.append('Spec nodes: %d' % report['nodes'])
+    lines.append('Constructed nodes: %d' % profile.nodes)
+    lines.append('Deferral rounds: %d (max %d per node)' % (
+        profile.rounds, profile.max_rounds))
+    lines.append('Retained memory of spec: %d bytes' % report['spec_size'])
+    lines.append('Retained memory of :artifacts: %d bytes' %
+                 report['artifacts_size'])
+    return '\n'.join(lines)
@@ -1,12 +1,16 @@
+import gc
 import logging
 import copy
+import threading
 from django.conf.urls import url
+from django.core.urlresolvers import clear_url_caches
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 from apimas import utils
 from apimas.errors import InvalidSpec
 from apimas_django.execution import ApimasAction
-from apimas_django.wrapper import django_views
+from apimas_django.wrapper import django_views, django_lazy_views
+from apimas_django.batch import get_batch_config, mk_batch_urls
 from apimas_django.predicates import PREDICATES
 from apimas_django.collect_construction import collect_processors
 
@@ -217,14 +221,28 @@ def endpoint_constructor(instance):
     docular.doc_spec_set(instance, views)
 
 
+def mk_django_url(urlpattern, methods, django_view):
+    http_methods = require_http_methods(methods)
+    django_view = csrf_exempt(http_methods(django_view))
+    return url(urlpattern, django_view)
+
+
+def sort_url_items(url_items):
+    """
+    Order URL patterns so that literal segments are matched before named
+    ones, e.g. `posts/aggregate/` before `posts/(?P<pk>...)/`.
+    """
+    return sorted(url_items, key=lambda item: (item[0].count('(?P<'),
+                                                item[0]))
+
+
 def mk_django_urls(action_urls):
     urls = []
-    for urlpattern, method_actions in action_urls.iteritems():
+    for urlpattern, method_actions in sort_url_items(
+            action_urls.iteritems()):
         django_view = django_views(method_actions)
         methods = method_actions.keys()
-        http_methods = require_http_methods(methods)
-        django_view = csrf_exempt(http_methods(django_view))
-        urls.append(url(urlpattern, django_view))
+        urls.append(mk_django_url(urlpattern, methods, django_view))
     return urls
 
 
@@ -234,6 +252,7 @@ def apimas_app_constructor(instance):
             instance['endpoints']):
         for collection, collection_patterns in endpoint_patterns.iteritems():
             urlpatterns.extend(collection_patterns)
+    urlpatterns.extend(mk_batch_urls(*get_batch_config(instance)))
     logger.info("Built URL patterns:")
     for urlpattern in urlpatterns:
         logger.info(urlpattern)
@@ -284,9 +303,323 @@ def configure_spec(spec, config):
     return docular.doc_spec_config(spec, config, PREDICATES)
 
 
-def construct_views(spec):
+def construct_spec(spec):
     processors = collect_processors(spec)
     artifacts = construct_processors(processors, spec)
     spec[':artifacts'] = {'=': artifacts}
     docular.doc_spec_construct(spec, PREDICATES, REGISTERED_CONSTRUCTORS)
+
+
+def construct_views(spec, lazy=False, warmup=False, compact=False):
+    """
+    Construct the django URL patterns of a configured apimas app spec.
+
+    By default, every collection is constructed before returning. If `lazy`
+    is true, only the URL patterns are computed up front and each top-level
+    collection is constructed on its first request. If `warmup` is also true,
+    a background thread constructs the remaining collections in advance.
+
+    If `compact` is true (and `lazy` is not), the spec is released after
+    construction; see `release_spec()`.
+    """
+    if lazy:
+        app = LazyApimasApp(spec)
+        if warmup:
+            app.warmup()
+        return app.urlpatterns
+
+    construct_spec(spec)
+    if compact:
+        return release_spec(spec)
     return docular.doc_spec_get(spec)
+
+
+def release_spec(spec):
+    """
+    Drop the construction state of a constructed spec.
+
+    The spec, including ':artifacts' and every intermediate value, is emptied
+    in place, so that it is freed even if the caller still refers to it.
+    Only the django URL patterns and the runtime objects they reach are kept.
+
+    Returns the django URL patterns.
+    """
+    urlpatterns = docular.doc_spec_get(spec)
+    spec.clear()
+    return urlpatterns
+
+
+def prepare_fork(app=None):
+    """
+    Prepare a process that is about to fork workers.
+
+    If a LazyApimasApp is given, all its collections are constructed and
+    their construction specs are released. Then unreachable objects are
+    collected and, if the interpreter supports it (python 3.7+), the
+    surviving objects are moved to the permanent generation, so that the
+    garbage collector of the workers does not write to, and thus copy, the
+    pages they share with the parent.
+    """
+    if app is not None:
+        app.compact()
+    gc.collect()
+    freeze = getattr(gc, 'freeze', None)
+    if freeze is not None:
+        freeze()
+
+
+def iter_collection_urls(collection_spec, loc):
+    collection_path = mk_url_prefix(loc)
+    actions = collection_spec.get('actions') or {}
+    for action_name, action_spec in docular.doc_spec_iter(actions):
+        if action_name == '*':
+            continue
+        action_loc = loc + ('actions', action_name)
+        method = docular.doc_spec_get(action_spec, 'method')
+        action_url = docular.doc_spec_get(action_spec, 'url')
+        if method is None:
+            msg = 'HTTP method not found for action {!r}'.format(action_name)
+            raise InvalidSpec(msg, loc=action_loc)
+        if action_url is None:
+            msg = 'URL not found for action {!r}'.format(action_name)
+            raise InvalidSpec(msg, loc=action_loc)
+        yield _construct_url(collection_path, action_url), method.upper()
+
+    fields = collection_spec.get('fields') or {}
+    for field_name, field_spec in docular.doc_spec_iter(fields):
+        if field_spec and '.field.collection' in field_spec:
+            subloc = loc + ('fields', field_name)
+            for urlpattern, method in iter_collection_urls(field_spec,
+                                                           subloc):
+                yield urlpattern, method
+
+
+def select_spec_key(spec, key):
+    """
+    Shallow-copy a compiled spec node, dropping all data keys except `key`.
+    """
+    selected = {k: v for k, v in spec.iteritems()
+                if k == key or k[:1] in '=.:' or k[-1:] == '*'}
+    selected['=k'] = [k for k in spec['=k'] if k in selected]
+    return selected
+
+
+def select_collection_spec(spec, endpoint, collection):
+    """
+    Make an app spec that only contains the given top-level collection.
+
+    The nodes on the path to the collection are copied, the rest of the
+    spec is shared with the original.
+    """
+    endpoints = select_spec_key(spec['endpoints'], endpoint)
+    endpoint_spec = dict(endpoints[endpoint])
+    endpoint_spec['collections'] = select_spec_key(
+        endpoint_spec['collections'], collection)
+    endpoints[endpoint] = endpoint_spec
+    app_spec = dict(spec)
+    app_spec['endpoints'] = endpoints
+    return app_spec
+
+
+def inherited_config(spec, endpoint):
+    """
+    Collect the configuration keys a collection inherits from its app
+    and endpoint.
+    """
+    endpoint_spec = spec['endpoints'][endpoint]
+    config = {}
+    for node in (spec, endpoint_spec):
+        for key, value in node.iteritems():
+            if key[:1] == ':':
+                config[key] = value
+    return config
+
+
+class LazyCollectionViews(object):
+    """
+    The views of a top-level collection, constructed on first use.
+
+    Construction works on a private deep copy of the collection spec so that
+    collections can be constructed concurrently.
+    """
+
+    def __init__(self, spec, endpoint, collection):
+        collection_spec = spec['endpoints'][endpoint]['collections'][
+            collection]
+        self.spec = select_collection_spec(spec, endpoint, collection)
+        self.loc = ('endpoints', endpoint, 'collections', collection)
+        self.fingerprint = docular.doc_spec_fingerprint(
+            collection_spec, inherited_config(spec, endpoint))
+        self.url_methods = {}
+        for urlpattern, method in iter_collection_urls(collection_spec,
+                                                       self.loc):
+            self.url_methods.setdefault(urlpattern, []).append(method)
+        self.urls = mk_lazy_django_urls(self)
+        self.lock = threading.Lock()
+        self.views = None
+
+    def construct(self):
+        logger.info("Constructing collection %s on demand", self.loc)
+        spec = copy.deepcopy(self.spec)
+        construct_spec(spec)
+        return docular.doc_spec_get(docular.doc_get(spec, self.loc))
+
+    def get_views(self):
+        views = self.views
+        if views is None:
+            with self.lock:
+                if self.views is None:
+                    self.views = self.construct()
+                views = self.views
+        return views
+
+    def get_actions(self, urlpattern):
+        return self.get_views()[urlpattern]
+
+    def replace(self, other):
+        """
+        Take over the spec and views of another holder of the same collection.
+
+        The django URLs of this holder keep serving, now with the views of
+        `other`.
+        """
+        with self.lock:
+            self.spec = other.spec
+            self.fingerprint = other.fingerprint
+            self.views = other.views
+
+
+class LazyApimasApp(object):
+    """
+    Register the URL patterns of an apimas app without constructing it.
+
+    The URL patterns are computed from the endpoint, collection and action
+    URLs of the spec. The processors of each top-level collection are
+    constructed when one of its URLs is first requested.
+    """
+
+    def __init__(self, spec):
+        self.collections = list(self.iter_collection_views(spec))
+        self.batch_config = get_batch_config(spec)
+        self.batch_urls = mk_batch_urls(*self.batch_config)
+        self.urlpatterns = []
+        for collection_views in self.collections:
+            self.urlpatterns.extend(collection_views.urls)
+        self.urlpatterns.extend(self.batch_urls)
+
+        logger.info("Registered URL patterns:")
+        for urlpattern in self.urlpatterns:
+            logger.info(urlpattern)
+
+    @staticmethod
+    def iter_collection_views(spec):
+        for endpoint, endpoint_spec in docular.doc_spec_iter(
+                spec['endpoints']):
+            for name, collection_spec in docular.doc_spec_iter(
+                    endpoint_spec['collections']):
+                yield LazyCollectionViews(spec, endpoint, name)
+
+    def construct_all(self):
+        for collection_views in self.collections:
+            try:
+                collection_views.get_views()
+            except Exception:
+                logger.exception("Failed to construct collection %s",
+                                 collection_views.loc)
+
+    def compact(self):
+        """
+        Construct all collections and drop their construction specs.
+
+        Collections that fail to construct keep their spec, so that they
+        are retried on request.
+        """
+        self.construct_all()
+        for collection_views in self.collections:
+            if collection_views.views is not None:
+                collection_views.spec = None
+
+    def warmup(self):
+        thread = threading.Thread(target=self.construct_all,
+                                  name='apimas-warmup')
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def reconstruct(self, spec):
+        """
+        Switch the app to a new configured spec.
+
+        Only the top-level collections whose spec or inherited configuration
+        changed are reconstructed. Collections that had already been
+        constructed are reconstructed before anything is switched, so that a
+        construction error leaves the app as it was; the others stay lazy.
+
+        A changed collection that serves the same URL patterns and methods
+        keeps its django URLs and only has its views swapped. Otherwise,
+        `urlpatterns` is updated in place and django's URL caches are
+        cleared; the URL conf must include this list (not a copy of it) to
+        pick up such changes.
+
+        Returns the locations of the changed collections.
+        """
+        old_collections = {c.loc: c for c in self.collections}
+        collections = []
+        changed = []
+        swaps = []
+        urls_changed = False
+        for collection_views in self.iter_collection_views(spec):
+            loc = collection_views.loc
+            old_views = old_collections.pop(loc, None)
+            if old_views is not None and \
+               old_views.fingerprint == collection_views.fingerprint:
+                collections.append(old_views)
+                continue
+
+            changed.append(loc)
+            if old_views is not None and old_views.views is not None:
+                collection_views.get_views()
+
+            if old_views is not None and \
+               old_views.url_methods == collection_views.url_methods:
+                swaps.append((old_views, collection_views))
+                collections.append(old_views)
+            else:
+                urls_changed = True
+                collections.append(collection_views)
+
+        for loc in old_collections:
+            changed.append(loc)
+            urls_changed = True
+
+        for old_views, collection_views in swaps:
+            old_views.replace(collection_views)
+
+        batch_config = get_batch_config(spec)
+        if batch_config != self.batch_config:
+            self.batch_config = batch_config
+            self.batch_urls = mk_batch_urls(*batch_config)
+            urls_changed = True
+
+        if urls_changed:
+            self.collections[:] = collections
+            urlpatterns = []
+            for collection_views in collections:
+                urlpatterns.extend(collection_views.urls)
+            urlpatterns.extend(self.batch_urls)
+            self.urlpatterns[:] = urlpatterns
+            clear_url_caches()
+
+        logger.info("Reconstructed collections: %s", changed)
+        return changed
+
+
+def mk_lazy_django_urls(collection_views):
+    urls = []
+    for urlpattern, methods in sort_url_items(
+            collection_views.url_methods.iteritems()):
+        load_actions = lambda urlpattern=urlpattern: \
+            collection_views.get_actions(urlpattern)
+        django_view = django_lazy_views(load_actions)
+        urls.append(mk_django_url(urlpattern, methods, django_view))
+    return urls
@@ -94,7 +94,7 @@ class SearchProcessor(BaseProcessor):
         search_value = context_data['imported_search']
         queryset = context_data['queryset']
 
-        if not queryset or not search_value:
+        if queryset is None or not search_value:
             return
 
         if not isinstance(queryset, QuerySet):
@@ -0,0 +1,146 @@
+import calendar
+import hashlib
+from django.db.models import Model, Count, Max
+from django.db.models.query import QuerySet
+from django.utils import timezone
+from django.utils.http import http_date, parse_http_date_safe
+from apimas.components import BaseProcessor
+from apimas.errors import NotModified
+from apimas_django.concurrency import compute_etag
+from apimas_django.handlers import _django_base_construction
+
+
+def to_timestamp(value):
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value, timezone.get_default_timezone())
+    return calendar.timegm(value.utctimetuple())
+
+
+def opaque_tag(etag):
+    etag = etag.strip()
+    return etag[2:] if etag.startswith('W/') else etag
+
+
+def etag_matches_weakly(if_none_match, etag):
+    """
+    Check an `If-None-Match` header value against an ETag.
+
+    Comparison is weak, so weak and strong tags of the same value match.
+    """
+    if if_none_match.strip() == '*':
+        return True
+    return opaque_tag(etag) in [opaque_tag(tag)
+                                for tag in if_none_match.split(',')]
+
+
+def is_not_modified(headers, etag, last_modified):
+    """
+    Evaluate the `If-None-Match` or, if not given, the `If-Modified-Since`
+    header of a request against the validators of the response.
+    """
+    if_none_match = headers.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        return etag is not None and etag_matches_weakly(if_none_match, etag)
+
+    if_modified_since = headers.get('HTTP_IF_MODIFIED_SINCE')
+    if if_modified_since is None or last_modified is None:
+        return False
+    since = parse_http_date_safe(if_modified_since)
+    return since is not None and last_modified <= since
+
+
+class ValidatorsProcessor(BaseProcessor):
+    """
+    Add validators to the responses of a collection and answer conditional
+    requests.
+
+    Validators are computed before the response is serialized. A resource is
+    validated by the `:version_field` column, if given, or else by the
+    `:modified_field` column (by default the `changes_column` of the
+    collection), which also gives its `Last-Modified` time. A listing is
+    validated by a weak ETag of the latest modification time and the number
+    of the resources matched by its filters, computed in one query. It has
+    no `Last-Modified` time, since deleting a resource other than the latest
+    modified one does not change it.
+
+    Requests whose `If-None-Match` or `If-Modified-Since` header matches are
+    answered with 304 Not Modified, skipping the rest of the processors.
+    `:cache_control`, if given, is sent as the `Cache-Control` header.
+    """
+    READ_KEYS = {
+        'instance': 'backend/checked_response',
+        'queryset': 'backend/filtered_response',
+        'etag': 'response/meta/headers/ETag',
+        'headers': 'request/meta/headers',
+    }
+
+    WRITE_KEYS = {
+        'etag': 'response/meta/headers/ETag',
+        'last_modified': 'response/meta/headers/Last-Modified',
+        'cache_control': 'response/meta/headers/Cache-Control',
+    }
+
+    def __init__(self, collection_loc, action_name, spec, version_field,
+                 modified_field, cache_control):
+        modified_field = modified_field or spec['changes_column']
+        self.version_field = version_field
+        self.modified = spec['model']._meta.get_field(modified_field) \
+            if modified_field else None
+        self.cache_control = cache_control
+
+    def resource_validators(self, instance, etag):
+        last_modified = None
+        if self.modified is not None:
+            value = self.modified.value_from_object(instance)
+            if value is not None:
+                last_modified = to_timestamp(value)
+        if etag is None:
+            if self.version_field:
+                etag = compute_etag(instance, (), self.version_field)
+            elif self.modified is not None:
+                etag = compute_etag(instance, (self.modified,), None)
+        return etag, last_modified
+
+    def collection_validators(self, queryset):
+        if self.modified is None:
+            return None
+        stats = queryset.aggregate(modified=Max(self.modified.name),
+                                   count=Count('pk', distinct=True))
+        modified = stats['modified']
+        if modified is not None:
+            modified = self.modified.to_python(modified)
+        digest = hashlib.sha1(repr((
+            None if modified is None else modified.isoformat(),
+            stats['count']))).hexdigest()
+        return 'W/"%s"' % digest
+
+    def process(self, context):
+        if self.version_field is None and self.modified is None and \
+           self.cache_control is None:
+            return
+
+        context_data = self.read(context)
+        instance = context_data['instance']
+        queryset = context_data['queryset']
+        etag, last_modified = None, None
+        if isinstance(instance, Model):
+            etag, last_modified = self.resource_validators(
+                instance, context_data['etag'])
+        elif isinstance(queryset, QuerySet):
+            etag = self.collection_validators(queryset)
+
+        headers = {}
+        if etag is not None:
+            headers['etag'] = etag
+        if last_modified is not None:
+            headers['last_modified'] = http_date(last_modified)
+        if self.cache_control:
+            headers['cache_control'] = self.cache_control
+        self.write(headers, context)
+
+        if is_not_modified(context_data['headers'] or {}, etag,
+                           last_modified):
+            raise NotModified('Not modified')
+
+
+Validators = _django_base_construction(ValidatorsProcessor)
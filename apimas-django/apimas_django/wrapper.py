@@ -153,6 +153,16 @@ def execute_action(action, request, **kwargs):
     return django_response
 
 
+def dispatch_action(actions, request, **kwargs):
+    action = actions.get(request.method)
+    if action:
+        return execute_action(action, request, **kwargs)
+
+    # Return 405 `METHOD_NOT_ALLOWED` if no action was found for the
+    # particular request method.
+    return HttpResponse(status=405)
+
+
 def django_views(actions):
     def view(request, **kwargs):
         """
@@ -160,11 +170,19 @@ def django_views(actions):
 
         The actual view which is mapped with a url pattern.
         """
-        action = actions.get(request.method)
-        if action:
-            return execute_action(action, request, **kwargs)
+        return dispatch_action(actions, request, **kwargs)
+    view.load_actions = lambda: actions
+    return view
+
 
-        # Return 405 `METHOD_NOT_ALLOWED` if no action was found for the
-        # particular request method.
-        return HttpResponse(status=405)
+def django_lazy_views(load_actions):
+    def view(request, **kwargs):
+        """
+        Django function-based views, loading their actions on first use.
+
+        `load_actions` is called on every request and must return the
+        actions of the url pattern, keyed by HTTP method.
+        """
+        return dispatch_action(load_actions(), request, **kwargs)
+    view.load_actions = load_actions
     return view
@@ -1,4 +1,6 @@
 from collections import namedtuple
+from django.conf import settings
+from apimas.auth import TokenSigner
 from apimas.errors import UnauthorizedError
 from anapp.models import User
 
@@ -12,3 +14,6 @@ def token_verifier(token):
 
 def user_resolver(identity, context=None):
     return identity
+
+
+token_signer = TokenSigner(settings.SECRET_KEY, max_age=600)
@@ -0,0 +1,10 @@
+from django.conf import settings
+from apimas.auth import AuthCache
+from apimas.cache import LRUCache
+
+response_cache = LRUCache(maxsize=100, ttl=60)
+
+fragment_cache = LRUCache(maxsize=1000, ttl=60)
+
+auth_cache = AuthCache(LRUCache(maxsize=1000, ttl=300), settings.SECRET_KEY,
+                       ttl=60, negative_ttl=5)
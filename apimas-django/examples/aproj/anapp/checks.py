@@ -22,6 +22,11 @@ def update_check(backend_input, instance, context):
         raise ValidationError("Transition not allowed")
 
 
+def bulk_update_check(backend_input, instance, context):
+    if backend_input.get('status') not in [None, 'posted']:
+        raise ValidationError("Transition not allowed")
+
+
 def censor_one(instance, context):
     auth_user = context.extract(u'auth/user')
     username = auth_user.username
@@ -54,3 +59,7 @@ def is_hidden(context):
 
 def non_hidden(context):
     return ~Q(status='hidden')
+
+
+def is_active(context):
+    return Q(active=True)
@@ -16,6 +16,8 @@ class Institution(models.Model):
     category = models.CharField(
         choices=INSTITUTION_CATEGORIES, max_length=100, default='Research')
     logo = models.FileField(upload_to='logos/')
+    version = models.IntegerField(default=1)
+    modified = models.DateTimeField(auto_now=True)
 
 
 class User(AbstractUser):
@@ -46,6 +46,7 @@ RULES = [
     ('api/prefix/institutions', 'partial_update', '*', '*', '*', '*', '*'),
     ('api/prefix/institutions', 'update', '*', '*', '*', '*', '*'),
     ('api/prefix/institutions', 'delete', '*', '*', '*', '*', '*'),
+    ('api/prefix/institutions', 'bulk_update', '*', '*', '*', '*', '*'),
 
     ('api/prefix/groups', 'list', '*', '*', '*', '*', '*'),
     ('api/prefix/groups', 'retrieve', '*', '*', '*', '*', '*'),
@@ -59,6 +60,11 @@ RULES = [
     ('api/prefix/groups/members', 'partial_update', '*', '*', '*', '*', '*'),
     ('api/prefix/groups/members', 'delete', '*', '*', '*', '*', '*'),
 
+    ('api/prefix/boundedgroups', 'list', '*', '*', '*', '*', '*'),
+    ('api/prefix/boundedgroups', 'retrieve', '*', '*', '*', '*', '*'),
+    ('api/prefix/boundedgroups', 'create', '*', '*', '*', '*', '*'),
+    ('api/prefix/boundedgroups/members', 'list', '*', '*', '*', '*', '*'),
+
     ('api/prefix/posts', 'list', 'admin', '*', '*', '*', '*'),
     ('api/prefix/posts', 'list', 'user', 'non_hidden', 'censor_all', '*', '*'),
 
@@ -70,10 +76,16 @@ RULES = [
 
     ('api/prefix/posts', 'delete', 'admin', 'is_hidden', '*', '*', '*'),
 
+    ('api/prefix/posts', 'bulk_update', 'admin', '*', '*', '*', '*'),
+    ('api/prefix/posts', 'bulk_update', 'user', 'is_pending', 'bulk_update_check', 'status', '*'),
+
+    ('api/prefix/posts', 'bulk_delete', 'admin', 'is_hidden', '*', '*', '*'),
+
     ('api/prefix/posts', 'retrieve', 'admin', '*', '*', '*', '*'),
     ('api/prefix/posts', 'retrieve', 'user', 'non_hidden', 'censor_one', '*', '*'),
     ('api/prefix/posts', 'retrieve', 'anonymous', 'is_posted', '*', 'id,title,status', '*'),
 
+    ('api/prefix/posts2', 'list', '*', 'checks.is_posted', '*', '*', '*'),
     ('api/prefix/posts2', 'retrieve', '*', 'checks.is_posted', '*', '*', '*'),
 
     ('api/prefix/nulltest', 'create', '*', '*', '*', '*', '*'),
@@ -94,6 +106,10 @@ RULES = [
     ('api/prefix/pairs', 'create', '*', '*', '*', '*', '*'),
     ('api/prefix/pairs', 'retrieve', '*', '*', '*', '*', '*'),
     ('api/prefix/pairs', 'partial_update', '*', '*', '*', '*', '*'),
+
+    ('api/restricted/institutions', 'list', '*', 'is_active', '*', '*', '*'),
+    ('api/restricted/institutions', 'delete', '*', '*', '*', '*', '*'),
+    ('api/restricted/posts2', 'list', '*', '*', '*', 'id,url,title,body', '*'),
 ]
 
 def get_rules():
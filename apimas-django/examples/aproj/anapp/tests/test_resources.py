@@ -3,9 +3,12 @@
 from django.core.files.uploadedfile import SimpleUploadedFile
 from apimas_django.test import *
 from anapp import models
-from datetime import datetime
+from aproj.spec import INSTITUTIONS
+from datetime import datetime, timedelta
 import uuid as uuid_lib
 import unicodedata
+import copy
+import docular
 
 pytestmark = pytest.mark.django_db(transaction=False)
 
@@ -572,6 +575,155 @@ def test_subelements(client):
     assert name_variants_id == new_name_variants_id
 
 
+def test_bulk_create(client):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    api = client.copy(prefix='/api/prefix/')
+    inst_id = models.Institution.objects.create(name='inst', active=True).id
+
+    def mk_group(name, n_members):
+        members = [{'onoma': '%s-%d' % (name, i), 'age': 20 + i}
+                   for i in range(n_members)]
+        members.append({'onoma': '%s-v' % name, 'age': 40,
+                        'variants': {'el': 'Giorgos', 'en': 'George'}})
+        return {
+            'name': name,
+            'founded': '2014-12-31',
+            'email': 'email@example.com',
+            'institution_id': inst_id,
+            'members': members,
+        }
+
+    def member_inserts(queries):
+        return len([q for q in queries
+                    if q['sql'].startswith('INSERT INTO "anapp_member"')])
+
+    with CaptureQueriesContext(connection) as queries:
+        resp = api.post('groups', mk_group('one', 5))
+    assert resp.status_code == 201
+    members = resp.json()['members']
+    assert [m['onoma'] for m in members] == [
+        'one-0', 'one-1', 'one-2', 'one-3', 'one-4', 'one-v']
+    assert members[-1]['variants'] == {'el': 'Giorgos', 'en': 'George'}
+    assert member_inserts(queries.captured_queries) == 1
+
+    data = [mk_group('two', 2), mk_group('three', 3)]
+    with CaptureQueriesContext(connection) as queries:
+        resp = api.post('groups', data)
+    assert resp.status_code == 201
+    body = resp.json()
+    assert [group['name'] for group in body] == ['two', 'three']
+    assert [len(group['members']) for group in body] == [3, 4]
+    assert member_inserts(queries.captured_queries) == 1
+    for group in body:
+        resp = api.get('groups/%s' % group['id'])
+        assert resp.status_code == 200
+        assert resp.json() == group
+
+    data = [mk_group('four', 1), dict(mk_group('five', 1), email='invalid')]
+    resp = api.post('groups', data)
+    assert resp.status_code == 400
+    assert not models.Group.objects.filter(name='four').exists()
+
+    resp = api.post('institutions', [{'name': 'inst'}])
+    assert resp.status_code == 400
+
+
+def test_update_subcollection_diff(client):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    api = client.copy(prefix='/api/prefix/')
+    inst_id = models.Institution.objects.create(name='inst', active=True).id
+    data = {
+        'name': 'group',
+        'founded': '2014-12-31',
+        'email': 'email@example.com',
+        'institution_id': inst_id,
+        'members': [{'onoma': 'member%d' % i, 'age': 20} for i in range(6)],
+    }
+    resp = api.post('groups', data)
+    assert resp.status_code == 201
+    group_path = 'groups/%s' % resp.json()['id']
+    ids = [member['id'] for member in resp.json()['members']]
+
+    members = [{'id': ids[0], 'onoma': 'member0', 'age': 20},
+               {'id': ids[1], 'onoma': 'member1', 'age': 30},
+               {'id': ids[2], 'onoma': 'member2', 'age': 30},
+               {'id': ids[3], 'onoma': 'renamed', 'age': 20},
+               {'onoma': 'new', 'age': 40}]
+    with CaptureQueriesContext(connection) as queries:
+        resp = api.patch(group_path, {'members': members})
+    assert resp.status_code == 200
+    body = resp.json()['members']
+    assert [member['id'] for member in body[:4]] == ids[:4]
+    assert body[4]['id'] > ids[-1]
+    assert [(member['onoma'], member['age']) for member in body] == [
+        ('member0', 20), ('member1', 30), ('member2', 30), ('renamed', 20),
+        ('new', 40)]
+    assert not models.Member.objects.filter(id__in=ids[4:]).exists()
+
+    sqls = [q['sql'] for q in queries.captured_queries]
+    assert len([sql for sql in sqls
+                if sql.startswith('UPDATE "anapp_member"')]) == 2
+    assert len([sql for sql in sqls
+                if sql.startswith('INSERT INTO "anapp_member"')]) == 1
+    assert len([sql for sql in sqls
+                if sql.startswith('DELETE FROM "anapp_member"')]) == 1
+
+    resp = api.patch(group_path, {'members': [{'id': ids[-1], 'onoma': 'x',
+                                               'age': 1}]})
+    assert resp.status_code == 400
+    assert models.Member.objects.filter(group__name='group').count() == 5
+
+    resp = api.post('groups', dict(data, members=[
+        {'id': ids[0], 'onoma': 'x', 'age': 1}]))
+    assert resp.status_code == 400
+    assert 'not writable' in resp.json()['details']
+
+
+def test_write_plan():
+    from apimas_django.handlers import compile_write_plan
+
+    variants = {
+        'source': 'name_variants',
+        'subfields': {'en': {'source': 'en'}, 'el': {'source': 'el'}},
+        'substructs': {},
+        'subcollections': {},
+    }
+    spec = {
+        'subfields': {'id': {'source': 'id', 'flags': ['nowrite']},
+                      'onoma': {'source': 'username'}},
+        'substructs': {'variants': variants},
+        'subcollections': {},
+        'bounds': ['group'],
+        'id_field': 'id',
+        'db_key': 'id',
+    }
+    plan = compile_write_plan(spec, models.Member)
+    assert plan.model is models.Member
+    assert plan.bound_name == 'group_id'
+    assert not plan.id_writable
+    assert plan.bulk_create and plan.bulk_update
+    assert plan.columns['name_variants'].attname == 'name_variants_id'
+    ((source, struct_plan),) = plan.substructs
+    assert source == 'name_variants'
+    assert struct_plan.model is models.Variants
+    assert struct_plan.bound_name is None
+    assert 'model' not in variants
+
+    spec = {
+        'subfields': {'username': {'source': 'username'}},
+        'substructs': {},
+        'subcollections': {},
+    }
+    plan = compile_write_plan(spec, models.User)
+    assert plan.create_fn == models.User.apimas_create
+    assert plan.update_fn == models.User.apimas_update
+    assert not plan.bulk_create and not plan.bulk_update
+
+
 def test_nowrite_subcollection(client):
     api = client.copy(prefix='/api/prefix')
 
@@ -699,6 +851,97 @@ def test_manytomany(client):
     assert models.Institution.objects.all().count() == 10
 
 
+def test_identity_map(client):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    user = models.User.objects.create_user(
+        'user', role='user', token='USERTOKEN', email='user@example.org')
+    models.EnhancedUser.objects.create(
+        user=user, feature='feature', is_verified=False)
+    other = models.User.objects.create_user(
+        'other', role='user', token='OTHERTOKEN', email='other@example.org')
+    other_eu = models.EnhancedUser.objects.create(
+        user=other, feature='feature', is_verified=False)
+
+    api = client.copy(prefix='/api/prefix/', auth_token='USERTOKEN')
+    eu_id = models.EnhancedUser.objects.get(user=user).id
+
+    def selects(queries):
+        return [q['sql'] for q in queries.captured_queries
+                if q['sql'].startswith('SELECT') and
+                'FROM "anapp_enhanceduser"' in q['sql']]
+
+    # fetched with the write filter, then once more with the read filter
+    with CaptureQueriesContext(connection) as queries:
+        resp = api.patch('enhancedusers/%s' % eu_id,
+                         {'user': {'first_name': 'First'}})
+    assert resp.status_code == 200
+    assert resp.json()['user']['first_name'] == 'First'
+    assert len(selects(queries)) == 2
+
+    resp = api.patch('enhancedusers/%s' % other_eu.id,
+                     {'user': {'first_name': 'First'}})
+    assert resp.status_code == 404
+
+    anonymous = client.copy(prefix='/api/prefix/')
+    resp = anonymous.post('enhancedadmins', {
+        'feature': 'feature',
+        'user': {'username': 'admin', 'password': 'pass',
+                 'email': 'admin@example.org', 'role': 'admin',
+                 'token': 'ADMINTOKEN'}})
+    assert resp.status_code == 201
+    admin_id = resp.json()['id']
+
+    # created resources outside the subset are fetched once and not served
+    with CaptureQueriesContext(connection) as queries:
+        resp = anonymous.post('enhancedadmins', {
+            'feature': 'feature',
+            'user': {'username': 'nonadmin', 'password': 'pass',
+                     'email': 'nonadmin@example.org', 'role': 'user',
+                     'token': 'NONADMINTOKEN'}})
+    assert resp.status_code == 201
+    assert resp.json() is None
+    assert len(selects(queries)) == 1
+    assert models.EnhancedUser.objects.filter(user__username='nonadmin')
+
+    resp = anonymous.get('enhancedadmins/%s' % admin_id)
+    assert resp.status_code == 200
+
+
+def test_read_filter_pushdown(client):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    user = models.User.objects.create_user(
+        'user', role='user', token='USERTOKEN', email='user@example.org')
+    eu = models.EnhancedUser.objects.create(
+        user=user, feature='feature', is_verified=False)
+    other = models.User.objects.create_user(
+        'other', role='user', token='OTHERTOKEN', email='other@example.org')
+    other_eu = models.EnhancedUser.objects.create(
+        user=other, feature='feature', is_verified=False)
+
+    api = client.copy(prefix='/api/prefix/', auth_token='USERTOKEN')
+
+    def selects(queries):
+        return [q['sql'] for q in queries.captured_queries
+                if q['sql'].startswith('SELECT') and
+                'FROM "anapp_enhanceduser"' in q['sql']]
+
+    with CaptureQueriesContext(connection) as queries:
+        resp = api.get('enhancedusers/%s' % eu.id)
+    assert resp.status_code == 200
+    assert resp.json()['id'] == eu.id
+    (sql,) = selects(queries)
+    assert '"anapp_enhanceduser"."user_id" = %s' % user.id in sql
+
+    with CaptureQueriesContext(connection) as queries:
+        resp = api.get('enhancedusers/%s' % other_eu.id)
+    assert resp.status_code == 404
+    assert len(selects(queries)) == 1
+
+
 def test_id_field(client):
     api = client.copy(prefix='/api/prefix/')
     for i in range(1, 11):
@@ -859,6 +1102,59 @@ def test_update(client):
     assert inst['active'] == True  # default value
 
 
+def test_update_changed_fields(client):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    api = client.copy(prefix='/api/prefix/')
+    inst_id = models.Institution.objects.create(name='inst', active=True).id
+    data = {
+        'name': 'group',
+        'founded': '2014-12-31',
+        'email': 'email@example.com',
+        'institution_id': inst_id,
+        'members': [{'onoma': 'Georgios', 'age': 22,
+                     'variants': {'el': 'Giorgos', 'en': 'George'}}],
+    }
+    resp = api.post('groups', data)
+    assert resp.status_code == 201
+    group_path = 'groups/%s' % resp.json()['id']
+    member_path = group_path + '/members/%s' % resp.json()['members'][0]['id']
+
+    def updates(queries):
+        return [q['sql'] for q in queries.captured_queries
+                if q['sql'].startswith('UPDATE')]
+
+    with CaptureQueriesContext(connection) as queries:
+        resp = api.patch(group_path, {'email': 'email@example.com'})
+    assert resp.status_code == 200
+    assert updates(queries) == []
+
+    with CaptureQueriesContext(connection) as queries:
+        resp = api.patch(group_path, {'email': 'other@example.com'})
+    assert resp.status_code == 200
+    assert resp.json()['email'] == 'other@example.com'
+    (sql,) = updates(queries)
+    assert sql.startswith('UPDATE "anapp_group" SET "email" = ')
+    assert '"name"' not in sql
+
+    variants = {'el': 'Giorgos', 'en': 'George'}
+    with CaptureQueriesContext(connection) as queries:
+        resp = api.patch(member_path, {'age': 23, 'variants': variants})
+    assert resp.status_code == 200
+    assert resp.json()['age'] == 23
+    (sql,) = updates(queries)
+    assert sql.startswith('UPDATE "anapp_member" SET "age" = ')
+
+    with CaptureQueriesContext(connection) as queries:
+        resp = api.patch(member_path, {'variants': None})
+    assert resp.status_code == 200
+    assert resp.json()['variants'] is None
+    (sql,) = updates(queries)
+    assert sql.startswith('UPDATE "anapp_member" SET "name_variants_id" = ')
+    assert not models.Variants.objects.exists()
+
+
 def test_delete(client):
     api = client.copy(prefix='/api/prefix/')
     inst1 = models.Institution.objects.create(name='inst1', active=True)
@@ -882,6 +1178,142 @@ def test_delete(client):
     assert len(resp.json()) == 1
 
 
+def test_bulk_update_delete(client):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    models.User.objects.create_user('admin', role='admin', token='ADMINTOKEN')
+    models.User.objects.create_user('user', role='user', token='USERTOKEN')
+    admin = client.copy(prefix='/api/prefix', auth_token='ADMINTOKEN')
+    user = client.copy(prefix='/api/prefix', auth_token='USERTOKEN')
+
+    for i, status in enumerate(['pending', 'pending', 'hidden', 'hidden',
+                                'posted']):
+        models.Post.objects.create(
+            title='title%d' % i, body='body%d' % i, status=status)
+
+    def statuses():
+        return sorted(models.Post.objects.values_list('status', flat=True))
+
+    def writes(queries):
+        return [q['sql'] for q in queries.captured_queries
+                if q['sql'].startswith(('UPDATE', 'DELETE'))]
+
+    # the write filter narrows the matched posts to the pending ones
+    with CaptureQueriesContext(connection) as queries:
+        resp = user.patch('posts', {'status': 'posted'},
+                          QUERY_STRING='flt__status__startswith=p')
+    assert resp.status_code == 200
+    assert resp.json() == {'count': 2}
+    assert len(writes(queries)) == 1
+    assert statuses() == ['hidden', 'hidden', 'posted', 'posted', 'posted']
+
+    # the write check applies to the update data
+    resp = user.patch('posts', {'status': 'hidden'})
+    assert resp.status_code == 400
+
+    # only permitted fields are written
+    resp = user.patch('posts', {'title': 'title'})
+    assert resp.status_code == 403
+
+    resp = admin.patch('posts', {'body': 'changed'},
+                       QUERY_STRING='flt__status=hidden')
+    assert resp.status_code == 200
+    assert resp.json() == {'count': 2}
+    assert models.Post.objects.filter(body='changed').count() == 2
+
+    resp = user.delete('posts')
+    assert resp.status_code == 403
+
+    # admins may delete only hidden posts
+    with CaptureQueriesContext(connection) as queries:
+        resp = admin.delete('posts')
+    assert resp.status_code == 200
+    assert resp.json() == {'count': 2}
+    assert len(writes(queries)) == 1
+    assert statuses() == ['posted', 'posted', 'posted']
+
+    resp = admin.delete('posts', QUERY_STRING='flt__status=posted')
+    assert resp.status_code == 200
+    assert resp.json() == {'count': 0}
+    assert statuses() == ['posted', 'posted', 'posted']
+
+
+def test_batch(client, settings):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from apimas_django import provider
+    from aproj.spec import APP_CONFIG, DEPLOY_CONFIG
+
+    def configure(**config):
+        app_spec = provider.configure_apimas_app(APP_CONFIG)
+        spec = provider.configure_spec(
+            app_spec, dict(DEPLOY_CONFIG, **config))
+
+        class URLConf(object):
+            urlpatterns = provider.construct_views(spec)
+        settings.ROOT_URLCONF = URLConf
+
+    models.User.objects.create_user('admin', role='admin', token='ADMINTOKEN')
+    admin = client.copy(prefix='/api/', auth_token='ADMINTOKEN')
+    api = client.copy(prefix='/api/')
+
+    configure(**{':batch_url': 'api/batch'})
+    post = dict(title='title', body='body', status='posted')
+    operations = [
+        {'method': 'post', 'path': '/api/prefix/posts/', 'body': post},
+        {'method': 'GET', 'path': '/api/prefix/posts/?flt__status=posted'},
+        {'method': 'GET', 'path': '/api/prefix/posts/?flt__status=hidden'},
+        {'method': 'GET', 'path': '/api/prefix/missing/'},
+        {'method': 'PUT', 'path': '/api/prefix/posts/'},
+    ]
+
+    def user_selects(queries):
+        return [q['sql'] for q in queries.captured_queries
+                if q['sql'].startswith('SELECT') and
+                'FROM "anapp_user"' in q['sql']]
+
+    # authentication and user retrieval are done once per batch
+    with CaptureQueriesContext(connection) as queries:
+        resp = admin.post('batch', operations)
+    assert resp.status_code == 200
+    assert len(user_selects(queries)) == 1
+    responses = resp.json()
+    assert [r['status'] for r in responses] == [201, 200, 200, 404, 405]
+    post_id = responses[0]['body']['id']
+    assert [p['id'] for p in responses[1]['body']] == [post_id]
+    assert responses[2]['body'] == []
+    assert models.PostLog.objects.filter(
+        post_id=post_id, username='admin', action='create').exists()
+
+    resp = api.post('batch', operations[:2])
+    assert resp.status_code == 200
+    assert [r['status'] for r in resp.json()] == [403, 403]
+
+    resp = api.post('batch', {'method': 'GET', 'path': '/api/prefix/posts/'})
+    assert resp.status_code == 400
+
+    # atomic batches are rolled back on the first failed operation
+    configure(**{':batch_url': 'api/batch', ':batch_atomic': True})
+    operations = [
+        {'method': 'POST', 'path': '/api/prefix/institutions/',
+         'body': {'name': 'inst', 'category': 'Research Center'}},
+        {'method': 'POST', 'path': '/api/prefix/institutions/',
+         'body': {'name': 'inst', 'category': 'Other'}},
+        {'method': 'GET', 'path': '/api/prefix/institutions/'},
+    ]
+    resp = api.post('batch', operations)
+    assert resp.status_code == 400
+    assert [r['status'] for r in resp.json()] == [201, 400]
+    assert not models.Institution.objects.exists()
+
+    resp = api.post('batch', operations[:1] + operations[2:])
+    assert resp.status_code == 200
+    responses = resp.json()
+    assert [r['status'] for r in responses] == [201, 200]
+    assert len(responses[1]['body']) == 1
+
+
 def test_custom_action(client):
     models.User.objects.create_user('admin', role='admin', token='ADMINTOKEN')
     api = client.copy(prefix='/api/prefix/')
@@ -957,6 +1389,560 @@ def test_ref(client):
     assert body['institution_name'] == 'inst1'
 
 
+def test_expand(client):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    api = client.copy(prefix='/api/prefix/')
+    inst1 = models.Institution.objects.create(name='inst1', active=True)
+    inst2 = models.Institution.objects.create(name='inst2', active=True)
+    for name, inst in [('gr1', inst1), ('gr2', inst2), ('gr3', None)]:
+        models.Group.objects.create(
+            name=name, founded=datetime.now(), active=True,
+            email='%s@example.com' % name, institution=inst)
+    group = models.Group.objects.get(name='gr1')
+    feature = models.Feature.objects.create(name='feature', group=group)
+
+    def institution_selects(queries):
+        return [q['sql'] for q in queries.captured_queries
+                if 'FROM "anapp_institution"' in q['sql']]
+
+    # referenced resources are fetched in one query
+    with CaptureQueriesContext(connection) as queries:
+        resp = api.get('groups', {'expand': 'institution_id'})
+    assert resp.status_code == 200
+    assert len(institution_selects(queries)) == 1
+    institutions = [g['institution_id'] for g in
+                    sorted(resp.json(), key=lambda g: g['name'])]
+    assert institutions[0]['id'] == inst1.id
+    assert institutions[0]['name'] == 'inst1'
+    assert institutions[0]['category'] == 'Research Center'
+    assert institutions[1]['name'] == 'inst2'
+    assert institutions[2] is None
+
+    resp = api.get('features/%s' % feature.id)
+    assert resp.status_code == 200
+    group_url = resp.json()['group_id']
+    assert group_url.endswith('/api/prefix/groups/%s/' % group.id)
+
+    resp = api.get('features/%s' % feature.id,
+                   {'expand': 'group_id.institution_id'})
+    assert resp.status_code == 200
+    embedded = resp.json()['group_id']
+    assert embedded['url'] == group_url
+    assert embedded['name'] == 'gr1'
+    assert embedded['institution_id']['name'] == 'inst1'
+
+    resp = api.get('features/%s' % feature.id, {'expand': 'group_id'})
+    assert resp.status_code == 200
+    embedded = resp.json()['group_id']
+    assert embedded['institution_id'].endswith(
+        '/api/prefix/institutions/%s/' % inst1.id)
+
+    # expansions are limited to :expand_depth refs
+    resp = api.get('groups', {'expand': 'institution_id.id'})
+    assert resp.status_code == 400
+
+    resp = api.get('groups', {'expand': 'name'})
+    assert resp.status_code == 400
+
+    resp = api.get('groups', {'expand': 'unknown'})
+    assert resp.status_code == 403
+
+
+def test_sparse_fields(client):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    api = client.copy(prefix='/api/prefix/')
+    inst = models.Institution.objects.create(name='inst1', active=True)
+    group = models.Group.objects.create(
+        name='gr1', founded=datetime.now(), active=True,
+        email='gr1@example.com', institution=inst)
+    models.Member.objects.create(group=group, username='m1', age=30)
+
+    with CaptureQueriesContext(connection) as queries:
+        resp = api.get('groups', {'fields': 'id,name,members.onoma'})
+    assert resp.status_code == 200
+    assert resp.json() == [
+        {'id': str(group.id), 'name': 'gr1', 'members': [{'onoma': 'm1'}]}]
+    group_selects = [q['sql'] for q in queries.captured_queries
+                     if 'FROM "anapp_group"' in q['sql']]
+    assert len(group_selects) == 1
+    assert '"email"' not in group_selects[0]
+    assert not [q for q in queries.captured_queries
+                if 'FROM "anapp_institution"' in q['sql']]
+
+    resp = api.get('groups/%s' % group.id, {'fields': 'institution'})
+    assert resp.status_code == 200
+    body = resp.json()
+    assert body.keys() == ['institution']
+    assert body['institution']['name'] == 'inst1'
+
+    resp = api.get('groups', {'fields': 'id,unknown'})
+    assert resp.status_code == 403
+
+    # posts2 lists a slimmer profile by default
+    models.Post.objects.create(title='title', body='body', status='posted')
+    resp = api.get('posts2')
+    assert resp.status_code == 200
+    post = resp.json()[0]
+    assert set(post.keys()) == set(['id', 'url', 'title', 'status'])
+    post_id = post['id']
+
+    resp = api.get('posts2', {'fields': 'id,body'})
+    assert resp.status_code == 200
+    assert resp.json() == [{'id': post_id, 'body': 'body'}]
+
+    resp = api.get('posts2/%s' % post_id)
+    assert resp.status_code == 200
+    assert resp.json()['body'] == 'body'
+
+
+def test_default_fields_permissions(client, settings):
+    from apimas_django import provider
+    from aproj.spec import POSTS2
+
+    app_config = dict(INSTITUTIONS_APP_CONFIG, endpoints={
+        'api/restricted': {'collections': {'posts2': POSTS2}}})
+    spec = provider.configure_spec(
+        provider.configure_apimas_app(app_config), {})
+
+    class URLConf(object):
+        urlpatterns = provider.construct_views(spec)
+    settings.ROOT_URLCONF = URLConf
+
+    api = client.copy(prefix='/api/restricted/')
+    models.Post.objects.create(title='title', body='body', status='posted')
+
+    # the default profile is narrowed to the readable fields
+    resp = api.get('posts2')
+    assert resp.status_code == 200
+    assert set(resp.json()[0].keys()) == set(['id', 'url', 'title'])
+
+    # unlike the fields requested explicitly
+    resp = api.get('posts2', {'fields': 'id,status'})
+    assert resp.status_code == 403
+    resp = api.get('posts2', {'fields': 'body'})
+    assert resp.status_code == 200
+    assert resp.json() == [{'body': 'body'}]
+
+def test_embed_limit(client, monkeypatch):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    api = client.copy(prefix='/api/prefix/')
+    groups = []
+    for name, size in [('gr1', 3), ('gr2', 1), ('gr3', 0)]:
+        group = models.Group.objects.create(
+            name=name, founded=datetime.now(), active=True,
+            email='%s@example.com' % name)
+        for i in range(size):
+            models.Member.objects.create(
+                group=group, username='%s-m%d' % (name, i), age=20 + i)
+        groups.append(group)
+
+    # children are limited per parent in the database
+    with CaptureQueriesContext(connection) as queries:
+        resp = api.get('boundedgroups')
+    assert resp.status_code == 200
+    member_selects = [q['sql'] for q in queries.captured_queries
+                      if 'FROM "anapp_member"' in q['sql']]
+    assert len(member_selects) == 2
+
+    members = dict((g['name'], g['members']) for g in resp.json())
+    assert members['gr1']['count'] == 3
+    assert [m['onoma'] for m in members['gr1']['results']] == [
+        'gr1-m0', 'gr1-m1']
+    assert members['gr1']['url'].endswith(
+        '/api/prefix/boundedgroups/%s/members/' % groups[0].id)
+    assert members['gr2']['count'] == 1
+    assert len(members['gr2']['results']) == 1
+    assert members['gr3'] == {
+        'count': 0, 'results': [],
+        'url': members['gr1']['url'].replace(str(groups[0].id),
+                                             str(groups[2].id))}
+
+    resp = api.get(members['gr1']['url'])
+    assert resp.status_code == 200
+    assert len(resp.json()) == 3
+
+    resp = api.get('boundedgroups/%s' % groups[0].id)
+    assert resp.status_code == 200
+    assert resp.json()['members']['count'] == 3
+
+    # elements are still written as a list
+    inst = models.Institution.objects.create(name='inst1', active=True)
+    resp = api.post('boundedgroups', {
+        'name': 'gr4', 'email': 'gr4@example.com', 'institution_id': inst.id,
+        'members': [{'onoma': 'gr4-m0', 'age': 20}]})
+    assert resp.status_code == 201
+    assert resp.json()['members']['count'] == 1
+
+    # unbounded subcollections are exported in full
+    resp = api.get('groups/%s' % groups[0].id)
+    assert len(resp.json()['members']) == 3
+
+    # backends that cannot limit subqueries query per parent with elements
+    monkeypatch.setattr(connection.features, 'allow_sliced_subqueries',
+                        False)
+    with CaptureQueriesContext(connection) as queries:
+        resp = api.get('boundedgroups')
+    assert resp.status_code == 200
+    member_selects = [q['sql'] for q in queries.captured_queries
+                      if 'FROM "anapp_member"' in q['sql']]
+    assert len(member_selects) == 4
+    assert dict((g['name'], g['members']) for g in resp.json()
+                if g['name'] != 'gr4') == members
+
+
+def test_embed_limit_id_field(client, settings):
+    from apimas_django import provider
+    from aproj.spec import BOUNDEDGROUPS
+
+    groups = copy.deepcopy(BOUNDEDGROUPS)
+    groups['id_field'] = 'name'
+    app_config = dict(INSTITUTIONS_APP_CONFIG, endpoints={
+        'api/prefix': {'collections': {'boundedgroups': groups,
+                                       'institutions': INSTITUTIONS}}})
+    spec = provider.configure_spec(
+        provider.configure_apimas_app(app_config), {})
+
+    class URLConf(object):
+        urlpatterns = provider.construct_views(spec)
+    settings.ROOT_URLCONF = URLConf
+
+    api = client.copy(prefix='/api/prefix/')
+    group = models.Group.objects.create(
+        name='gr1', founded=datetime.now(), active=True,
+        email='gr1@example.com')
+    models.Member.objects.create(group=group, username='m1', age=20)
+
+    # embedded subcollections are keyed by the id_field, as in their URLs
+    for path in ['boundedgroups', 'boundedgroups/gr1']:
+        resp = api.get(path)
+        assert resp.status_code == 200
+        body = resp.json()
+        members = (body[0] if isinstance(body, list) else body)['members']
+        assert members['url'].endswith('api/prefix/boundedgroups/gr1/members/')
+    resp = client.get('/' + members['url'].split('/', 3)[-1]
+                      if '://' in members['url'] else '/' + members['url'])
+    assert resp.status_code == 200
+    assert [member['onoma'] for member in resp.json()] == ['m1']
+
+def test_aggregate(client):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    api = client.copy(prefix='/api/prefix/')
+    inst1 = models.Institution.objects.create(name='inst1', active=True)
+    inst2 = models.Institution.objects.create(name='inst2', active=True)
+    for name, active, inst, ages in [('gr1', True, inst1, [20, 30]),
+                                     ('gr2', True, inst2, [40]),
+                                     ('gr3', False, inst1, [])]:
+        group = models.Group.objects.create(
+            name=name, founded=datetime.now(), active=active,
+            email='%s@example.com' % name, institution=inst)
+        for age in ages:
+            models.Member.objects.create(group=group, username=name, age=age)
+
+    with CaptureQueriesContext(connection) as queries:
+        resp = api.get('groups/aggregate', {
+            'group_by': 'active',
+            'aggregate': 'count,sum:members.age,max:members.age'})
+    assert resp.status_code == 200
+    assert len(queries.captured_queries) == 1
+    assert resp.json() == [
+        {'group': {'active': False}, 'count': 1,
+         'sum': {'members': {'age': None}},
+         'max': {'members': {'age': None}}},
+        {'group': {'active': True}, 'count': 2,
+         'sum': {'members': {'age': 90}},
+         'max': {'members': {'age': 40}}},
+    ]
+
+    # grouped values are exported with the converters of their fields
+    resp = api.get('groups/aggregate', {'group_by': 'institution_id',
+                                        'aggregate': 'avg:members.age'})
+    assert resp.status_code == 200
+    rows = resp.json()
+    assert rows[0]['group']['institution_id'].endswith(
+        '/api/prefix/institutions/%s/' % inst1.id)
+    assert rows[0]['avg'] == {'members': {'age': 25.0}}
+    assert 'count' not in rows[0]
+
+    # filters apply before aggregation
+    resp = api.get('groups/aggregate', {'flt__active': True})
+    assert resp.status_code == 200
+    assert resp.json() == [{'group': {}, 'count': 2}]
+
+    resp = api.get('groups/aggregate', {'group_by': 'name'})
+    assert resp.status_code == 403
+
+    resp = api.get('groups/aggregate', {'aggregate': 'sum:email'})
+    assert resp.status_code == 400
+
+    resp = api.get('groups/aggregate', {'aggregate': 'median:members.age'})
+    assert resp.status_code == 400
+
+    resp = api.get('groups/%s' % models.Group.objects.get(name='gr1').id)
+    assert resp.status_code == 200
+
+
+def test_annotation_fields(client):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    api = client.copy(prefix='/api/prefix/')
+    insts = [models.Institution.objects.create(name='inst%d' % i, active=True)
+             for i in range(3)]
+    eus = []
+    for i in range(3):
+        user = models.User.objects.create_user(
+            'user%d' % i, email='user%d@example.com' % i, role='user',
+            token='TOKEN%d' % i)
+        eu = models.EnhancedUser.objects.create(
+            user=user, is_verified=False, feature='')
+        eu.institutions.add(*insts[:i])
+        eus.append(eu)
+
+    # computed in the list query
+    with CaptureQueriesContext(connection) as queries:
+        resp = api.get('enhancedusers',
+                       {'fields': 'id,institution_count',
+                        'ordering': '-institution_count'})
+    assert resp.status_code == 200
+    for query in queries.captured_queries:
+        assert 'FROM "anapp_enhanceduser" ' in query['sql']
+    assert resp.json() == [
+        {'id': eus[2].id, 'institution_count': 2},
+        {'id': eus[1].id, 'institution_count': 1},
+        {'id': eus[0].id, 'institution_count': 0},
+    ]
+
+    resp = api.get('enhancedusers', {'flt__institution_count__gte': 1,
+                                     'fields': 'id'})
+    assert resp.status_code == 200
+    assert set(eu['id'] for eu in resp.json()) == set([eus[1].id, eus[2].id])
+
+    admin = client.copy(prefix='/api/prefix/', auth_token='TOKEN2')
+    models.User.objects.filter(username='user2').update(role='admin')
+    resp = admin.get('enhancedusers/%s' % eus[2].id)
+    assert resp.status_code == 200
+    assert resp.json()['institution_count'] == 2
+
+    resp = admin.patch('enhancedusers/%s' % eus[2].id,
+                       {'institution_count': 5})
+    assert resp.status_code == 400
+
+
+def move_changes_clock(monkeypatch, seconds):
+    from django.utils import timezone
+    monkeypatch.setattr('apimas_django.changes.now', lambda: (
+        timezone.now() + timedelta(seconds=seconds)))
+
+
+def test_changes(client, monkeypatch):
+    from StringIO import StringIO
+    from django.core.management import call_command
+    from apimas_django.models import Tombstone
+
+    # changes are read once they are older than the lag
+    move_changes_clock(monkeypatch, 60)
+    api = client.copy(prefix='/api/prefix/')
+    insts = [models.Institution.objects.create(name='inst%d' % i, active=True)
+             for i in range(3)]
+
+    resp = api.get('institutions/changes', {'limit': 2})
+    assert resp.status_code == 200
+    body = resp.json()
+    assert [inst['id'] for inst in body['results']] == [
+        insts[0].id, insts[1].id]
+    assert body['deleted'] == []
+    assert body['more'] is True
+
+    resp = api.get('institutions/changes', {'since': body['next'],
+                                            'limit': 2})
+    assert resp.status_code == 200
+    body = resp.json()
+    assert [inst['id'] for inst in body['results']] == [insts[2].id]
+    assert body['more'] is False
+    cursor = body['next']
+
+    resp = api.get('institutions/changes', {'since': cursor})
+    assert resp.status_code == 200
+    assert resp.json()['results'] == []
+    assert resp.json()['next'] == cursor
+
+    resp = api.patch('institutions/%s' % insts[0].id, {'name': 'renamed'})
+    assert resp.status_code == 200
+    resp = api.delete('institutions/%s' % insts[1].id)
+    assert resp.status_code == 204
+
+    resp = api.get('institutions/changes', {'since': cursor})
+    assert resp.status_code == 200
+    body = resp.json()
+    assert [(inst['id'], inst['name']) for inst in body['results']] == [
+        (insts[0].id, 'renamed')]
+    assert body['deleted'] == [insts[1].id]
+
+    resp = api.get('institutions/changes', {'since': body['next']})
+    assert resp.status_code == 200
+    assert resp.json()['results'] == []
+    assert resp.json()['deleted'] == []
+
+    resp = api.get('institutions/changes', {'since': 'invalid'})
+    assert resp.status_code == 400
+    resp = api.get('institutions/changes', {'offset': 2})
+    assert resp.status_code == 400
+
+    # recent changes are held back, in case earlier writes still commit
+    cursor = body['next']
+    move_changes_clock(monkeypatch, 0)
+    resp = api.patch('institutions/%s' % insts[2].id, {'name': 'recent'})
+    assert resp.status_code == 200
+    resp = api.delete('institutions/%s' % insts[0].id)
+    assert resp.status_code == 204
+    resp = api.get('institutions/changes', {'since': cursor})
+    body = resp.json()
+    assert (body['results'], body['deleted']) == ([], [])
+    assert body['next'] == cursor
+
+    move_changes_clock(monkeypatch, 60)
+    resp = api.get('institutions/changes', {'since': cursor})
+    body = resp.json()
+    assert [inst['name'] for inst in body['results']] == ['recent']
+    assert body['deleted'] == [insts[0].id]
+    cursor = body['next']
+
+    # cursors that have not read past pruned tombstones must resync
+    inst = models.Institution.objects.create(name='pruned', active=True)
+    resp = api.delete('institutions/%s' % inst.id)
+    assert resp.status_code == 204
+    stdout = StringIO()
+    call_command('apimas_prune_tombstones', days=-1, stdout=stdout)
+    assert stdout.getvalue() == 'Removed 3 tombstones\n'
+    assert not Tombstone.objects.exists()
+    resp = api.get('institutions/changes', {'since': cursor})
+    assert resp.status_code == 410
+
+    resp = api.get('institutions/changes')
+    assert resp.status_code == 200
+    body = resp.json()
+    assert body['deleted'] == []
+    resp = api.get('institutions/changes', {'since': body['next']})
+    assert resp.status_code == 200
+
+
+def test_handlers_without_installed_app(tmpdir):
+    import subprocess
+    import sys
+
+    # apimas_django is an installed app only for change feeds
+    script = tmpdir.join('script.py')
+    script.write(
+        "from django.conf import settings\n"
+        "settings.configure(INSTALLED_APPS=['django.contrib.contenttypes',"
+        " 'django.contrib.auth'])\n"
+        "import django\n"
+        "django.setup()\n"
+        "import apimas_django.handlers\n")
+    subprocess.check_call([sys.executable, str(script)])
+
+def test_changes_permissions(client, settings, monkeypatch):
+    from apimas_django import provider
+
+    move_changes_clock(monkeypatch, 60)
+
+    institutions = copy.deepcopy(INSTITUTIONS)
+    institutions[':permissions_namespace'] = 'anapp.checks'
+    app_config = dict(INSTITUTIONS_APP_CONFIG, endpoints={
+        'api/restricted': {'collections': {'institutions': institutions}}})
+    spec = provider.configure_spec(
+        provider.configure_apimas_app(app_config), {})
+
+    class URLConf(object):
+        urlpatterns = provider.construct_views(spec)
+    settings.ROOT_URLCONF = URLConf
+
+    api = client.copy(prefix='/api/restricted/')
+    active = models.Institution.objects.create(name='active', active=True)
+    inactive = models.Institution.objects.create(name='inactive',
+                                                 active=False)
+    resp = api.delete('institutions/%s' % inactive.id)
+    assert resp.status_code == 204
+
+    # deletions are hidden from roles that may not read every resource
+    resp = api.get('institutions/changes')
+    assert resp.status_code == 200
+    body = resp.json()
+    assert [inst['id'] for inst in body['results']] == [active.id]
+    assert body['deleted'] is None
+
+
+def test_conditional_get(client):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    api = client.copy(prefix='/api/prefix/')
+    inst = models.Institution.objects.create(name='inst', active=True)
+    path = 'institutions/%s' % inst.id
+
+    resp = api.get(path)
+    assert resp.status_code == 200
+    assert resp['Cache-Control'] == 'private, max-age=0'
+    etag = resp['ETag']
+    last_modified = resp['Last-Modified']
+
+    resp = api.get(path, HTTP_IF_NONE_MATCH=etag)
+    assert resp.status_code == 304
+    assert resp.content == ''
+    assert resp['ETag'] == etag
+    assert resp['Cache-Control'] == 'private, max-age=0'
+    resp = api.get(path, HTTP_IF_NONE_MATCH='"other", W/%s' % etag)
+    assert resp.status_code == 304
+    resp = api.get(path, HTTP_IF_MODIFIED_SINCE=last_modified)
+    assert resp.status_code == 304
+    resp = api.get(path, HTTP_IF_MODIFIED_SINCE='Sat, 01 Jan 2000 00:00:00 GMT')
+    assert resp.status_code == 200
+
+    models.Institution.objects.filter(id=inst.id).update(
+        modified=inst.modified + timedelta(seconds=1))
+    resp = api.get(path, HTTP_IF_NONE_MATCH=etag)
+    assert resp.status_code == 200
+    assert resp['ETag'] != etag
+
+    # listings are validated in one query, before being fetched
+    resp = api.get('institutions')
+    assert resp.status_code == 200
+    list_etag = resp['ETag']
+    assert list_etag.startswith('W/')
+    with CaptureQueriesContext(connection) as queries:
+        resp = api.get('institutions', HTTP_IF_NONE_MATCH=list_etag)
+    assert resp.status_code == 304
+    assert len(queries.captured_queries) == 1
+
+    resp = api.get('institutions', {'flt__category': 'Institution'},
+                   HTTP_IF_NONE_MATCH=list_etag)
+    assert resp.status_code == 200
+
+    other = models.Institution.objects.create(name='other', active=True)
+    resp = api.get('institutions', HTTP_IF_NONE_MATCH=list_etag)
+    assert resp.status_code == 200
+    assert resp['ETag'] != list_etag
+
+    # deletions leave the latest modification time as is, so listings are
+    # validated by their ETag only
+    list_etag = resp['ETag']
+    assert 'Last-Modified' not in resp
+    inst.delete()
+    resp = api.get('institutions', HTTP_IF_MODIFIED_SINCE=last_modified)
+    assert resp.status_code == 200
+    assert [elem['id'] for elem in resp.json()] == [other.id]
+    resp = api.get('institutions', HTTP_IF_NONE_MATCH=list_etag)
+    assert resp.status_code == 200
+
+
 def test_choices(client):
     api = client.copy(prefix='/api/prefix/')
 
@@ -1190,3 +2176,722 @@ def test_pagination_default_limit(client):
     results = body['results']
     assert len(results) == 5
     assert [inst['id'] for inst in results] == range(1, 6)
+
+
+def test_lazy_views(client, settings):
+    from apimas_django import provider
+    from aproj.spec import APP_CONFIG, DEPLOY_CONFIG
+    from aproj.urls import api_urls
+
+    app_spec = provider.configure_apimas_app(APP_CONFIG)
+    spec = provider.configure_spec(app_spec, DEPLOY_CONFIG)
+    app = provider.LazyApimasApp(spec)
+
+    patterns = set(pattern.regex.pattern for pattern in app.urlpatterns)
+    assert patterns == set(pattern.regex.pattern for pattern in api_urls)
+    assert all(views.views is None for views in app.collections)
+
+    class URLConf(object):
+        urlpatterns = app.urlpatterns
+
+    settings.ROOT_URLCONF = URLConf
+    api = client.copy(prefix='/api/prefix/')
+    models.Institution.objects.create(name='inst', active=True)
+
+    resp = api.get('institutions')
+    assert resp.status_code == 200
+    assert len(resp.json()) == 1
+
+    resp = api.patch('institutions/1', {'name': 'other'})
+    assert resp.status_code == 200
+    assert resp.json()['name'] == 'other'
+
+    resp = api.post('institutions/1')
+    assert resp.status_code == 405
+
+    constructed = set(views.loc[-1] for views in app.collections
+                      if views.views is not None)
+    assert constructed == set(['institutions'])
+
+    app.construct_all()
+    assert all(views.views is not None for views in app.collections)
+
+
+def test_lazy_views_invalid_action():
+    from apimas.errors import InvalidSpec
+    from apimas_django import provider
+
+    institutions = copy.deepcopy(INSTITUTIONS)
+    institutions['actions']['broken'] = {
+        '.action.django': {}, 'method': 'GET', 'processors': {}}
+    app_config = dict(INSTITUTIONS_APP_CONFIG, endpoints={
+        'api/prefix': {'collections': {'institutions': institutions}}})
+    spec = provider.configure_spec(
+        provider.configure_apimas_app(app_config), {})
+
+    # as in eager construction, actions without a URL are rejected
+    with pytest.raises(InvalidSpec) as excinfo:
+        provider.LazyApimasApp(spec)
+    assert excinfo.value.loc == ('endpoints', 'api/prefix', 'collections',
+                                 'institutions', 'actions', 'broken')
+    with pytest.raises(InvalidSpec):
+        provider.construct_views(spec)
+
+def test_lazy_views_reconstruct(client, settings):
+    from apimas_django import provider
+    from aproj.spec import APP_CONFIG, DEPLOY_CONFIG
+
+    def mk_spec(app_config):
+        app_spec = provider.configure_apimas_app(app_config)
+        return provider.configure_spec(app_spec, DEPLOY_CONFIG)
+
+    app = provider.LazyApimasApp(mk_spec(APP_CONFIG))
+    urlpatterns = list(app.urlpatterns)
+
+    class URLConf(object):
+        urlpatterns = app.urlpatterns
+
+    settings.ROOT_URLCONF = URLConf
+    api = client.copy(prefix='/api/prefix/')
+
+    resp = api.post('institutions', {'name': 'inst'})
+    assert resp.status_code == 201
+    assert resp.json()['category'] == 'Research Center'
+
+    assert app.reconstruct(mk_spec(APP_CONFIG)) == []
+
+    loc = ('endpoints', 'api/prefix', 'collections', 'institutions')
+    app_config = copy.deepcopy(APP_CONFIG)
+    institutions = docular.doc_get(app_config, loc)
+    institutions['fields']['category']['default'] = 'Institution'
+    # groups embeds the fields of institutions
+    groups_loc = loc[:-1] + ('groups',)
+    assert sorted(app.reconstruct(mk_spec(app_config))) == [groups_loc, loc]
+    assert app.urlpatterns == urlpatterns
+
+    resp = api.post('institutions', {'name': 'inst2'})
+    assert resp.status_code == 201
+    assert resp.json()['category'] == 'Institution'
+
+    del institutions['actions']['.action-template.django.delete']
+    assert app.reconstruct(mk_spec(app_config)) == [loc]
+    assert app.urlpatterns != urlpatterns
+
+    resp = api.get('institutions/1')
+    assert resp.status_code == 200
+    resp = api.delete('institutions/1')
+    assert resp.status_code == 405
+
+
+INSTITUTIONS_APP_CONFIG = {
+    '.apimas_app': {},
+    ':permission_rules': 'anapp.rules.get_rules',
+    'endpoints': {
+        'api/prefix': {
+            'collections': {
+                'institutions': INSTITUTIONS,
+            },
+        },
+    },
+}
+
+
+def test_profile_spec():
+    from StringIO import StringIO
+    from django.core.management import call_command
+    from apimas_django.profiling import profile_spec
+
+    report = profile_spec(INSTITUTIONS_APP_CONFIG)
+    assert report['phases'].keys() == [
+        'configure_apimas_app', 'configure_spec', 'construct_views']
+    assert report['nodes'] > 0
+    assert 0 < report['artifacts_size'] < report['spec_size']
+
+    profile = report['profile']
+    registries = set(profile.registry_times())
+    assert 'apimas_django.provider' in registries
+    assert 'apimas_django.handlers.DJANGEBASEHANDLER_CONSTRUCTORS' in \
+        registries
+    assert ('apimas_django.provider', '.action') in profile.constructors
+
+    out = StringIO()
+    call_command('apimas_profile_spec',
+                 __name__ + '.INSTITUTIONS_APP_CONFIG',
+                 '--top', '5', stdout=out)
+    output = out.getvalue()
+    assert 'construct_views' in output
+    assert 'Retained memory of :artifacts' in output
+
+
+def test_compact_views(client, settings):
+    from apimas_django import provider
+
+    def mk_spec():
+        app_spec = provider.configure_apimas_app(INSTITUTIONS_APP_CONFIG)
+        return provider.configure_spec(app_spec, {})
+
+    spec = mk_spec()
+    api_urls = provider.construct_views(spec, compact=True)
+    assert spec == {}
+
+    class URLConf(object):
+        urlpatterns = api_urls
+
+    settings.ROOT_URLCONF = URLConf
+    api = client.copy(prefix='/api/prefix/')
+
+    resp = api.post('institutions', {'name': 'inst'})
+    assert resp.status_code == 201
+    resp = api.get('institutions')
+    assert resp.status_code == 200
+    assert [inst['name'] for inst in resp.json()] == ['inst']
+
+    app = provider.LazyApimasApp(mk_spec())
+    provider.prepare_fork(app)
+    assert all(views.spec is None and views.views is not None
+               for views in app.collections)
+
+    class LazyURLConf(object):
+        urlpatterns = app.urlpatterns
+
+    settings.ROOT_URLCONF = LazyURLConf
+    resp = api.get('institutions/1')
+    assert resp.status_code == 200
+    assert resp.json()['name'] == 'inst'
+
+
+def test_tab_rules_cache():
+    from apimas.components import permissions
+
+    processor = object.__new__(permissions.PermissionsProcessor)
+    rules = [('api/prefix/posts', 'list', '*', '*', '*', '*', '*')]
+    tab_rules = processor.init_tab_rules(rules)
+    assert processor.init_tab_rules(list(rules)) is tab_rules
+
+    # the rules of reloads are kept up to a bound
+    for i in range(2 * permissions.TAB_RULES_CACHE_SIZE):
+        processor.init_tab_rules(
+            [('api/prefix/posts', 'list', 'role%d' % i, '*', '*', '*', '*')])
+    assert len(permissions._tab_rules_cache) == \
+        permissions.TAB_RULES_CACHE_SIZE
+    assert processor.init_tab_rules(rules) is not tab_rules
+
+def test_response_cache(client, settings):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from apimas_django import provider
+    from anapp.cache import response_cache
+    from aproj.spec import GROUPS
+
+    groups = copy.deepcopy(GROUPS)
+    groups[':response_cache'] = 'anapp.cache.response_cache'
+    app_config = dict(INSTITUTIONS_APP_CONFIG, endpoints={
+        'api/prefix': {'collections': {'groups': groups,
+                                       'institutions': INSTITUTIONS}}})
+    spec = provider.configure_spec(
+        provider.configure_apimas_app(app_config), {})
+
+    class URLConf(object):
+        urlpatterns = provider.construct_views(spec)
+    settings.ROOT_URLCONF = URLConf
+    response_cache.clear()
+
+    api = client.copy(prefix='/api/prefix/')
+    inst = models.Institution.objects.create(name='inst', active=True)
+    data = {
+        'name': 'group',
+        'founded': '2014-12-31',
+        'email': 'email@example.com',
+        'institution_id': inst.id,
+        'members': [{'onoma': 'member', 'age': 20}],
+    }
+    resp = api.post('groups', data)
+    assert resp.status_code == 201
+    group_path = 'groups/%s' % resp.json()['id']
+    members_path = group_path + '/members'
+    member_path = members_path + '/%s' % resp.json()['members'][0]['id']
+
+    def get(path, **params):
+        with CaptureQueriesContext(connection) as queries:
+            resp = api.get(path, params)
+        assert resp.status_code == 200
+        return resp.json(), len(queries.captured_queries)
+
+    body, count = get('groups')
+    assert count > 0
+    assert get('groups') == (body, 0)
+    assert get('groups', flt__active='true')[1] > 0
+    assert get(members_path)[1] > 0
+    assert get(members_path)[1] == 0
+    assert get(group_path)[1] > 0
+    assert get(group_path)[1] == 0
+
+    # writes to a subcollection invalidate its parent
+    resp = api.patch(member_path, {'age': 21})
+    assert resp.status_code == 200
+    body, count = get('groups')
+    assert count > 0
+    assert body[0]['members'][0]['age'] == 21
+    assert get(members_path)[1] > 0
+
+    # and writes to a collection invalidate its subcollections
+    resp = api.patch(group_path, {'name': 'renamed'})
+    assert resp.status_code == 200
+    assert get(members_path)[1] > 0
+    body, count = get(group_path)
+    assert count > 0
+    assert body['name'] == 'renamed'
+
+    # expansions read other collections and are not cached
+    get(group_path, expand='institution_id')
+    assert get(group_path, expand='institution_id')[1] > 0
+
+
+def test_response_cache_annotations(client, settings):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from apimas_django import provider
+    from anapp.cache import response_cache
+    from aproj.spec import GROUPS, FEATURES
+
+    groups = copy.deepcopy(GROUPS)
+    groups[':response_cache'] = 'anapp.cache.response_cache'
+    groups['fields']['feature_count'] = {
+        '.field.annotation': {}, 'function': 'count', 'over': 'feature'}
+    features = copy.deepcopy(FEATURES)
+    features[':response_cache'] = 'anapp.cache.response_cache'
+    app_config = dict(INSTITUTIONS_APP_CONFIG, endpoints={
+        'api/prefix': {'collections': {'groups': groups,
+                                       'features': features,
+                                       'institutions': INSTITUTIONS}}})
+    spec = provider.configure_spec(
+        provider.configure_apimas_app(app_config), {})
+
+    class URLConf(object):
+        urlpatterns = provider.construct_views(spec)
+    settings.ROOT_URLCONF = URLConf
+    response_cache.clear()
+
+    api = client.copy(prefix='/api/prefix/')
+    group = models.Group.objects.create(
+        name='group', founded='2014-12-31', active=True,
+        email='email@example.com')
+    group_path = 'groups/%s' % group.id
+
+    def get(path):
+        with CaptureQueriesContext(connection) as queries:
+            resp = api.get(path)
+        assert resp.status_code == 200
+        return resp.json()['feature_count'], len(queries.captured_queries)
+
+    assert get(group_path)[0] == 0
+    assert get(group_path) == (0, 0)
+
+    # writes to the models of annotations invalidate the collection
+    resp = api.post('features', {'name': 'feature', 'group_id': str(group.id)})
+    assert resp.status_code == 201
+    assert get(group_path)[0] == 1
+
+
+def test_fragment_cache(client, settings, monkeypatch):
+    from apimas_django import provider
+    from anapp.cache import fragment_cache
+
+    institutions = copy.deepcopy(INSTITUTIONS)
+    institutions[':fragment_cache'] = 'anapp.cache.fragment_cache'
+    app_config = dict(INSTITUTIONS_APP_CONFIG, endpoints={
+        'api/prefix': {'collections': {'institutions': institutions}}})
+    spec = provider.configure_spec(
+        provider.configure_apimas_app(app_config), {})
+
+    class URLConf(object):
+        urlpatterns = provider.construct_views(spec)
+    settings.ROOT_URLCONF = URLConf
+    fragment_cache.clear()
+    stored = []
+    set_fragment = fragment_cache.set
+    monkeypatch.setattr(fragment_cache, 'set', lambda key, value: (
+        stored.append(value['name']), set_fragment(key, value)))
+
+    api = client.copy(prefix='/api/prefix/')
+    for name in ['a', 'b', 'c']:
+        resp = api.post('institutions', {'name': name})
+        assert resp.status_code == 201
+    a_id, b_id = resp.json()['id'] - 2, resp.json()['id'] - 1
+
+    def names(**params):
+        resp = api.get('institutions', params)
+        assert resp.status_code == 200
+        body = resp.json()
+        results = body['results'] if 'results' in body else body
+        return [elem['name'] for elem in results]
+
+    assert names(ordering='name') == ['a', 'b', 'c']
+    assert stored == ['a', 'b', 'c']
+    assert names(ordering='-name') == ['c', 'b', 'a']
+    assert stored == ['a', 'b', 'c']
+
+    # rows are served from the cache until their version changes
+    models.Institution.objects.filter(id=a_id).update(name='aa')
+    assert names(ordering='name') == ['a', 'b', 'c']
+    resp = api.patch('institutions/%s' % b_id, {'name': 'd'})
+    assert resp.status_code == 200
+    del stored[:]
+    assert names(ordering='name') == ['a', 'c', 'd']
+    assert stored == ['d']
+
+    # pages are assembled within their meta, per set of readable fields
+    assert names(ordering='name', limit=2, offset=1) == ['c', 'd']
+    assert stored == ['d']
+    resp = api.get('institutions', {'fields': 'name', 'ordering': 'name'})
+    assert resp.json()[0] == {'name': 'aa'}
+    assert stored == ['d', 'aa', 'c', 'd']
+
+    # requests with expansions are not cached
+    del stored[:]
+    resp = api.get('institutions', {'expand': 'name', 'ordering': 'name'})
+    assert resp.status_code == 400
+    assert stored == []
+
+
+def test_fragment_cache_users(client, settings, monkeypatch):
+    from apimas_django import provider
+    from anapp.cache import fragment_cache
+
+    institutions = copy.deepcopy(INSTITUTIONS)
+    institutions[':permissions_namespace'] = 'anapp.checks'
+    institutions[':authenticator'] = 'apimas.auth.TokenAuthentication'
+    institutions[':verifier'] = 'anapp.auth.token_verifier'
+    institutions[':user_resolver'] = 'anapp.auth.user_resolver'
+    institutions[':fragment_cache'] = 'anapp.cache.fragment_cache'
+    app_config = dict(INSTITUTIONS_APP_CONFIG, endpoints={
+        'api/restricted': {'collections': {'institutions': institutions}}})
+    spec = provider.configure_spec(
+        provider.configure_apimas_app(app_config), {})
+
+    class URLConf(object):
+        urlpatterns = provider.construct_views(spec)
+    settings.ROOT_URLCONF = URLConf
+    fragment_cache.clear()
+    stored = []
+    set_fragment = fragment_cache.set
+    monkeypatch.setattr(fragment_cache, 'set', lambda key, value: (
+        stored.append(value['name']), set_fragment(key, value)))
+
+    models.User.objects.create_user('user1', role='user', token='TOKEN1')
+    models.User.objects.create_user('user2', role='user', token='TOKEN2')
+    models.Institution.objects.create(name='inst', active=True)
+
+    def names(**kwargs):
+        api = client.copy(prefix='/api/restricted/', **kwargs)
+        resp = api.get('institutions')
+        assert resp.status_code == 200
+        return [elem['name'] for elem in resp.json()]
+
+    # the rules filter per user, so fragments are kept per user and not
+    # cached without one
+    assert names() == ['inst']
+    assert stored == []
+    assert names(auth_token='TOKEN1') == ['inst']
+    assert names(auth_token='TOKEN1') == ['inst']
+    assert stored == ['inst']
+    assert names(auth_token='TOKEN2') == ['inst']
+    assert stored == ['inst', 'inst']
+
+def test_fragment_cache_annotations(client, settings):
+    from apimas_django import provider
+    from anapp.cache import fragment_cache
+    from aproj.spec import GROUPS
+
+    institutions = copy.deepcopy(INSTITUTIONS)
+    institutions[':fragment_cache'] = 'anapp.cache.fragment_cache'
+    institutions['fields']['group_count'] = {
+        '.field.annotation': {}, 'function': 'count', 'over': 'group'}
+    # Groups have no version column; their writes advance the generations
+    # of the fragment cache as a response cache.
+    groups = copy.deepcopy(GROUPS)
+    groups[':response_cache'] = 'anapp.cache.fragment_cache'
+    app_config = dict(INSTITUTIONS_APP_CONFIG, endpoints={
+        'api/prefix': {'collections': {'groups': groups,
+                                       'institutions': institutions}}})
+    spec = provider.configure_spec(
+        provider.configure_apimas_app(app_config), {})
+
+    class URLConf(object):
+        urlpatterns = provider.construct_views(spec)
+    settings.ROOT_URLCONF = URLConf
+    fragment_cache.clear()
+
+    api = client.copy(prefix='/api/prefix/')
+    inst = models.Institution.objects.create(name='inst', active=True)
+
+    def counts():
+        resp = api.get('institutions')
+        assert resp.status_code == 200
+        return [elem['group_count'] for elem in resp.json()]
+
+    assert counts() == [0]
+    assert counts() == [0]
+
+    # writes to the models of annotations leave the version of the row as
+    # is, but invalidate its fragments
+    resp = api.post('groups', {
+        'name': 'group',
+        'founded': '2014-12-31',
+        'email': 'email@example.com',
+        'institution_id': inst.id,
+        'members': [],
+    })
+    assert resp.status_code == 201
+    assert counts() == [1]
+
+
+def test_auth_cache(client, settings, tmpdir):
+    import hashlib
+    import json
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from apimas.auth import AuthCache, TokenSigner
+    from apimas.cache import LRUCache, SQLiteCache
+    from apimas.errors import UnauthorizedError
+    from apimas_django import provider
+    from anapp.cache import auth_cache
+    from aproj.spec import POSTS
+
+    posts = copy.deepcopy(POSTS)
+    posts[':auth_cache'] = 'anapp.cache.auth_cache'
+    app_config = dict(INSTITUTIONS_APP_CONFIG, endpoints={
+        'api/prefix': {'collections': {'posts': posts}}})
+    spec = provider.configure_spec(
+        provider.configure_apimas_app(app_config), {})
+
+    class URLConf(object):
+        urlpatterns = provider.construct_views(spec)
+    settings.ROOT_URLCONF = URLConf
+    auth_cache.revoke_all()
+
+    admin = models.User.objects.create_user(
+        'admin', role='admin', token='ADMINTOKEN')
+    api = client.copy(prefix='/api/prefix/', auth_token='ADMINTOKEN')
+    other = client.copy(prefix='/api/prefix/', auth_token='OTHERTOKEN')
+
+    def get(api):
+        with CaptureQueriesContext(connection) as queries:
+            resp = api.get('posts')
+        return resp.status_code, len(queries.captured_queries)
+
+    status, count = get(api)
+    assert status == 200
+    assert get(api) == (200, count - 1)
+    assert get(other) == (401, 1)
+    assert get(other) == (401, 0)
+
+    # a new token is verified on its next use
+    models.User.objects.filter(id=admin.id).update(token='OTHERTOKEN')
+    auth_cache.revoke('OTHERTOKEN')
+    assert get(other) == (200, count)
+    auth_cache.revoke_all()
+    assert get(api)[0] == 401
+
+    # only hashes of the credentials are stored
+    path = str(tmpdir.join('auth.db'))
+    shared = AuthCache(SQLiteCache(path), 'secret')
+    verify = shared.verifier(lambda token: {'user': token.lower()})
+    assert verify('SECRETTOKEN') == {'user': 'secrettoken'}
+    assert verify('SECRETTOKEN') == {'user': 'secrettoken'}
+    assert 'SECRETTOKEN' not in open(path, 'rb').read()
+    # unsalted hashes could be checked against guessed credentials
+    assert hashlib.sha256(json.dumps('SECRETTOKEN')).hexdigest() \
+        not in open(path, 'rb').read()
+    with pytest.raises(ValueError):
+        AuthCache(SQLiteCache(path), None)
+
+    # signed tokens are not cached past their expiry
+    now = [1000.0]
+    signer = TokenSigner('key', max_age=10, clock=lambda: now[0])
+    cache = AuthCache(LRUCache(maxsize=10), 'secret', ttl=60,
+                      clock=lambda: now[0])
+    verify = cache.verifier(signer)
+    token = signer.issue(1, ['user'])
+    assert verify(token)['sub'] == 1
+    now[0] += 5
+    assert verify(token)['sub'] == 1
+    now[0] += 5
+    with pytest.raises(UnauthorizedError):
+        verify(token)
+
+
+def test_signed_token_authentication(client, settings):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from apimas.auth import ClientSignedTokenAuthentication, TokenSigner
+    from apimas_django import provider
+    from anapp.auth import token_signer
+    from aproj.spec import POSTS
+
+    posts = copy.deepcopy(POSTS)
+    posts.update({
+        ':authenticator': 'apimas.auth.SignedTokenAuthentication',
+        ':verifier': 'anapp.auth.token_signer',
+        ':user_resolver': 'apimas.auth.token_user_resolver',
+    })
+    app_config = dict(INSTITUTIONS_APP_CONFIG, endpoints={
+        'api/prefix': {'collections': {'posts': posts}}})
+    spec = provider.configure_spec(
+        provider.configure_apimas_app(app_config), {})
+
+    class URLConf(object):
+        urlpatterns = provider.construct_views(spec)
+    settings.ROOT_URLCONF = URLConf
+    models.Post.objects.create(title='title', body='hi admin',
+                               status='posted')
+
+    def get(headers):
+        with CaptureQueriesContext(connection) as queries:
+            resp = client.get('/api/prefix/posts/', **{
+                'HTTP_' + name.upper(): value
+                for name, value in headers.iteritems()})
+        assert not any('"anapp_user"' in query['sql']
+                       for query in queries.captured_queries)
+        return resp
+
+    auth = ClientSignedTokenAuthentication(token_signer)
+    resp = get(auth.attach_to_headers(1, ['admin'], username='admin'))
+    assert resp.status_code == 200
+    assert len(resp.json()) == 1
+
+    # roles and other claims are read off the token
+    resp = get(auth.attach_to_headers(2, ['user'], username='admin'))
+    assert resp.status_code == 200
+    assert resp.json() == []
+
+    expired = TokenSigner(settings.SECRET_KEY, clock=lambda: 0)
+    resp = get(ClientSignedTokenAuthentication(expired).attach_to_headers(
+        1, ['admin']))
+    assert resp.status_code == 401
+    assert resp.json()['details'] == 'Token expired'
+    assert resp['WWW-Authenticate'] == 'Bearer'
+
+    forged = TokenSigner('other key')
+    resp = get(ClientSignedTokenAuthentication(forged).attach_to_headers(
+        1, ['admin']))
+    assert resp.status_code == 401
+
+    # keys are rotated by keeping the old one as a fallback
+    rotated = TokenSigner('new key', fallback_keys=[settings.SECRET_KEY])
+    assert rotated.verify(token_signer.issue(1, ['admin']))['sub'] == 1
+
+
+def test_cache_backends(tmpdir):
+    from apimas.cache import LRUCache, SQLiteCache
+
+    now = [0]
+    shared = SQLiteCache(str(tmpdir.join('cache.db')), ttl=10,
+                         clock=lambda: now[0])
+    for cache in [LRUCache(maxsize=2, ttl=10, clock=lambda: now[0]), shared]:
+        cache.set('a', {'content': [1]})
+        assert cache.get('a') == {'content': [1]}
+        assert cache.get('b') is None
+        assert cache.get_many(['b', 'a']) == [None, {'content': [1]}]
+        assert cache.generations(['x', 'y']) == [0, 0]
+        cache.bump(['x'])
+        assert cache.generations(['x', 'y']) == [1, 0]
+        now[0] = 10
+        assert cache.get('a') is None
+        now[0] = 0
+
+    lru = LRUCache(maxsize=2, shared=shared)
+    for key in 'abc':
+        lru.set(key, key)
+    assert [lru.get(key) for key in 'abc'] == [None, 'b', 'c']
+    shared.bump(['x'])
+    assert lru.generations(['x']) == [2]
+
+
+def test_optimistic_concurrency(client, settings):
+    from apimas_django import provider
+    from apimas_django.handlers import Condition, claim_instance
+    from apimas.errors import PreconditionFailed
+
+    def configure(**config):
+        institutions = copy.deepcopy(INSTITUTIONS)
+        institutions.update(config)
+        institutions['actions']['.action-template.django.bulk_update'] = {}
+        app_config = dict(INSTITUTIONS_APP_CONFIG, endpoints={
+            'api/prefix': {'collections': {'institutions': institutions}}})
+        app_spec = provider.configure_apimas_app(app_config)
+        spec = provider.configure_spec(app_spec, {})
+
+        class URLConf(object):
+            urlpatterns = provider.construct_views(spec)
+        settings.ROOT_URLCONF = URLConf
+
+    api = client.copy(prefix='/api/prefix/')
+
+    # ETag is a hash of the readable columns
+    configure(**{':optimistic_concurrency': True})
+    resp = api.post('institutions', {'name': 'inst'})
+    assert resp.status_code == 201
+    etag = resp['ETag']
+    path = 'institutions/%s' % resp.json()['id']
+
+    resp = api.get(path)
+    assert resp.status_code == 200
+    assert resp['ETag'] == etag
+
+    resp = api.patch(path, {'name': 'renamed'})
+    assert resp.status_code == 428
+    resp = api.patch(path, {'name': 'renamed'}, HTTP_IF_MATCH='"other"')
+    assert resp.status_code == 412
+
+    resp = api.patch(path, {'name': 'renamed'}, HTTP_IF_MATCH=etag)
+    assert resp.status_code == 200
+    assert resp.json()['name'] == 'renamed'
+    new_etag = resp['ETag']
+    assert new_etag != etag
+
+    resp = api.patch(path, {'name': 'lost'}, HTTP_IF_MATCH=etag)
+    assert resp.status_code == 412
+    resp = api.delete(path, HTTP_IF_MATCH=etag)
+    assert resp.status_code == 412
+    resp = api.delete(path, HTTP_IF_MATCH=new_etag)
+    assert resp.status_code == 204
+
+    # bulk updates cannot check the ETags of the resources they write
+    resp = api.patch('institutions', {'name': 'bulk'})
+    assert resp.status_code == 400
+
+    # ETag is the version column
+    configure(**{':optimistic_concurrency': True, ':version_field': 'version'})
+    resp = api.post('institutions', {'name': 'inst'})
+    assert resp.status_code == 201
+    assert resp['ETag'] == '"1"'
+    inst_id = resp.json()['id']
+    path = 'institutions/%s' % inst_id
+
+    resp = api.put(path, {'name': 'renamed'}, HTTP_IF_MATCH='"1"')
+    assert resp.status_code == 200
+    assert resp['ETag'] == '"2"'
+    assert models.Institution.objects.get(id=inst_id).version == 2
+
+    resp = api.patch(path, {'name': 'lost'}, HTTP_IF_MATCH='"1"')
+    assert resp.status_code == 412
+
+    # a write between fetching and writing the row is detected
+    instance = models.Institution.objects.get(id=inst_id)
+    condition = Condition({'version': 2}, 'version')
+    models.Institution.objects.filter(id=inst_id).update(version=3)
+    with pytest.raises(PreconditionFailed):
+        claim_instance(instance, condition)
+
+    # bulk updates increment the version, invalidating the ETags
+    resp = api.patch('institutions', {'name': 'bulk'})
+    assert resp.status_code == 200
+    assert models.Institution.objects.get(id=inst_id).version == 4
+    resp = api.patch(path, {'name': 'lost'}, HTTP_IF_MATCH='"3"')
+    assert resp.status_code == 412
+    assert api.get(path)['ETag'] == '"4"'
+
+    resp = api.delete(path, HTTP_IF_MATCH='"4"')
+    assert resp.status_code == 204
+    assert not models.Institution.objects.filter(id=inst_id).exists()
@@ -38,6 +38,12 @@ ENHANCEDUSERS = {
             '.flag.nowrite': {}},
         'feature': {
             '.field.string': {}},
+        'institution_count': {
+            '.field.annotation': {},
+            '.flag.filterable': {},
+            '.flag.orderable': {},
+            'function': 'count',
+            'over': 'institutions'},
         'user': {
             '.field.struct': {},
             'fields': {
@@ -192,6 +198,8 @@ POSTS = {
         '.action-template.django.retrieve': {},
         '.action-template.django.partial_update': {},
         '.action-template.django.delete': {},
+        '.action-template.django.bulk_update': {},
+        '.action-template.django.bulk_delete': {},
         'create': {
             ':post_handler': 'anapp.models.post_create_post',
         },
@@ -208,12 +216,16 @@ POSTS = {
         "title": {".field.string": {}},
         "body": {".field.string": {}},
         "status": {".field.string": {},
+                   ".flag.filterable": {},
                    "default": "pending"},
     }
 }
 
 POSTS2 = copy.deepcopy(POSTS)
 POSTS2[':permissions_namespace'] = 'anapp'
+POSTS2['actions']['list'] = {
+    ':default_fields': 'id,url,title,status',
+}
 
 NULLTEST = {
     '.field.collection.django': {},
@@ -239,8 +251,11 @@ NULLTEST = {
 INSTITUTIONS = {
     ".field.collection.django": {},
     "model": "anapp.models.Institution",
+    "changes_column": "modified",
+    ":cache_control": "private, max-age=0",
     "actions": {
         '.action-template.django.list': {},
+        '.action-template.django.changes': {},
         '.action-template.django.retrieve': {},
         '.action-template.django.create': {},
         '.action-template.django.partial_update': {},
@@ -275,9 +290,11 @@ INSTITUTIONS = {
 
 GROUPS = {
     ".field.collection.django": {},
+    ":bulk_create": True,
     "model": "anapp.models.Group",
     "actions": {
         '.action-template.django.list': {},
+        '.action-template.django.aggregate': {},
         '.action-template.django.partial_update': {},
         '.action-template.django.create': {},
         '.action-template.django.retrieve': {},
@@ -346,8 +363,12 @@ GROUPS = {
     }
 }
 
+BOUNDEDGROUPS = copy.deepcopy(GROUPS)
+BOUNDEDGROUPS['fields']['members']['embed_limit'] = 2
+
 FEATURES = {
     ".field.collection.django": {},
+    ":expand_depth": 2,
     "model": "anapp.models.Feature",
     "actions": {
         '.action-template.django.retrieve': {},
@@ -452,6 +473,7 @@ APP_CONFIG = {
                 'nulltest': NULLTEST,
                 "institutions": INSTITUTIONS,
                 "groups": GROUPS,
+                "boundedgroups": BOUNDEDGROUPS,
                 "features": FEATURES,
                 "negotiations": NEGOTIATIONS,
                 "accounts": ACCOUNTS,
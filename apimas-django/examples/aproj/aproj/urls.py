@@ -23,7 +23,7 @@ from aproj.spec import APP_CONFIG, DEPLOY_CONFIG
 app_spec = provider.configure_apimas_app(APP_CONFIG)
 deployment_spec = provider.configure_spec(app_spec, DEPLOY_CONFIG)
 
-api_urls = provider.construct_views(deployment_spec)
+api_urls = provider.construct_views(deployment_spec, compact=True)
 
 urlpatterns = [
     url(r'^admin/', include(admin.site.urls)),
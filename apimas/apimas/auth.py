@@ -1,4 +1,8 @@
 import base64
+import hashlib
+import hmac
+import json
+import time
 from apimas.errors import UnauthorizedError
 
 
@@ -100,6 +104,239 @@ class DjoserAuthentication(TokenAuthentication):
     AUTH_HEADERS = 'Token'
 
 
+def b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip('=')
+
+
+def b64decode(data):
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+class TokenSigner(object):
+    """
+    Issue and verify self-contained tokens, signed with HMAC-SHA256.
+
+    A token carries its claims: the id of the user as `sub`, the `roles`
+    of the user and the time the token expires as `exp`, which is at most
+    `max_age` seconds after the token is issued. Tokens signed with any of
+    `fallback_keys` are accepted too, so that keys can be rotated.
+
+    A signer is a verifier: called with a token, it returns its claims, or
+    raises `UnauthorizedError` if the token is invalid or expired.
+    """
+
+    def __init__(self, key, max_age=3600, fallback_keys=(), clock=time.time):
+        self.keys = [k.encode('utf-8') if isinstance(k, unicode) else k
+                     for k in (key,) + tuple(fallback_keys)]
+        self.max_age = max_age
+        self.clock = clock
+
+    def signature(self, payload, key):
+        return b64encode(hmac.new(key, payload, hashlib.sha256).digest())
+
+    def issue(self, user_id, roles, max_age=None, **claims):
+        """
+        Issue a token for a user with the given roles; `claims` are carried
+        along with them.
+        """
+        if max_age is None or max_age > self.max_age:
+            max_age = self.max_age
+        claims.update(sub=user_id, roles=list(roles),
+                      exp=int(self.clock() + max_age))
+        payload = b64encode(json.dumps(
+            claims, sort_keys=True, separators=(',', ':')))
+        return '%s.%s' % (payload, self.signature(payload, self.keys[0]))
+
+    def verify(self, token):
+        try:
+            payload, _, signature = token.encode('ascii').partition('.')
+        except UnicodeError:
+            raise UnauthorizedError('Invalid token given')
+        if not any(hmac.compare_digest(self.signature(payload, key),
+                                       signature) for key in self.keys):
+            raise UnauthorizedError('Invalid token given')
+        try:
+            claims = json.loads(b64decode(payload))
+            expires = float(claims['exp'])
+        except (TypeError, ValueError, KeyError):
+            raise UnauthorizedError('Invalid token given')
+        if expires <= self.clock():
+            raise UnauthorizedError('Token expired')
+        return claims
+
+    __call__ = verify
+
+
+class SignedTokenAuthentication(TokenAuthentication):
+    """
+    Authentication by tokens issued by the `TokenSigner` given as verifier.
+
+    Tokens are verified by their signature alone, so no lookups are
+    needed. The identity of a request is the claims of its token; see
+    `token_user_resolver` for reading the user off them, too.
+    """
+
+    def authenticate(self, headers):
+        token = self.extract_from_headers(headers)
+        claims = self.verifier(token)
+        if claims is None:
+            raise UnauthorizedError('Invalid token given')
+        return claims
+
+
+class TokenUser(object):
+    """
+    A user as described by the claims of a signed token.
+
+    Its id and roles are the `sub` and `roles` claims; any other claims
+    are available as attributes.
+    """
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, claims):
+        self.claims = claims
+        self.pk = self.id = claims['sub']
+        self.apimas_roles = list(claims.get('roles') or ())
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['claims'][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __repr__(self):
+        return '<TokenUser: %s>' % (self.pk,)
+
+
+def token_user_resolver(identity, context=None):
+    """ Resolve the claims of a signed token to a `TokenUser`. """
+    return TokenUser(identity)
+
+
+def default_identity_key(identity):
+    pk = getattr(identity, 'pk', None)
+    if pk is not None:
+        return (type(identity).__name__, pk)
+    return json.dumps(identity, sort_keys=True, default=repr)
+
+
+def get_expiry(value):
+    """
+    Get the time a verified identity or resolved user expires, given as an
+    `exp` claim, as by `TokenSigner`; `None` if it does not expire.
+    """
+    if isinstance(value, dict):
+        expires = value.get('exp')
+    else:
+        expires = getattr(value, 'exp', None)
+    try:
+        return None if expires is None else float(expires)
+    except (TypeError, ValueError):
+        return None
+
+
+class AuthCache(object):
+    """
+    Cache of the results of verifiers and user resolvers.
+
+    Results are stored in an `apimas.cache.ResponseCache` backend, keyed
+    by an HMAC of the credentials or of the identity they were computed
+    from, under `secret`; credentials themselves are never stored, and the
+    hashes cannot be checked against guessed credentials. Processes that
+    share a backend must share the secret as well, or they do not see each
+    other's entries and revocations.
+    Verified identities and resolved users are kept for `ttl` seconds, but
+    not past their `exp` claim, if any, and failed lookups, i.e. `None`, for
+    `negative_ttl` seconds, within the expiration and size bounds of the
+    backend.
+
+    Cached values are shared by the requests served from the cache and must
+    not be modified. A `SQLiteCache` backend requires them to be JSON
+    serializable; an `LRUCache` keeps them in process, and with a `shared`
+    backend shares the revocations among processes.
+
+    Identities are keyed by `identity_key`; by default, by the primary key
+    of objects that have one and by their JSON otherwise.
+    """
+    REVOKE_ALL = 'auth:*'
+
+    def __init__(self, cache, secret, ttl=60, negative_ttl=5,
+                 identity_key=default_identity_key, clock=time.time):
+        if not secret:
+            raise ValueError('AuthCache requires a secret')
+        self.cache = cache
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.secret = secret.encode('utf-8') \
+            if isinstance(secret, unicode) else secret
+        self.identity_key = identity_key
+        self.clock = clock
+
+    def hash(self, kind, value):
+        # JSON, so that str and unicode credentials hash alike.
+        data = json.dumps(value, sort_keys=True, default=repr)
+        digest = hmac.new(self.secret, data, hashlib.sha256).hexdigest()
+        return 'auth:%s:%s' % (kind, digest)
+
+    def credentials_name(self, credentials):
+        return self.hash('credentials', credentials)
+
+    def identity_name(self, identity):
+        return self.hash('identity', self.identity_key(identity))
+
+    def lookup(self, name, compute, *args):
+        """
+        Get the cached result of `compute` for the credentials or identity
+        given by `name`, computing and caching it if missing or expired.
+        """
+        generations = self.cache.generations([self.REVOKE_ALL, name])
+        key = '%s:%d:%d' % (name, generations[0], generations[1])
+        now = self.clock()
+        entry = self.cache.get(key)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+
+        value = compute(*args)
+        ttl = self.negative_ttl if value is None else self.ttl
+        expires = get_expiry(value)
+        if ttl and expires is not None:
+            ttl = min(ttl, expires - now)
+        if ttl > 0:
+            self.cache.set(key, [now + ttl, value])
+        return value
+
+    def verifier(self, verifier):
+        """ Wrap a verifier so that its results are cached. """
+        def verify(credentials):
+            return self.lookup(self.credentials_name(credentials),
+                               verifier, credentials)
+        return verify
+
+    def resolver(self, resolver):
+        """
+        Wrap a user resolver so that its results are cached.
+
+        Users are cached by identity alone, so the resolver must not depend
+        on the rest of the context.
+        """
+        def resolve(identity, context=None):
+            return self.lookup(self.identity_name(identity),
+                               resolver, identity, context)
+        return resolve
+
+    def revoke(self, credentials):
+        """ Drop the cached verification of the given credentials. """
+        self.cache.bump([self.credentials_name(credentials)])
+
+    def revoke_identity(self, identity):
+        """ Drop the cached user of the given identity. """
+        self.cache.bump([self.identity_name(identity)])
+
+    def revoke_all(self):
+        self.cache.bump([self.REVOKE_ALL])
+
+
 class ClientBasicAuthentication(object):
     AUTH_HEADERS = 'Basic'
 
@@ -120,3 +357,17 @@ class ClientTokenAuthentication(object):
         return {
             'Authorization': auth
         }
+
+
+class ClientSignedTokenAuthentication(ClientTokenAuthentication):
+    """
+    Attach tokens issued on the spot by a `TokenSigner`, e.g. for calls
+    between services that share its key.
+    """
+
+    def __init__(self, signer):
+        self.signer = signer
+
+    def attach_to_headers(self, user_id, roles, **claims):
+        token = self.signer.issue(user_id, roles, **claims)
+        return ClientTokenAuthentication.attach_to_headers(self, token)
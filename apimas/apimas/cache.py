@@ -0,0 +1,187 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResponseCache(object):
+    """
+    Base class of response cache backends.
+
+    Besides entries, a backend keeps generation counters by name. Entries
+    are keyed by the generations of the data they depend on, so bumping a
+    generation invalidates every entry that depends on it, without having
+    to find them.
+    """
+
+    def get(self, key):
+        """
+        Return the value stored under `key`, or `None` if there is none or
+        it has expired.
+        """
+        raise NotImplementedError('get() must be implemented')
+
+    def get_many(self, keys):
+        """ Return the values stored under the given keys, in order. """
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value):
+        raise NotImplementedError('set() must be implemented')
+
+    def generations(self, names):
+        """ Return the current generations of the given names, in order. """
+        raise NotImplementedError('generations() must be implemented')
+
+    def bump(self, names):
+        """ Advance the generations of the given names. """
+        raise NotImplementedError('bump() must be implemented')
+
+    def clear(self):
+        raise NotImplementedError('clear() must be implemented')
+
+
+class LRUCache(ResponseCache):
+    """
+    In-process cache of at most `maxsize` entries, each kept for at most
+    `ttl` seconds; the least recently used entries are evicted first.
+
+    Generations are kept in process too, unless a `shared` backend is
+    given: then writes in other processes invalidate the entries of this
+    one as well. Values are stored as given and must not be modified.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300, shared=None, clock=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.shared = shared
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= self.clock():
+                return None
+            self._entries[key] = entry
+            return value
+
+    def set(self, key, value):
+        expires = self.clock() + self.ttl
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (expires, value)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def generations(self, names):
+        if self.shared is not None:
+            return self.shared.generations(names)
+        with self._lock:
+            return [self._generations.get(name, 0) for name in names]
+
+    def bump(self, names):
+        if self.shared is not None:
+            return self.shared.bump(names)
+        with self._lock:
+            for name in names:
+                self._generations[name] = self._generations.get(name, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteCache(ResponseCache):
+    """
+    Cache shared by the processes of a host, stored in the SQLite database
+    at `path`.
+
+    Entries are kept for at most `ttl` seconds and must be JSON
+    serializable. Expired entries are purged every `purge_every` writes.
+    """
+
+    def __init__(self, path, ttl=300, purge_every=1000, clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self.purge_every = purge_every
+        self.clock = clock
+        self._writes = 0
+        self._local = threading.local()
+
+    def connection(self):
+        conn = getattr(self._local, 'connection', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5,
+                                   isolation_level=None)
+            conn.execute('CREATE TABLE IF NOT EXISTS entries '
+                         '(key TEXT PRIMARY KEY, expires REAL, value TEXT)')
+            conn.execute('CREATE TABLE IF NOT EXISTS generations '
+                         '(name TEXT PRIMARY KEY, value INTEGER)')
+            self._local.connection = conn
+        return conn
+
+    def get(self, key):
+        row = self.connection().execute(
+            'SELECT expires, value FROM entries WHERE key = ?',
+            (key,)).fetchone()
+        if row is None or row[0] <= self.clock():
+            return None
+        return json.loads(row[1])
+
+    def get_many(self, keys):
+        keys = list(keys)
+        conn = self.connection()
+        now = self.clock()
+        values = {}
+        # SQLite limits the number of parameters of a statement.
+        for i in xrange(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            values.update(conn.execute(
+                'SELECT key, value FROM entries WHERE expires > ? '
+                'AND key IN (%s)' % ', '.join('?' * len(chunk)),
+                [now] + chunk).fetchall())
+        return [json.loads(values[key]) if key in values else None
+                for key in keys]
+
+    def set(self, key, value):
+        conn = self.connection()
+        now = self.clock()
+        conn.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?)',
+                     (key, now + self.ttl, json.dumps(value)))
+        self._writes += 1
+        if self._writes % self.purge_every == 0:
+            conn.execute('DELETE FROM entries WHERE expires <= ?', (now,))
+
+    def generations(self, names):
+        names = list(names)
+        if not names:
+            return []
+        rows = self.connection().execute(
+            'SELECT name, value FROM generations WHERE name IN (%s)' %
+            ', '.join('?' * len(names)), names).fetchall()
+        values = dict(rows)
+        return [values.get(name, 0) for name in names]
+
+    def bump(self, names):
+        conn = self.connection()
+        params = [(name,) for name in names]
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                'INSERT OR IGNORE INTO generations VALUES (?, 0)', params)
+            conn.executemany(
+                'UPDATE generations SET value = value + 1 WHERE name = ?',
+                params)
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def clear(self):
+        self.connection().execute('DELETE FROM entries')
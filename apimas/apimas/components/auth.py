@@ -14,7 +14,8 @@ class AuthenticationProcessor(BaseProcessor):
     name = 'apimas.components.processors.Authentication'
 
     READ_KEYS = {
-        'headers': 'request/meta/headers'
+        'headers': 'request/meta/headers',
+        'batch': 'request/meta/batch',
     }
 
     WRITE_KEYS = {
@@ -24,11 +25,17 @@ class AuthenticationProcessor(BaseProcessor):
 
     authenticator = None
 
-    def __init__(self, collection_loc, action_name, authenticator, verifier):
+    def __init__(self, collection_loc, action_name, authenticator, verifier,
+                 auth_cache=None):
 
         if authenticator:
             assert verifier
+            # Requests of a batch share the identity computed by the same
+            # authenticator and verifier.
+            self.batch_key = ('identity', authenticator, verifier)
             verifier = utils.import_object(verifier)
+            if auth_cache:
+                verifier = utils.import_object(auth_cache).verifier(verifier)
             _cls = utils.import_object(authenticator)
             self.authenticator = _cls(verifier)
 
@@ -39,11 +46,20 @@ class AuthenticationProcessor(BaseProcessor):
             # this processor.
             return
         data = self.read(context)
+        batch = data['batch']
+        if batch is not None and self.batch_key in batch:
+            identity = batch[self.batch_key]
+            if identity is not None:
+                self.write({'identity': identity}, context)
+            return
+
         try:
             identity = self.authenticator.authenticate(data['headers'])
         except MissingCredentials:
             # this indicates anonymous access, permissions processor will
             # handle authorization for this request
+            if batch is not None:
+                batch[self.batch_key] = None
             return
         except UnauthorizedError:
             # Provide the appropriate headers, so that handler can read them
@@ -53,6 +69,8 @@ class AuthenticationProcessor(BaseProcessor):
             if auth_headers:
                 self.write({'www_authenticate': auth_headers}, context)
             raise
+        if batch is not None:
+            batch[self.batch_key] = identity
         self.write({'identity': identity}, context)
 
 
@@ -63,6 +81,7 @@ class UserRetrievalProcessor(BaseProcessor):
     READ_KEYS = {
         'headers': 'request/meta/headers',
         'identity': 'auth/identity',
+        'batch': 'request/meta/batch',
     }
 
     WRITE_KEYS = (
@@ -73,11 +92,15 @@ class UserRetrievalProcessor(BaseProcessor):
     ANONYMOUS_ROLE = 'anonymous'
     ROLE_HEADER = 'USER_ROLE'
 
-    def __init__(self, collection_loc, action_name, user_resolver=None):
+    def __init__(self, collection_loc, action_name, user_resolver=None,
+                 auth_cache=None):
         if user_resolver:
             user_resolver = utils.import_object(user_resolver)
             assert callable(user_resolver), (
                 '"user_resolver" must be a callable')
+            if auth_cache:
+                user_resolver = utils.import_object(auth_cache).resolver(
+                    user_resolver)
         self.user_resolver = user_resolver
 
     def process(self, context):
@@ -90,7 +113,7 @@ class UserRetrievalProcessor(BaseProcessor):
         else:
             if not self.user_resolver:
                 raise Exception("No user_resolver set")
-            user = self.user_resolver(identity, context)
+            user = self.resolve_user(identity, data.get('batch'), context)
 
         if user is None:
             role = self.ANONYMOUS_ROLE
@@ -110,6 +133,21 @@ class UserRetrievalProcessor(BaseProcessor):
 
         self.write((user, role), context)
 
+    def resolve_user(self, identity, batch, context):
+        """
+        Resolve the user of an identity, once per batch of requests.
+
+        The identity is kept along with the user, so that it is not
+        garbage collected and its id is not reused during the batch.
+        """
+        if batch is None:
+            return self.user_resolver(identity, context)
+
+        key = ('user', self.user_resolver, id(identity))
+        if key not in batch:
+            batch[key] = (identity, self.user_resolver(identity, context))
+        return batch[key][1]
+
 
 USER_RETRIEVAL_CONSTRUCTORS = docular.doc_spec_init_constructor_registry({
 }, default=impexp.no_constructor)
@@ -1,7 +1,7 @@
 from copy import deepcopy
 from collections import namedtuple
 from apimas.errors import InvalidInput
-from docular import doc_set, doc_get
+from docular import doc_compile_get, doc_compile_set
 from apimas.utils import normalize_path
 
 
@@ -10,6 +10,29 @@ ProcessorConstruction = namedtuple(
 
 Null = object()
 
+# Compiled accessors per context path; paths are mostly the constant
+# READ_KEYS/WRITE_KEYS of processors, the size limit guards against others.
+_MAX_CACHED_PATHS = 4096
+_getters = {}
+_setters = {}
+
+
+def _compile_accessor(cache, compile_func, path):
+    try:
+        return cache[path]
+    except KeyError:
+        accessor = compile_func(normalize_path(path))
+        if len(cache) < _MAX_CACHED_PATHS:
+            cache[path] = accessor
+        return accessor
+    except TypeError:
+        # unhashable (list) paths
+        return compile_func(normalize_path(path))
+
+
+def _compile_setter(path):
+    return doc_compile_set(path, multival=False)
+
 
 class Context(object):
     def __init__(self, d=None):
@@ -26,8 +49,8 @@ class Context(object):
         Returns:
             The value of the desired key.
         """
-        path = normalize_path(path)
-        return doc_get(self._d, path)
+        getter = _compile_accessor(_getters, doc_compile_get, path)
+        return getter(self._d)
 
     def save(self, path, value):
         """
@@ -38,8 +61,8 @@ class Context(object):
                 string or tuple format (e.g. `foo/bar` or `('foo', bar')`.
             value: Value to be saved to the context.
         """
-        path = normalize_path(path)
-        doc_set(self._d, path, value, multival=False)
+        setter = _compile_accessor(_setters, _compile_setter, path)
+        setter(self._d, value)
 
 
 class BaseProcessor(object):
@@ -67,7 +67,9 @@ def list_constructor(context, instance, loc, top_spec, config):
     value['args'] = args
 
     docular.doc_spec_set(instance, value)
-    converter_obj(cnvs.List, dependencies=None)(
+    embed_limit = docular.doc_spec_get(instance, 'embed_limit')
+    cls = cnvs.List if embed_limit is None else cnvs.BoundedList
+    converter_obj(cls, dependencies=None)(
         context, instance, loc, top_spec, config)
 
 
@@ -84,6 +86,18 @@ def field_struct_constructor(context, instance, loc, top_spec, config):
         context, instance, loc, top_spec, config)
 
 
+ANNOTATION_CONVERTERS = {
+    'count': cnvs.Integer,
+    'exists': cnvs.Boolean,
+}
+
+
+def annotation_constructor(context, instance, loc, top_spec, config):
+    function = docular.doc_spec_get(instance, 'function')
+    cls = ANNOTATION_CONVERTERS.get(function, cnvs.Float)
+    converter_obj(cls)(context, instance, loc, top_spec, config)
+
+
 def construct_action(instance):
     on_collection = docular.doc_spec_get(instance['on_collection'])
     value = {'on_collection': on_collection}
@@ -114,6 +128,7 @@ IMPORTEXPORT_CONSTRUCTORS = docular.doc_spec_init_constructor_registry({
     '.field.file': converter_obj(cnvs.File),
     '.field.choices': converter_obj(
         cnvs.Choices, extra_args=['allowed', 'displayed']),
+    '.field.annotation': annotation_constructor,
 
     '.flag.*': no_constructor,
     '.flag.noread': cerberus_flag('noread'),
@@ -138,6 +153,19 @@ def import_integer(value):
     return cnvs.Integer().import_data(value, permissions=True)
 
 
+AGGREGATE_FUNCTIONS = ('count', 'sum', 'avg', 'min', 'max')
+
+NUMERIC_CONVERTERS = (cnvs.Integer, cnvs.Float, cnvs.Decimal)
+
+
+def get_field_converter(converter, path):
+    for segment in path:
+        while isinstance(converter, cnvs.List):
+            converter = converter.converter
+        converter = converter.schema[segment]['converter']
+    return converter
+
+
 class ImportParamsProcessor(ImportExportData):
     READ_KEYS = {
         'parameters': 'request/meta/params',
@@ -150,12 +178,18 @@ class ImportParamsProcessor(ImportExportData):
         'imported_ordering': 'imported/ordering',
         'imported_search': 'imported/search',
         'imported_pagination': 'imported/pagination',
+        'imported_expand': 'imported/expand',
+        'imported_fields': 'imported/fields',
+        'imported_group_by': 'imported/group_by',
+        'imported_aggregates': 'imported/aggregates',
+        'imported_since': 'imported/since',
     }
 
     def __init__(self, collection_loc, action_name, filter_compat,
-                 ordering_compat, **kwargs):
+                 ordering_compat, default_fields, **kwargs):
         self.filter_compat = bool(filter_compat)
         self.ordering_compat = bool(ordering_compat)
+        self.default_fields = default_fields
         ImportExportData.__init__(self, collection_loc, action_name, **kwargs)
 
     def process_filters(self, filters, can_read_fields, compat):
@@ -199,6 +233,86 @@ class ImportParamsProcessor(ImportExportData):
             results.append((path, reverse))
         return results
 
+    def process_expand(self, expand_param, can_read_fields):
+        results = []
+        for expansion in expand_param.split(','):
+            path = expansion.split('.')
+            if not docular.doc_get(can_read_fields, path[:1]):
+                raise AccessDeniedError(
+                    "You do not have permission to expand this field")
+            results.append(path)
+        return results
+
+    def process_fields(self, fields_param, can_read_fields, strict=True):
+        """
+        Narrow the readable fields to the ones selected by `fields_param`,
+        a comma-separated list of dotted paths, e.g. `id,user.username`.
+        A selected struct or subcollection includes all its readable fields.
+
+        Selecting a field that cannot be read is denied, unless not
+        `strict`, in which case it is skipped.
+        """
+        paths = sorted(tuple(field.split('.'))
+                       for field in fields_param.split(','))
+        selected = {}
+        prev = None
+        for path in paths:
+            if prev is not None and path[:len(prev)] == prev:
+                continue
+            subfields = docular.doc_get(can_read_fields, path)
+            if not subfields:
+                if not strict:
+                    continue
+                raise AccessDeniedError(
+                    "You do not have permission to read field '%s'" %
+                    '.'.join(path))
+            docular.doc_set(selected, path, subfields)
+            prev = path
+        return selected
+
+    def process_group_by(self, group_by_param, can_read_fields):
+        results = []
+        for field in group_by_param.split(','):
+            path = field.split('.')
+            if not docular.doc_get(can_read_fields, path):
+                raise AccessDeniedError(
+                    "You do not have permission to group by this field")
+            results.append(path)
+        return results
+
+    def process_aggregates(self, aggregate_param, can_read_fields):
+        """
+        Parse a comma-separated list of aggregates, each either `count` or
+        a function and a dotted field path, e.g. `count,sum:members.age`.
+        """
+        results = []
+        for aggregate in aggregate_param.split(','):
+            function, _, field = aggregate.partition(':')
+            if function not in AGGREGATE_FUNCTIONS:
+                raise ValidationError(
+                    "Unknown aggregate function '%s'" % function)
+            if function == 'count':
+                if field:
+                    raise ValidationError("'count' takes no field")
+                results.append((function, None))
+                continue
+
+            if not field:
+                raise ValidationError(
+                    "Aggregate function '%s' requires a field" % function)
+            path = field.split('.')
+            if not docular.doc_get(can_read_fields, path):
+                raise AccessDeniedError(
+                    "You do not have permission to aggregate this field")
+            if function in ('sum', 'avg'):
+                converter = get_field_converter(self.converter, path)
+                if not isinstance(converter, NUMERIC_CONVERTERS):
+                    raise ValidationError(
+                        "Cannot compute '%s' of field '%s'" % (
+                            function, field))
+            results.append((function, path))
+        return results
+
     def process_search(self, search_value):
         return cnvs.String().import_data(search_value, permissions=True)
 
@@ -209,15 +323,40 @@ class ImportParamsProcessor(ImportExportData):
         search = None
         pagination_offset = None
         pagination_limit = None
+        expand = None
+        fields = None
+        group_by = None
+        aggregates = None
+        since = None
         for param, value in parameters.iteritems():
             if param == 'ordering':
                 ordering = value
                 continue
 
+            if param == 'group_by':
+                group_by = value
+                continue
+
+            if param == 'aggregate':
+                aggregates = value
+                continue
+
+            if param == 'fields':
+                fields = value
+                continue
+
+            if param == 'expand':
+                expand = value
+                continue
+
             if param == 'search':
                 search = value
                 continue
 
+            if param == 'since':
+                since = value
+                continue
+
             if param == 'offset':
                 pagination_offset = import_integer(value)
                 continue
@@ -252,6 +391,24 @@ class ImportParamsProcessor(ImportExportData):
         if pagination_offset is not None or pagination_limit is not None:
             result['imported_pagination'] = (
                 pagination_offset, pagination_limit)
+        if expand:
+            result['imported_expand'] = self.process_expand(
+                expand, read_fields)
+        if fields:
+            result['imported_fields'] = self.process_fields(
+                fields, read_fields)
+        elif self.default_fields:
+            # The default profile is narrowed to what the role may read.
+            result['imported_fields'] = self.process_fields(
+                self.default_fields, read_fields, strict=False)
+        if group_by:
+            result['imported_group_by'] = self.process_group_by(
+                group_by, read_fields)
+        if aggregates:
+            result['imported_aggregates'] = self.process_aggregates(
+                aggregates, read_fields)
+        if since:
+            result['imported_since'] = self.process_search(since)
 
         return result
 
@@ -274,6 +431,10 @@ class ImportWriteDataProcessor(ImportExportData):
         'imported_content': 'imported/content',
     }
 
+    def __init__(self, collection_loc, action_name, bulk_create, **kwargs):
+        self.bulk_create = bool(bulk_create)
+        ImportExportData.__init__(self, collection_loc, action_name, **kwargs)
+
     def process_write_data(self, context_data):
         write_data = context_data['write_data']
         can_write = context_data['can_write']
@@ -282,6 +443,9 @@ class ImportWriteDataProcessor(ImportExportData):
                 'You do not have permission to write to this resource')
 
         can_write_fields = context_data['write_fields']
+        if self.bulk_create and isinstance(write_data, list):
+            return [self.converter.import_data(elem, can_write_fields)
+                    for elem in write_data]
         return self.converter.import_data(write_data, can_write_fields)
 
     def execute(self, context_data):
@@ -301,6 +465,7 @@ class ExportDataProcessor(ImportExportData):
         'meta': 'exportable/meta',
         'can_read': 'permissions/read/enabled',
         'read_fields': 'permissions/read/fields',
+        'selected_fields': 'imported/fields',
     }
 
     WRITE_KEYS = (
@@ -312,7 +477,18 @@ class ExportDataProcessor(ImportExportData):
         if export_data is None:
             return None
         can_read = context_data['can_read']
-        can_read_fields = context_data['read_fields']
+        can_read_fields = context_data['selected_fields']
+        if can_read_fields is None:
+            can_read_fields = context_data['read_fields']
+        if not self.on_collection and isinstance(export_data, list):
+            # resources created in bulk
+            exported_data = [
+                self.converter.export_data(
+                    elem, can_read_fields, toplevel=True)
+                for elem in export_data]
+            return [elem for elem in exported_data
+                    if elem is not cnvs.Nothing]
+
         exported_data = self.converter.export_data(
             export_data, can_read_fields, toplevel=True)
         if exported_data is cnvs.Nothing:
@@ -335,3 +511,62 @@ class ExportDataProcessor(ImportExportData):
 
 ExportData = ProcessorConstruction(
     IMPORTEXPORT_CONSTRUCTORS, ExportDataProcessor)
+
+
+class ExportAggregatesProcessor(ImportExportData):
+    """
+    Processor exporting aggregates of a collection.
+
+    Grouped field values and the `sum`, `min` and `max` aggregates are
+    exported with the converters of their fields; `count` and `avg` are
+    plain numbers.
+    """
+    READ_KEYS = {
+        'aggregates': 'backend/aggregates',
+        'read_fields': 'permissions/read/fields',
+    }
+
+    WRITE_KEYS = (
+        'response/content',
+    )
+
+    def export_fields(self, data, can_read_fields):
+        if not data:
+            return {}
+        permissions = {}
+        for path, _ in docular.doc_iter_leaves(data):
+            docular.doc_set(permissions, path,
+                            docular.doc_get(can_read_fields, path))
+        converter = self.converter
+        if self.on_collection:
+            converter = converter.converter
+        return converter.export_data(
+            data, permissions, single=True, toplevel=True)
+
+    def export_aggregates(self, row, can_read_fields):
+        exported = {'group': self.export_fields(row['group'], can_read_fields)}
+        for function, value in row.iteritems():
+            if function == 'count':
+                exported[function] = value
+            elif function == 'avg':
+                averages = {}
+                for path, avg in docular.doc_iter_leaves(value):
+                    docular.doc_set(averages, path,
+                                    None if avg is None else float(avg))
+                exported[function] = averages
+            elif function != 'group':
+                exported[function] = self.export_fields(
+                    value, can_read_fields)
+        return exported
+
+    def execute(self, context_data):
+        aggregates = context_data['aggregates']
+        if aggregates is None:
+            return None
+        can_read_fields = context_data['read_fields']
+        return ([self.export_aggregates(row, can_read_fields)
+                 for row in aggregates],)
+
+
+ExportAggregates = ProcessorConstruction(
+    IMPORTEXPORT_CONSTRUCTORS, ExportAggregatesProcessor)
@@ -1,3 +1,5 @@
+import threading
+from collections import OrderedDict
 import docular
 from apimas.components import BaseProcessor, ProcessorConstruction
 from apimas import documents as doc
@@ -18,6 +20,13 @@ FIELD_SEPARATOR = '/'
 
 _default_rules = []
 
+# Tabmatch instances are read-only once built; processors with the same
+# rules share one. Only the most recently used are kept, so that the ones
+# of reloaded rules do not pile up.
+TAB_RULES_CACHE_SIZE = 8
+_tab_rules_cache = OrderedDict()
+_tab_rules_lock = threading.Lock()
+
 
 def _is_prefixed(path, prefix=None):
     if prefix is None:
@@ -104,6 +113,7 @@ PERMISSIONS_CONSTRUCTORS = docular.doc_spec_init_constructor_registry(
 class PermissionsProcessor(BaseProcessor):
     READ_KEYS = {
         'role': 'auth/role',
+        'batch': 'request/meta/batch',
     }
 
     WRITE_KEYS = {
@@ -161,10 +171,21 @@ class PermissionsProcessor(BaseProcessor):
         return parsed_rules
 
     def init_tab_rules(self, rules):
+        key = (self.COLUMNS, tuple(tuple(rule) for rule in rules))
+        with _tab_rules_lock:
+            tab_rules = _tab_rules_cache.pop(key, None)
+            if tab_rules is not None:
+                _tab_rules_cache[key] = tab_rules
+                return tab_rules
+
         rules = self._parse_rules(rules)
         tab_rules = Tabmatch(self.COLUMNS)
         tab_rules.update(
             map((lambda x: tab_rules.Row(*x)), rules))
+        with _tab_rules_lock:
+            _tab_rules_cache[key] = tab_rules
+            while len(_tab_rules_cache) > TAB_RULES_CACHE_SIZE:
+                _tab_rules_cache.popitem(last=False)
         return tab_rules
 
     def _get_pattern_set(self, collection, action, role):
@@ -224,15 +245,29 @@ class PermissionsProcessor(BaseProcessor):
             'fields': expanded_fields,
         }
 
+    def get_permissions(self, action_tag, role, batch, context):
+        """
+        Compute the permissions of a role, once per batch of requests.
+        """
+        if batch is None:
+            return self.compute_permissions(
+                self.collection_path, action_tag, role, context)
+
+        key = ('permissions', self, action_tag, role)
+        if key not in batch:
+            batch[key] = self.compute_permissions(
+                self.collection_path, action_tag, role, context)
+        return batch[key]
+
     def process(self, context):
         context_data = self.read(context)
         role = context_data.get('role')
+        batch = context_data.get('batch')
 
         result = {}
         if self.check_read:
-            read_permissions = self.compute_permissions(
-                self.collection_path, self.read_permissions_tag,
-                role, context)
+            read_permissions = self.get_permissions(
+                self.read_permissions_tag, role, batch, context)
 
             if self.strict and not read_permissions['enabled']:
                 raise AccessDeniedError(
@@ -245,9 +280,8 @@ class PermissionsProcessor(BaseProcessor):
                self.write_permissions_tag == self.read_permissions_tag:
                 write_permissions = read_permissions
             else:
-                write_permissions = self.compute_permissions(
-                    self.collection_path, self.write_permissions_tag,
-                    role, context)
+                write_permissions = self.get_permissions(
+                    self.write_permissions_tag, role, batch, context)
 
             if self.strict and not write_permissions['enabled']:
                 raise AccessDeniedError(
@@ -27,6 +27,8 @@ class DataConverter(object):
         noread (bool): `True` if value must not be exported.
         nullable (bool): `True` if value can be None.
     """
+    __slots__ = ('noread', 'nullable')
+
     def __init__(self, noread=False, nullable=False):
         self.noread = noread
         self.nullable = nullable
@@ -76,6 +78,8 @@ class DataConverter(object):
 
 
 class String(DataConverter):
+    __slots__ = ()
+
     def _get_value(self, value):
         valid_types = (str, unicode)
         if not isinstance(value, valid_types):
@@ -92,6 +96,8 @@ class String(DataConverter):
 
 
 class UUID(DataConverter):
+    __slots__ = ()
+
     def get_repr_value(self, value, permissions, single):
         return str(value)
 
@@ -101,6 +107,8 @@ class UUID(DataConverter):
 
 
 class Email(String):
+    __slots__ = ()
+
     # http://bit.ly/RVerWq
     EMAIL_REGEX = re.compile(
         r"(^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$)")
@@ -125,6 +133,8 @@ class Serial(DataConverter):
     Deserialization is not meaningful for serials because the value is
     set automatically.
     """
+    __slots__ = ()
+
     def get_repr_value(self, value, permissions, single):
         if isinstance(value, str) and not value.isdigit():
             raise ValidationError('Field is not an integer')
@@ -150,6 +160,8 @@ class Number(DataConverter):
         >>> field.serialize('10')
         10.0
     """
+    __slots__ = ()
+
     def _get_value(self, value):
         number_type = getattr(self, 'NUMBER_TYPE', None)
         if number_type is None:
@@ -182,14 +194,20 @@ class Integer(Number):
         >>> field.serialize('10')
         10.0
     """
+    __slots__ = ()
+
     NUMBER_TYPE = int
 
 
 class Float(Number):
+    __slots__ = ()
+
     NUMBER_TYPE = float
 
 
 class Decimal(DataConverter):
+    __slots__ = ('decimal_places', 'quantizer')
+
     def __init__(self, decimal_places=None, **kwargs):
         if decimal_places is None:
             raise InvalidInput("'decimal_places' must be set.")
@@ -208,6 +226,8 @@ class Decimal(DataConverter):
 
 
 class Boolean(DataConverter):
+    __slots__ = ()
+
     TRUE_VALUES = {
         'true',
         'True',
@@ -261,6 +281,8 @@ class Date(DataConverter):
         >>> field.serialize(value)
         '1994-09'
     """
+    __slots__ = ('date_format',)
+
     DEFAULT_FORMAT = '%Y-%m-%d'
 
     def __init__(self, date_format=None, **kwargs):
@@ -291,6 +313,8 @@ class Date(DataConverter):
 
 
 class DateTime(Date):
+    __slots__ = ()
+
     DEFAULT_FORMAT = '%Y-%m-%dT%H:%M:%S'
 
 
@@ -315,6 +339,8 @@ class Choices(DataConverter):
         >>> field.serialize('foo')
         'foo_displayed'
     """
+    __slots__ = ('allowed', 'displayed', 'to_native', 'from_native')
+
     ERROR_MESSAGE = 'Given value must be one of [{values!s}]'
 
     def __init__(self, allowed, displayed=None, **kwargs):
@@ -358,6 +384,8 @@ class Identity(DataConverter):
         >>> field.serialize({'pk': 'bar'})
         'api/foo/bar/'
     """
+    __slots__ = ('rel_url', 'parsed_rel_url')
+
     TRAILING_SLASH = '/'
 
     def __init__(self, to, root_url, **kwargs):
@@ -380,6 +408,8 @@ class Identity(DataConverter):
 
 
 class Ref(Identity):
+    __slots__ = ()
+
     def get_native_value(self, value, permissions, single):
         if isinstance(value, numbers.Number):
             return str(value)
@@ -406,6 +436,8 @@ class Ref(Identity):
 
 
 class File(DataConverter):
+    __slots__ = ()
+
     def get_repr_value(self, value, permissions, single):
         return value.name
 
@@ -442,6 +474,7 @@ class Struct(DataConverter):
         >>> field.serialize('foo_mapped': 'x', 'bar_mapped': 10})
         {'foo': 'x', 'bar': 10}
     """
+    __slots__ = ('schema', 'flat')
 
     def __init__(self, schema, flat=False, **kwargs):
         self.schema = schema
@@ -516,6 +549,8 @@ class List(DataConverter):
         >>> field.deserialize(['foo', 'bar'])
         ['foo', 'bar']
     """
+    __slots__ = ('converter',)
+
     def __init__(self, converter, **kwargs):
         self.converter = converter
         super(List, self).__init__(**kwargs)
@@ -535,3 +570,24 @@ class List(DataConverter):
 
     def get_native_value(self, value, permissions, single):
         return self.get_list_elems(value, permissions, single, importing=True)
+
+
+class BoundedList(List):
+    """
+    Serializes a list that may be given bounded, as a dict of its first
+    `results`, the `count` of all its items and the `url` listing them.
+    """
+    __slots__ = ()
+
+    def get_repr_value(self, value, permissions, single):
+        if not isinstance(value, Mapping):
+            return super(BoundedList, self).get_repr_value(
+                value, permissions, single)
+
+        results = super(BoundedList, self).get_repr_value(
+            value['results'], permissions, single)
+        return {
+            'count': value['count'],
+            'url': value['url'],
+            'results': results,
+        }
@@ -29,6 +29,11 @@ class GenericException(Exception):
         return repr(self)
 
 
+class NotModified(GenericException):
+    """A conditional request, e.g. with `If-None-Match`, needs no body."""
+    http_code = 304
+
+
 class ValidationError(GenericException):
     """A runtime user input validation check has failed."""
     http_code = 400
@@ -51,11 +56,31 @@ class NotFound(GenericException):
     http_code = 404
 
 
+class MethodNotAllowed(GenericException):
+    """A resource does not support the requested method."""
+    http_code = 405
+
+
 class ConflictError(GenericException):
     """A runtime request cannot be fulfilled because of conflicting state."""
     http_code = 409
 
 
+class ResyncRequired(GenericException):
+    """A change feed cursor has expired; changes must be read anew."""
+    http_code = 410
+
+
+class PreconditionFailed(GenericException):
+    """A request precondition, e.g. `If-Match`, does not hold."""
+    http_code = 412
+
+
+class PreconditionRequired(GenericException):
+    """A conditional request is required, e.g. with `If-Match`."""
+    http_code = 428
+
+
 class InvalidInput(GenericException):
     """Code was called with invalid arguments."""
     pass
@@ -134,17 +134,20 @@ spec_list = [
         'module_path': 'apimas.components.auth.Authentication',
         ':authenticator': {'.string': {}},
         ':verifier': {'.string': {}},
+        ':auth_cache': {'.string': {}},
     },
 
     {
         '.processor.user_retrieval': {},
         'module_path': 'apimas.components.auth.UserRetrieval',
         ':user_resolver': {'.string': {}},
+        ':auth_cache': {'.string': {}},
     },
 
     {
         '.processor.import_write_data': {},
         'module_path': 'apimas.components.impexp.ImportWriteData',
+        ':bulk_create': {'.boolean': {}},
     },
 
     {
@@ -152,6 +155,7 @@ spec_list = [
         'module_path': 'apimas.components.impexp.ImportParams',
         ':filter_compat': {'.boolean': {}},
         ':ordering_compat': {'.boolean': {}},
+        ':default_fields': {'.string': {}},
     },
 
     {
@@ -159,6 +163,11 @@ spec_list = [
         'module_path': 'apimas.components.impexp.ExportData',
     },
 
+    {
+        '.processor.export_aggregates': {},
+        'module_path': 'apimas.components.impexp.ExportAggregates',
+    },
+
 ]
 
 PREDICATES = {}
@@ -0,0 +1,69 @@
+"""Benchmark docular traversal against the original implementations.
+
+Usage: python benchmarks/bench_doc.py [nr_docs] [nr_nodes]
+"""
+import os
+import sys
+import timeit
+
+from docular import (
+    doc_iter, doc_locate, doc_get, doc_set, doc_compile_get,
+    doc_compile_set, random_doc)
+
+# the original implementations are kept as references in the tests
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'docular', 'tests'))
+from test_unit_docular import reference_doc_iter, reference_doc_locate
+
+
+def reference_doc_get(doc, path):
+    feed, trail, nodes = reference_doc_locate(doc, path)
+    return None if feed else nodes[-1]
+
+
+def bench(name, func, number):
+    seconds = min(timeit.repeat(func, number=number, repeat=3))
+    print '%-40s %10.3f ms' % (name, seconds * 1000)
+    return seconds
+
+
+def main(nr_docs=20, nr_nodes=512):
+    docs = [random_doc(nr_nodes=nr_nodes, max_depth=12)
+            for _ in xrange(nr_docs)]
+    paths = [(doc, path) for doc in docs for path, _ in doc_iter(doc)]
+
+    def iter_with(func, **kwargs):
+        return lambda: [list(func(doc, **kwargs)) for doc in docs]
+
+    for kwargs in [{}, {'preorder': True}, {'ordered': True}]:
+        label = ', '.join('%s=%s' % kv for kv in kwargs.items()) or 'default'
+        old = bench('doc_iter recursive (%s)' % label,
+                    iter_with(reference_doc_iter, **kwargs), 10)
+        new = bench('doc_iter iterative (%s)' % label,
+                    iter_with(doc_iter, **kwargs), 10)
+        print '%-40s %10.2fx' % ('speedup', old / new)
+
+    old = bench('doc_locate original',
+                lambda: [reference_doc_locate(d, p) for d, p in paths], 10)
+    new = bench('doc_locate',
+                lambda: [doc_locate(d, p) for d, p in paths], 10)
+    print '%-40s %10.2fx' % ('speedup', old / new)
+
+    getters = [(d, doc_compile_get(p)) for d, p in paths]
+    old = bench('doc_get original',
+                lambda: [reference_doc_get(d, p) for d, p in paths], 10)
+    bench('doc_get', lambda: [doc_get(d, p) for d, p in paths], 10)
+    new = bench('doc_compile_get (precompiled)',
+                lambda: [get(d) for d, get in getters], 10)
+    print '%-40s %10.2fx' % ('speedup', old / new)
+
+    setters = [(d, p, doc_compile_set(p)) for d, p in paths]
+    old = bench('doc_set',
+                lambda: [doc_set(d, p, 'x') for d, p, _ in setters], 10)
+    new = bench('doc_compile_set (precompiled)',
+                lambda: [set_(d, 'x') for d, _, set_ in setters], 10)
+    print '%-40s %10.2fx' % ('speedup', old / new)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -2,6 +2,8 @@ from .doc import (
     doc_locate,
     doc_set,
     doc_get,
+    doc_compile_get,
+    doc_compile_set,
     doc_iter,
     doc_pop,
     doc_merge,
@@ -31,6 +33,8 @@ from .spec import (
     doc_spec_init_constructor_registry,
     doc_spec_config,
     doc_spec_construct,
+    doc_spec_reconstruct,
+    doc_spec_fingerprint,
     doc_construct,
     construct_after,
     construct_last,
@@ -38,6 +42,7 @@ from .spec import (
     MergeFault,
     DeferConstructor,
     SkipConstructor,
+    ConstructionProfile,
 )
 
 from .errors import (
@@ -5,10 +5,12 @@ and construction toolkit.
 
 """
 import re
-from itertools import izip_longest
+from itertools import izip_longest, izip, imap, count
 
 bytes = str
 
+_end = object()
+
 
 def doc_locate(doc, path):
     """Walk a path down a document.
@@ -51,23 +53,24 @@ def doc_locate(doc, path):
             nodes (list):
                 List of nodes already accessed, in order.
     """
-    feed = list(reversed(path))
     trail = []
     nodes = [doc]
-    while feed:
-        segment = feed.pop()
+    segments = iter(path)
+    for segment in segments:
         if not segment:
             continue
 
         if not isinstance(doc, dict) or segment not in doc:
-            feed.append(segment)
-            break
+            feed = [segment]
+            feed.extend(segments)
+            feed.reverse()
+            return feed, trail, nodes
 
         trail.append(segment)
         doc = doc[segment]
         nodes.append(doc)
 
-    return feed, trail, nodes
+    return [], trail, nodes
 
 
 def doc_set(doc, path, value, multival=False):
@@ -111,8 +114,99 @@ def doc_set(doc, path, value, multival=False):
 
 
 def doc_get(doc, path):
-    feed, trail, nodes = doc_locate(doc, path)
-    return None if feed else nodes[-1]
+    for segment in path:
+        if not segment:
+            continue
+        if not isinstance(doc, dict) or segment not in doc:
+            return None
+        doc = doc[segment]
+    return doc
+
+
+def doc_compile_get(path):
+    """Compile a path into a function that gets it from documents.
+
+    The returned function takes a document and behaves as doc_get() with
+    the given path.
+    """
+    segments = tuple(segment for segment in path if segment)
+
+    if not segments:
+        return lambda doc: doc
+
+    if len(segments) == 1:
+        key, = segments
+
+        def get(doc):
+            if not isinstance(doc, dict):
+                return None
+            return doc.get(key)
+        return get
+
+    if len(segments) == 2:
+        key0, key1 = segments
+
+        def get(doc):
+            if not isinstance(doc, dict):
+                return None
+            doc = doc.get(key0)
+            if not isinstance(doc, dict):
+                return None
+            return doc.get(key1)
+        return get
+
+    def get(doc):
+        for segment in segments:
+            if not isinstance(doc, dict) or segment not in doc:
+                return None
+            doc = doc[segment]
+        return doc
+    return get
+
+
+def doc_compile_set(path, multival=False):
+    """Compile a path into a function that sets it in documents.
+
+    The returned function takes a document and a value and behaves as
+    doc_set() with the given path and multival. Paths that pass through
+    existing dicts are handled without allocations; anything else falls
+    back to doc_set().
+    """
+    path = tuple(path)
+    segments = tuple(segment for segment in path if segment)
+    if not segments or len(segments) != len(path):
+        # doc_set() creates empty segments below missing nodes
+        return lambda doc, value: doc_set(doc, path, value,
+                                          multival=multival)
+
+    parent_segments = segments[:-1]
+    last = segments[-1]
+
+    def set_(doc, value):
+        parent = doc
+        for segment in parent_segments:
+            node = parent.get(segment) if isinstance(parent, dict) else None
+            if not isinstance(node, dict):
+                return doc_set(doc, segments, value, multival=multival)
+            parent = node
+
+        if not isinstance(parent, dict):
+            return doc_set(doc, segments, value, multival=multival)
+
+        if last not in parent:
+            parent[last] = value
+            return None
+
+        old_value = parent[last]
+        if not multival:
+            parent[last] = value
+        elif hasattr(old_value, 'append'):
+            old_value.append(value)
+        else:
+            parent[last] = [old_value, value]
+        return old_value
+
+    return set_
 
 
 class elem(long):
@@ -179,8 +273,6 @@ def doc_iter(doc, preorder=None, postorder=None, path=(),
             there will be no chance to send True before the nod
             children are visited.
     """
-    skip = None
-
     if preorder is None:
         if postorder is None:
             postorder = True
@@ -189,40 +281,43 @@ def doc_iter(doc, preorder=None, postorder=None, path=(),
     elif not preorder and postorder is None:
         postorder = True
 
-    if preorder:
-        skip = (yield path, doc)
-
-    if not skip:
-        doc_type = type(doc)
-        if multival and doc_type in (list, tuple, set):
-            for i, val in enumerate(doc):
-                subpath = path + (elem(i),)
-                g = doc_iter(val,
-                             preorder=preorder, postorder=postorder,
-                             path=subpath, multival=multival)
-                try:
-                    skip = None
-                    while True:
-                        skip = yield g.send(skip)
-                except StopIteration:
-                    pass
-
-        elif doc_type is dict:
-            iteritems = sorted(doc.iteritems()) if ordered else doc.iteritems()
-            for key, val in iteritems:
-                subpath = path + (key,)
-                g = doc_iter(val,
-                             preorder=preorder, postorder=postorder,
-                             path=subpath, multival=multival)
-                try:
-                    skip = None
-                    while True:
-                        skip = yield g.send(skip)
-                except StopIteration:
-                    pass
-
-    if postorder:
-        yield path, doc
+    # Explicit stack of (path, node, children) for the nodes being visited,
+    # so that each item is yielded directly instead of through a generator
+    # per ancestor.
+    stack = []
+    stack_append = stack.append
+    stack_pop = stack.pop
+    node_path = path
+    node = doc
+    while True:
+        skip = None
+        if preorder:
+            skip = (yield node_path, node)
+
+        children = None
+        if not skip:
+            node_type = type(node)
+            if multival and node_type in (list, tuple, set):
+                children = izip(imap(elem, count()), node)
+            elif node_type is dict:
+                children = (iter(sorted(node.iteritems())) if ordered
+                            else node.iteritems())
+
+        stack_append((node_path, node, children))
+
+        while stack:
+            node_path, node, children = stack[-1]
+            if children is not None:
+                child = next(children, _end)
+                if child is not _end:
+                    key, node = child
+                    node_path += (key,)
+                    break
+            stack_pop()
+            if postorder:
+                yield node_path, node
+        else:
+            return
 
 
 def doc_pop(doc, path):
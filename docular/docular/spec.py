@@ -9,6 +9,9 @@ from collections import Sequence, MutableMapping, defaultdict
 from copy import deepcopy
 from types import FunctionType
 from bisect import insort, bisect_right
+from hashlib import sha1
+from time import time
+from threading import local
 
 from errors import (
     collect_error,
@@ -467,7 +470,62 @@ def doc_spec_config(spec, config_spec, predicates,
 
 
 def doc_spec_construct(spec_instance, predicates, constructors,
-                       top_spec=None, config=(), loc=()):
+                       top_spec=None, config=(), loc=(), track=False):
+    """Construct a configured spec instance in place.
+
+    Subdocuments are constructed first, then the constructors of the
+    predicates of each node are called.
+
+    If track is true, each constructed node records under '=h' a fingerprint
+    of its source subtree and of the inherited configuration keys it uses,
+    so that a later doc_spec_reconstruct() can skip unchanged subtrees.
+    """
+    digests = {} if track else None
+    doc_spec_construct_instance(None, spec_instance, predicates, constructors,
+                                top_spec, config, loc, digests, None)
+
+
+def doc_spec_reconstruct(old_instance, spec_instance, predicates,
+                         constructors, top_spec=None, config=(), loc=()):
+    """Construct a spec instance, reusing unchanged parts of an old one.
+
+    old_instance must have been constructed with tracking enabled.
+    A subtree of spec_instance whose fingerprint matches the one recorded in
+    the corresponding node of old_instance is not constructed; the old
+    constructed node is placed in the new instance instead. All other nodes,
+    including the ancestors of changed nodes, are constructed as usual.
+
+    Constructors that read other parts of the document through top_spec are
+    not tracked; their nodes are only reconstructed if their own subtree or
+    configuration changed.
+
+    Returns:
+        tuple of (instance, reconstructed):
+            instance (dict):
+                The constructed instance. It is old_instance itself
+                if nothing changed, otherwise spec_instance.
+            reconstructed (list):
+                The locations of the nodes whose constructors were called,
+                in construction order.
+    """
+    reconstructed = []
+    instance = doc_spec_construct_instance(
+        old_instance, spec_instance, predicates, constructors,
+        top_spec, config, loc, {}, reconstructed)
+    return instance, reconstructed
+
+
+def doc_spec_construct_instance(old_instance, spec_instance,
+                                predicates, constructors,
+                                top_spec, config, loc,
+                                digests, reconstructed):
+
+    if digests is not None:
+        fingerprint = doc_spec_fingerprint(spec_instance, config, digests)
+        if old_instance is not None and \
+           old_instance.get('=h') == fingerprint:
+            return old_instance
+        spec_instance['=h'] = fingerprint
 
     if top_spec is None:
         top_spec = spec_instance
@@ -509,11 +567,16 @@ def doc_spec_construct(spec_instance, predicates, constructors,
 
     for key in construct_keys:
         subspec = spec_instance[key]
+        old_subinstance = None
+        if old_instance is not None:
+            old_subinstance = old_instance.get(key)
+            if not isinstance(old_subinstance, MutableMapping):
+                old_subinstance = None
         try:
-            doc_spec_construct(subspec, predicates, constructors,
-                               top_spec=top_spec,
-                               config=new_config,
-                               loc=loc + (key,))
+            spec_instance[key] = doc_spec_construct_instance(
+                old_subinstance, subspec, predicates, constructors,
+                top_spec, new_config, loc + (key,),
+                digests, reconstructed)
         except Error as e:
             collect_error(errs, e)
 
@@ -528,6 +591,68 @@ def doc_spec_construct(spec_instance, predicates, constructors,
         m = "Construction failed in constructors"
         raise Error(loc=loc, errs=errs, message=m)
 
+    if reconstructed is not None:
+        reconstructed.append(loc)
+
+    return spec_instance
+
+
+def doc_spec_digest(spec, digests):
+    """Digest a spec subtree.
+
+    Returns:
+        tuple of (digest, config_keys):
+            digest (str):
+                A digest of the values and keys of the subtree,
+                in merge order.
+            config_keys (frozenset):
+                The configuration (':'-prefixed) keys found in the subtree.
+    """
+    if not isinstance(spec, MutableMapping) or not spec:
+        return sha1(repr(spec)).hexdigest(), frozenset()
+
+    node_id = id(spec)
+    if node_id in digests:
+        return digests[node_id][1:]
+
+    h = sha1(repr(spec.get('=', Null)))
+    config_keys = set()
+    for key in doc_spec_get_source_keys(spec):
+        if key[:1] == ':':
+            config_keys.add(key)
+        subdigest, subconfig_keys = doc_spec_digest(spec[key], digests)
+        config_keys.update(subconfig_keys)
+        h.update(key)
+        h.update(subdigest)
+
+    result = (h.hexdigest(), frozenset(config_keys))
+    # keep the node alive so that its id is not reused while memoized
+    digests[node_id] = (spec,) + result
+    return result
+
+
+def doc_spec_fingerprint(spec, config=(), digests=None):
+    """Fingerprint a spec subtree together with the configuration it uses.
+
+    Only the keys of config that appear in the subtree are taken into
+    account, so that a node does not change when unrelated configuration
+    changes.
+    """
+    if digests is None:
+        digests = {}
+
+    digest, config_keys = doc_spec_digest(spec, digests)
+    h = sha1(digest)
+    for key in sorted(config_keys):
+        if key not in config:
+            continue
+        # configuration nodes are short-lived, do not memoize them
+        config_digest, _ = doc_spec_digest(config[key], {})
+        h.update(key)
+        h.update(config_digest)
+
+    return h.hexdigest()
+
 
 def doc_construct(spec, config, predicates, constructors,
                   merge=None):
@@ -540,6 +665,90 @@ def doc_construct(spec, config, predicates, constructors,
     return spec_instance
 
 
+# Profiles are active per thread, so that constructions running in other
+# threads, e.g. lazy ones, are not recorded in them.
+_construction_profiles = local()
+
+
+def _active_profiles():
+    profiles = getattr(_construction_profiles, 'stack', None)
+    if profiles is None:
+        profiles = _construction_profiles.stack = []
+    return profiles
+
+
+class ConstructionProfile(object):
+    """Collect statistics of the constructions run while active.
+
+    Use as a context manager around doc_spec_construct() calls; only the
+    constructions of the thread that entered it are recorded.
+    Constructor registries are reported by the name given with
+    name_registry(), or else by their id.
+
+    Attributes:
+        constructors (dict):
+            (registry name, predicate) -> [calls, deferrals, seconds]
+        nodes (int):
+            The number of nodes whose constructors were called.
+        rounds (int):
+            The total number of deferral rounds over all nodes.
+        max_rounds (int):
+            The maximum number of deferral rounds of a single node.
+    """
+
+    def __init__(self):
+        self.registry_names = {}
+        self.constructors = {}
+        self.nodes = 0
+        self.rounds = 0
+        self.max_rounds = 0
+
+    def name_registry(self, constructors, name):
+        self.registry_names[id(constructors)] = name
+
+    def registry_name(self, constructors):
+        registry_id = id(constructors)
+        return self.registry_names.get(registry_id,
+                                       'registry-%x' % registry_id)
+
+    def call_constructor(self, constructors, predicate, constructor,
+                         context):
+        key = (self.registry_name(constructors), predicate)
+        stats = self.constructors.get(key)
+        if stats is None:
+            stats = self.constructors[key] = [0, 0, 0.0]
+
+        started = time()
+        try:
+            constructor(context=context)
+        except DeferConstructor:
+            stats[1] += 1
+            raise
+        finally:
+            stats[0] += 1
+            stats[2] += time() - started
+
+    def record_node(self, rounds):
+        self.nodes += 1
+        self.rounds += rounds
+        if rounds > self.max_rounds:
+            self.max_rounds = rounds
+
+    def registry_times(self):
+        times = defaultdict(float)
+        for (registry, predicate), (_, _, seconds) in \
+                self.constructors.iteritems():
+            times[registry] += seconds
+        return dict(times)
+
+    def __enter__(self):
+        _active_profiles().append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _active_profiles().remove(self)
+
+
 def doc_spec_call_constructors(instance, predicates, constructors,
                                config, errs, loc, top_spec):
 
@@ -570,6 +779,9 @@ def doc_spec_call_constructors(instance, predicates, constructors,
         'context': None,
     }
 
+    profiles = _active_profiles()
+    profile = profiles[-1] if profiles else None
+
     skipped_predicates = []
     old_deferred_predicates = None
     while True:
@@ -587,7 +799,11 @@ def doc_spec_call_constructors(instance, predicates, constructors,
             context['predicate'] = predicate
 
             try:
-                constructor(context=context)
+                if profile is None:
+                    constructor(context=context)
+                else:
+                    profile.call_constructor(constructors, predicate,
+                                             constructor, context)
                 context['constructed'].add(predicate)
             except SkipConstructor:
                 skipped_predicates.append(predicate)
@@ -610,6 +826,9 @@ def doc_spec_call_constructors(instance, predicates, constructors,
         working_predicates = deferred_predicates
         context['round'] += 1
 
+    if profile is not None:
+        profile.record_node(context['round'])
+
     return skipped_predicates
 
 
@@ -2,6 +2,8 @@ from docular import (
     doc_locate,
     doc_set,
     doc_get,
+    doc_compile_get,
+    doc_compile_set,
     doc_iter,
     doc_pop,
     doc_merge,
@@ -25,9 +27,11 @@ from docular import (
     doc_spec_register_constructor,
     doc_spec_config,
     doc_spec_construct,
+    doc_spec_reconstruct,
     doc_construct,
     construct_after,
     construct_last,
+    ConstructionProfile,
     report_errors,
 )
 
@@ -40,6 +44,7 @@ from docular import (
 
 
 from copy import deepcopy
+import threading
 
 
 doc = {
@@ -176,6 +181,127 @@ def test_doc_iter():
     assert path_and_nodes == []
 
 
+def reference_doc_iter(doc, preorder=None, postorder=None, path=(),
+                       ordered=False, multival=False):
+    # the original recursive implementation
+    from docular.doc import elem
+    skip = None
+
+    if preorder is None:
+        if postorder is None:
+            postorder = True
+        elif not postorder:
+            preorder = True
+    elif not preorder and postorder is None:
+        postorder = True
+
+    if preorder:
+        skip = (yield path, doc)
+
+    if not skip:
+        doc_type = type(doc)
+        if multival and doc_type in (list, tuple, set):
+            items = [(elem(i), val) for i, val in enumerate(doc)]
+        elif doc_type is dict:
+            items = sorted(doc.iteritems()) if ordered else doc.iteritems()
+        else:
+            items = ()
+        for key, val in items:
+            g = reference_doc_iter(val, preorder=preorder,
+                                   postorder=postorder, path=path + (key,),
+                                   ordered=ordered, multival=multival)
+            try:
+                skip = None
+                while True:
+                    skip = yield g.send(skip)
+            except StopIteration:
+                pass
+
+    if postorder:
+        yield path, doc
+
+
+def drive_doc_iter(g, skip_depth):
+    # send skip to every preorder visit at skip_depth
+    results = []
+    seen = set()
+    try:
+        item = next(g)
+        while True:
+            results.append(item)
+            path = item[0]
+            skip = None
+            if len(path) == skip_depth and path not in seen:
+                seen.add(path)
+                skip = True
+            item = g.send(skip)
+    except StopIteration:
+        pass
+    return results
+
+
+def test_doc_iter_equivalence():
+    for _ in xrange(5):
+        doc = random_doc(nr_nodes=64)
+        doc['list'] = [1, {'a': [2, 3]}, (4,)]
+        for preorder, postorder in [(None, None), (True, False),
+                                    (False, True), (True, True)]:
+            for ordered in (False, True):
+                for multival in (False, True):
+                    kwargs = dict(preorder=preorder, postorder=postorder,
+                                  ordered=ordered, multival=multival)
+                    expected = list(reference_doc_iter(doc, **kwargs))
+                    assert list(doc_iter(doc, **kwargs)) == expected
+                    assert list(doc_iter(doc, path=('x',), **kwargs)) == \
+                        list(reference_doc_iter(doc, path=('x',), **kwargs))
+
+                    expected = drive_doc_iter(
+                        reference_doc_iter(doc, **kwargs), 2)
+                    assert drive_doc_iter(doc_iter(doc, **kwargs), 2) == \
+                        expected
+
+
+def test_doc_compiled_paths():
+    for _ in xrange(5):
+        doc = random_doc()
+        paths = [path for path, _ in doc_iter(doc)]
+        paths += [path + ('missing',) for path in paths]
+        paths += [('missing', 'x'), (), ('alpha', '', 'beta')]
+        assert doc_compile_get(('',))(doc) is doc
+
+        for path in paths:
+            assert doc_compile_get(path)(doc) == doc_get(doc, path)
+            assert doc_locate(doc, path) == reference_doc_locate(doc, path)
+
+            for multival in (False, True):
+                expected_doc = deepcopy(doc)
+                compiled_doc = deepcopy(doc)
+                expected = doc_set(expected_doc, path, 'new', multival)
+                setter = doc_compile_set(path, multival=multival)
+                assert setter(compiled_doc, 'new') == expected
+                assert compiled_doc == expected_doc
+
+
+def reference_doc_locate(doc, path):
+    feed = list(reversed(path))
+    trail = []
+    nodes = [doc]
+    while feed:
+        segment = feed.pop()
+        if not segment:
+            continue
+
+        if not isinstance(doc, dict) or segment not in doc:
+            feed.append(segment)
+            break
+
+        trail.append(segment)
+        doc = doc[segment]
+        nodes.append(doc)
+
+    return feed, trail, nodes
+
+
 def test_doc_pop():
     new_doc = deepcopy(doc)
     val = doc_pop(new_doc, ('a', 'b', 'c'))
@@ -1290,6 +1416,68 @@ def test_doc_spec_construct():
     assert instance == expected_instance
 
 
+def test_doc_spec_reconstruct():
+    call_log = []
+
+    def integer_constructor(instance, config, loc):
+        call_log.append(loc)
+        base = config.get(':base', {}).get('=', 10)
+        instance['='] = int(instance['='], int(base))
+
+    instance_spec = {
+        ':base': {},
+        'a': {
+            '.integer': {},
+        },
+        'b': {
+            '.integer': {},
+            ':base': {},
+        },
+    }
+
+    predicates = {}
+    constructors = {}
+
+    doc_spec_register_predicate(predicates, '.integer', {'.integer': {}})
+    doc_spec_register_constructor(constructors, '.integer',
+                                  integer_constructor)
+    doc_compile_spec(instance_spec, predicates)
+
+    def configure(a, b, base):
+        config = doc_compile_spec({':base': base, 'a': a, 'b': b},
+                                  predicates)
+        return doc_spec_config(deepcopy(instance_spec), config, predicates)
+
+    instance = configure('11', '11', '10')
+    doc_spec_construct(instance, predicates, constructors, track=True)
+    assert instance['a']['='] == 11
+    assert instance['b']['='] == 11
+    assert sorted(call_log) == [('a',), ('b',)]
+    old_a = instance['a']
+
+    del call_log[:]
+    same, reconstructed = doc_spec_reconstruct(
+        instance, configure('11', '11', '10'), predicates, constructors)
+    assert same is instance
+    assert reconstructed == []
+    assert call_log == []
+
+    new, reconstructed = doc_spec_reconstruct(
+        instance, configure('11', '11', '16'), predicates, constructors)
+    assert sorted(reconstructed) == [(), (':base',), ('b',)]
+    assert call_log == [('b',)]
+    assert new['a'] is old_a
+    assert new['b']['='] == 17
+
+    del call_log[:]
+    newer, reconstructed = doc_spec_reconstruct(
+        new, configure('12', '11', '16'), predicates, constructors)
+    assert sorted(reconstructed) == [(), ('a',)]
+    assert call_log == [('a',)]
+    assert newer['a']['='] == 12
+    assert newer['b'] is new['b']
+
+
 def test_doc_construct():
     integer_spec = {
         '.integer': {},
@@ -1376,6 +1564,50 @@ def test_constructor_order():
     assert call_log == expected_call_log
 
 
+def test_construction_profile():
+    def first_constructor(context):
+        pass
+
+    def second_constructor(context):
+        construct_after(context, '.one')
+
+    spec_source = {
+        '=keys': ['.two', '.one'],
+        '.one': {},
+        '.two': {},
+    }
+
+    predicates = {}
+    constructors = {}
+
+    spec = doc_compile_spec(spec_source, predicates)
+    doc_spec_register_constructor(constructors, '.one', first_constructor)
+    doc_spec_register_constructor(constructors, '.two', second_constructor)
+
+    with ConstructionProfile() as profile:
+        profile.name_registry(constructors, 'test')
+        doc_spec_construct(spec, predicates, constructors)
+
+    assert profile.nodes == 1
+    assert profile.rounds == 1
+    assert profile.max_rounds == 1
+    calls = {k: v[:2] for k, v in profile.constructors.iteritems()}
+    assert calls == {
+        ('test', '.one'): [1, 0],
+        ('test', '.two'): [2, 1],
+    }
+    assert profile.registry_times().keys() == ['test']
+
+    # constructions of other threads are not recorded
+    thread = threading.Thread(target=doc_spec_construct,
+                              args=(spec, predicates, constructors))
+    with ConstructionProfile() as profile:
+        thread.start()
+        thread.join()
+    assert profile.nodes == 0
+    assert profile.constructors == {}
+
+
 def test_non_shared_meta():
     from docular.spec import doc_spec_registry_verify_non_shared_meta
     spec_source = {